@@ -1,9 +1,62 @@
 import os
 import base64
 import io
+import json
+import mmap
+import sys
+import threading
+import time
+import zipfile
+from array import array
+from collections.abc import Sequence
 from PIL import Image
 from concurrent.futures import ThreadPoolExecutor
 import math
+import operator
+import subprocess
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from PIL import features as _pil_features
+    WEBP_SUPPORTED = bool(_pil_features.check("webp"))
+except Exception:
+    WEBP_SUPPORTED = False
+
+def encode_thumbnail_variants(img, base_size=128, variant_sizes=()):
+    """Encode one decoded image as the base JPEG thumbnail (skipped when base_size is 0) plus larger WebP (JPEG if unsupported) variants."""
+    fmt = "WEBP" if WEBP_SUPPORTED else "JPEG"
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    variants = {}
+    for size in sorted(variant_sizes):
+        if max(img.size) < size:
+            break
+        v = img.copy()
+        v.thumbnail((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        v.save(buffer, format=fmt, quality=75 if fmt == "WEBP" else 80)
+        variants[f"{fmt.lower()}{size}"] = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    if not base_size:
+        return None, variants
+    base = img.copy()
+    base.thumbnail((base_size, base_size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    base.save(buffer, format="JPEG", quality=80)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8'), variants
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
 
 if os.name == 'nt':
     import ctypes
@@ -43,6 +96,10 @@ if os.name == 'nt':
     DeleteObject.restype = wintypes.BOOL
 
     def get_thumbnail_as_base64(file_path, size=128):
+        thumb, _, path = get_thumbnail_variants(file_path, size)
+        return thumb, path
+
+    def get_thumbnail_variants(file_path, size=128, variant_sizes=(), defer_variants=False):
         hbitmap_handle = 0
         bmp_copy = None
         factory_ptr = None
@@ -59,40 +116,42 @@ if os.name == 'nt':
             if hr == 0 and ppv.value:
                 factory_ptr = ctypes.cast(ppv, ctypes.POINTER(IShellItemImageFactory))
 
-                size_struct = SIZE(size, size)
+                decode_size = max((size,) + tuple(variant_sizes))
+                size_struct = SIZE(decode_size, decode_size)
                 hbitmap_handle = factory_ptr.GetImage(size_struct, SIIGBF_THUMBNAILONLY)
                 if hbitmap_handle:
                     try:
                         bitmap_info = BITMAP()
-                        if GetObjectW(hbitmap_handle, ctypes.sizeof(bitmap_info), ctypes.byref(bitmap_info)) == 0: return None, file_path
+                        if GetObjectW(hbitmap_handle, ctypes.sizeof(bitmap_info), ctypes.byref(bitmap_info)) == 0: return None, {}, file_path
                         bmp = Image.frombuffer('RGB', (bitmap_info.bmWidth, bitmap_info.bmHeight), ctypes.string_at(bitmap_info.bmBits, bitmap_info.bmWidthBytes * bitmap_info.bmHeight), 'raw', 'BGRX', bitmap_info.bmWidthBytes, -1)
                         bmp_copy = bmp.transpose(Image.FLIP_TOP_BOTTOM)
                     finally:
                         DeleteObject(hbitmap_handle)
         except comtypes.COMError:
-            return None, file_path
+            return None, {}, file_path
         except Exception as e:
             print(f"Error extracting native thumbnail for {os.path.basename(file_path)}: {e}")
-            return None, file_path
+            return None, {}, file_path
         finally:
             if factory_ptr:
                 del factory_ptr
 
         if bmp_copy:
             try:
-                buffer = io.BytesIO()
-                bmp_copy.save(buffer, format="JPEG", quality=80)
-                return base64.b64encode(buffer.getvalue()).decode('utf-8'), file_path
+                if defer_variants:
+                    return encode_thumbnail_variants(bmp_copy, size)[0], bmp_copy, file_path
+                thumb, variants = encode_thumbnail_variants(bmp_copy, size, variant_sizes)
+                return thumb, variants, file_path
             except Exception as e:
                 print(f"Failed to convert or save image for '{os.path.basename(file_path)}': {e}")
-        return None, file_path
+        return None, {}, file_path
 
-    def process_thumbnail_chunk(file_paths_chunk):
+    def process_thumbnail_chunk(file_paths_chunk, variant_sizes=(), defer_variants=False):
         comtypes.CoInitialize()
         results = []
         try:
             for file_path in file_paths_chunk:
-                results.append(get_thumbnail_as_base64(file_path))
+                results.append(get_thumbnail_variants(file_path, variant_sizes=variant_sizes, defer_variants=defer_variants))
         finally:
             comtypes.CoUninitialize()
         return results
@@ -100,10 +159,17 @@ if os.name == 'nt':
 else:
     def get_thumbnail_as_base64(file_path, size=256):
         return None, file_path
-    def process_thumbnail_chunk(file_paths_chunk):
-        return [get_thumbnail_as_base64(path) for path in file_paths_chunk]
+    def get_thumbnail_variants(file_path, size=256, variant_sizes=(), defer_variants=False):
+        return None, {}, file_path
+    def process_thumbnail_chunk(file_paths_chunk, variant_sizes=(), defer_variants=False):
+        return [get_thumbnail_variants(path, variant_sizes=variant_sizes, defer_variants=defer_variants) for path in file_paths_chunk]
 
-def get_thumbnails_in_batch_windows(file_paths):
+def get_thumbnails_in_batch_windows(file_paths, variant_sizes=(), defer_variants=False):
+    """Returns {path: (base_jpeg_b64, {variant_name: b64})}; variants are only produced when variant_sizes is given.
+
+    With defer_variants the image is still decoded large enough for variant_sizes, but only the base is encoded and the
+    second item is the decoded image, for encode_thumbnail_variants(img, 0, variant_sizes) to encode the variants later.
+    """
     if not file_paths or os.name != 'nt':
         return {}
     
@@ -115,8 +181,715 @@ def get_thumbnails_in_batch_windows(file_paths):
     chunks = [file_paths[i:i + chunk_size] for i in range(0, len(file_paths), chunk_size)]
 
     with ThreadPoolExecutor(max_workers=num_workers) as executor:
-        for chunk_result in executor.map(process_thumbnail_chunk, chunks):
-            for thumbnail, path in chunk_result:
+        for chunk_result in executor.map(lambda c: process_thumbnail_chunk(c, variant_sizes, defer_variants), chunks):
+            for thumbnail, variants, path in chunk_result:
                 if thumbnail:
-                    results[path] = thumbnail
-    return results
\ No newline at end of file
+                    results[path] = (thumbnail, variants)
+    return results
+
+def open_video_decoder(file_path):
+    if cv2 is None:
+        return None, 0
+    try:
+        cap = cv2.VideoCapture(file_path)
+        if not cap.isOpened():
+            cap.release()
+            return None, 0
+        return cap, int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    except Exception as e:
+        print(f"Could not open video decoder for {os.path.basename(file_path)}: {e}")
+        return None, 0
+
+def close_video_decoder(cap):
+    if cap is None:
+        return
+    try:
+        cap.release()
+    except Exception:
+        pass
+
+def read_video_frames(cap, start_frame, count=1, verify_seek=True):
+    """Decode `count` consecutive frames starting at `start_frame`, seeking only when the decoder is not already there.
+
+    A frame-index seek can land elsewhere on VFR or open-GOP files; with `verify_seek`, every frame's timestamp must
+    match its index, and decoding stops at the first one that does not, so the caller can use an exact decoder for the rest.
+    """
+    frames = {}
+    if cap is None or cv2 is None or count <= 0:
+        return frames
+    try:
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != start_frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            if verify_seek and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != start_frame:
+                return frames
+        fps = cap.get(cv2.CAP_PROP_FPS) if verify_seek else 0
+        if verify_seek and not fps:
+            return frames
+        for frame_no in range(start_frame, start_frame + count):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if verify_seek and abs(cap.get(cv2.CAP_PROP_POS_MSEC) - frame_no * 1000.0 / fps) > 500.0 / fps:
+                break
+            frames[frame_no] = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    except Exception as e:
+        print(f"Error decoding frames at {start_frame}: {e}")
+    return frames
+
+def build_video_sprite(file_path, max_tiles=120, tile_size=160, columns=10, quality=70):
+    """Decode a video once and pack downscaled frames (every `step`-th one) into a single JPEG sprite sheet."""
+    cap, frame_count = open_video_decoder(file_path)
+    if cap is None or frame_count <= 0:
+        close_video_decoder(cap)
+        return None, None
+    try:
+        step = max(1, math.ceil(frame_count / max_tiles))
+        tiles = []
+        tile_w = tile_h = 0
+        for frame_no in range(frame_count):
+            if frame_no % step:
+                if not cap.grab():
+                    break
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            if not tiles:
+                w, h = img.size
+                if w >= h:
+                    tile_w, tile_h = tile_size, max(1, round(h * tile_size / w))
+                else:
+                    tile_w, tile_h = max(1, round(w * tile_size / h)), tile_size
+            tiles.append(img.resize((tile_w, tile_h), Image.BILINEAR))
+        if not tiles:
+            return None, None
+        cols = min(columns, len(tiles))
+        rows = math.ceil(len(tiles) / cols)
+        sheet = Image.new("RGB", (cols * tile_w, rows * tile_h))
+        for i, tile in enumerate(tiles):
+            sheet.paste(tile, ((i % cols) * tile_w, (i // cols) * tile_h))
+        buffer = io.BytesIO()
+        sheet.save(buffer, format="JPEG", quality=quality)
+        layout = {"cols": cols, "rows": rows, "tile_w": tile_w, "tile_h": tile_h, "step": step, "tiles": len(tiles), "frames": frame_count}
+        return buffer.getvalue(), layout
+    except Exception as e:
+        print(f"Error building sprite sheet for {os.path.basename(file_path)}: {e}")
+        return None, None
+    finally:
+        close_video_decoder(cap)
+
+def load_mosaic_tile(file_path, cached_b64=None, strip_frames=1, is_video=False, size=128):
+    """A small still for a folder mosaic: a cached thumbnail (or the first frame of a preview strip) when given, else the image itself or a video's first frame."""
+    try:
+        if cached_b64:
+            img = Image.open(io.BytesIO(base64.b64decode(cached_b64)))
+            if strip_frames > 1:
+                img = img.crop((0, 0, img.width // strip_frames, img.height))
+        elif is_video:
+            cap, frame_count = open_video_decoder(file_path)
+            try:
+                img = read_video_frames(cap, 0, 1, verify_seek=False).get(0) if frame_count > 0 else None
+            finally:
+                close_video_decoder(cap)
+            if img is None:
+                return None
+        else:
+            img = Image.open(file_path)
+            img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+        img.thumbnail((size, size))
+        return img
+    except Exception as e:
+        print(f"Could not load mosaic tile for {os.path.basename(file_path)}: {e}")
+        return None
+
+def build_folder_mosaic(tiles, tile_size=64, quality=75):
+    """Pack up to four stills, centre-cropped to squares, into a 2x2 JPEG; returns base64 or None."""
+    tiles = [t for t in tiles if t is not None][:4]
+    if not tiles:
+        return None
+    sheet = Image.new("RGB", (2 * tile_size, 2 * tile_size), (40, 40, 40))
+    for i, img in enumerate(tiles):
+        side = min(img.size)
+        left, top = (img.width - side) // 2, (img.height - side) // 2
+        square = img.crop((left, top, left + side, top + side)).resize((tile_size, tile_size), Image.BILINEAR)
+        sheet.paste(square, ((i % 2) * tile_size, (i // 2) * tile_size))
+    buffer = io.BytesIO()
+    sheet.save(buffer, format="JPEG", quality=quality)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+def get_video_preview_strip_as_base64(file_path, frames=6, size=112, quality=65):
+    """Seek to `frames` evenly spaced positions and pack them, letterboxed to `size` squares, into one horizontal JPEG strip."""
+    cap, frame_count = open_video_decoder(file_path)
+    if cap is None or frame_count <= 0:
+        close_video_decoder(cap)
+        return None, file_path
+    try:
+        strip = Image.new("RGB", (frames * size, size))
+        last_tile = None
+        for i in range(frames):
+            frame_no = min(frame_count - 1, int((i + 0.5) * frame_count / frames))
+            decoded = read_video_frames(cap, frame_no, 1, verify_seek=False).get(frame_no)
+            if decoded is not None:
+                decoded.thumbnail((size, size))
+                last_tile = decoded
+            if last_tile is None:
+                continue
+            strip.paste(last_tile, (i * size + (size - last_tile.width) // 2, (size - last_tile.height) // 2))
+        if last_tile is None:
+            return None, file_path
+        buffer = io.BytesIO()
+        strip.save(buffer, format="JPEG", quality=quality)
+        return base64.b64encode(buffer.getvalue()).decode('utf-8'), file_path
+    except Exception as e:
+        print(f"Error building preview strip for {os.path.basename(file_path)}: {e}")
+        return None, file_path
+    finally:
+        close_video_decoder(cap)
+
+def get_video_preview_strips_in_batch(file_paths, frames=6, max_workers=None):
+    if not file_paths or cv2 is None:
+        return {}
+    results = {}
+    num_workers = min(max_workers or os.cpu_count() or 1, 8, len(file_paths))
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for preview, path in executor.map(lambda p: get_video_preview_strip_as_base64(p, frames=frames), file_paths):
+            if preview:
+                results[path] = preview
+    return results
+
+def read_embedded_settings(file_path):
+    """Generation settings JSON that Wan2GP embeds in its outputs (image comment / EXIF user comment, video comment tag), or None."""
+    try:
+        raw = None
+        if os.path.splitext(file_path)[1].lower() in (".png", ".jpg", ".jpeg", ".webp"):
+            with Image.open(file_path) as img:
+                raw = img.info.get("comment")
+                if not raw:
+                    raw = img.getexif().get_ifd(0x8769).get(0x9286)
+        else:
+            cmd = ["ffprobe", "-v", "error", "-print_format", "json", "-show_entries", "format_tags", file_path]
+            p = subprocess.run(cmd, capture_output=True, text=True, check=False)
+            if p.returncode == 0 and p.stdout:
+                tags = (json.loads(p.stdout).get("format", {}) or {}).get("tags", {}) or {}
+                raw = next((v for k, v in tags.items() if k.lower() == "comment"), None)
+        if isinstance(raw, bytes):
+            # EXIF user comments start with an 8 byte character code prefix.
+            if raw[:8] == b"UNICODE\0":
+                raw = raw[8:].decode("utf-16", errors="ignore")
+            else:
+                raw = (raw[8:] if raw[:8] in (b"ASCII\0\0\0", b"\0" * 8) else raw).decode("utf-8", errors="ignore")
+            raw = raw.strip("\0")
+        configs = json.loads(raw) if raw else None
+        return configs if isinstance(configs, dict) else None
+    except Exception:
+        return None
+
+def compute_audio_peaks(file_path, buckets=256, duration_s=None, sample_rate=8000, chunk_bytes=1 << 16):
+    """Stream-decode audio through ffmpeg as mono s16 and reduce it to `buckets` (min, max) pairs in [-1, 1]."""
+    if np is None or buckets <= 0:
+        return None
+    # With a known duration each bucket is reduced as soon as it fills; otherwise start from short blocks and, whenever
+    # 2 * buckets of them are held, fold neighbouring pairs and double the block, so memory does not grow with the duration.
+    expected = int(duration_s * sample_rate) if duration_s else 0
+    block = max(1, math.ceil(expected / buckets)) if expected else max(1, sample_rate // 20)
+    cap = 2 * buckets
+    cmd = ["ffmpeg", "-v", "error", "-i", file_path, "-vn", "-ac", "1", "-ar", str(sample_rate), "-f", "s16le", "-"]
+    mins, maxs = [], []
+    count = 0
+    carry = np.empty(0, dtype=np.int16)
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except Exception as e:
+        print(f"Could not start ffmpeg for waveform of {os.path.basename(file_path)}: {e}")
+        return None
+    try:
+        pending = b""
+        while True:
+            chunk = proc.stdout.read(chunk_bytes)
+            if not chunk:
+                break
+            pending += chunk
+            usable = len(pending) - (len(pending) % 2)
+            samples = np.frombuffer(pending[:usable], dtype=np.int16)
+            pending = pending[usable:]
+            samples = np.concatenate((carry, samples)) if carry.size else samples
+            while True:
+                n = min(samples.size // block, cap - count)
+                if n:
+                    frames = samples[:n * block].reshape(n, block)
+                    mins.append(frames.min(axis=1))
+                    maxs.append(frames.max(axis=1))
+                    samples = samples[n * block:]
+                    count += n
+                if count < cap:
+                    break
+                mins = [np.concatenate(mins).reshape(-1, 2).min(axis=1)]
+                maxs = [np.concatenate(maxs).reshape(-1, 2).max(axis=1)]
+                count = buckets
+                block *= 2
+            carry = samples.copy()
+        if carry.size:
+            mins.append(carry.min(keepdims=True))
+            maxs.append(carry.max(keepdims=True))
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    if not mins:
+        return None
+    mins = np.concatenate(mins).astype(np.float32) / 32768.0
+    maxs = np.concatenate(maxs).astype(np.float32) / 32768.0
+    if mins.size != buckets:
+        edges = np.linspace(0, mins.size, buckets + 1).astype(np.int64)
+        edges[1:] = np.maximum(edges[1:], edges[:-1] + 1)
+        edges = np.minimum(edges, mins.size)
+        valid = edges[:-1] < mins.size
+        starts = edges[:-1][valid]
+        mins = np.minimum.reduceat(mins, starts)
+        maxs = np.maximum.reduceat(maxs, starts)
+    return mins, maxs
+
+def render_waveform_as_base64(mins, maxs, width=256, height=128, quality=80):
+    if np is None or mins is None or len(mins) == 0:
+        return None
+    from PIL import ImageDraw
+    img = Image.new("RGB", (width, height), (24, 26, 33))
+    draw = ImageDraw.Draw(img)
+    mid = height / 2
+    xs = np.linspace(0, len(mins), width, endpoint=False).astype(np.int64)
+    peak = max(float(np.max(np.abs(maxs))), float(np.max(np.abs(mins))), 1e-4)
+    for x, i in enumerate(xs):
+        top = mid - (float(maxs[i]) / peak) * (mid - 4)
+        bottom = mid - (float(mins[i]) / peak) * (mid - 4)
+        draw.line([(x, top), (x, max(bottom, top + 1))], fill=(110, 168, 254))
+    draw.line([(0, mid), (width, mid)], fill=(60, 64, 80))
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+class _ZipStreamBuffer:
+    """Write-only, non-seekable sink for zipfile: bytes are handed out with drain() as soon as they are written."""
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+def iter_zip_stream(entries, chunk_size=1 << 20):
+    """Yield a ZIP archive of `entries` [(src_path, arcname, stored)] chunk by chunk, never holding more than one chunk per file."""
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, "w", allowZip64=True) as zf:
+        for src_path, arcname, stored in entries:
+            try:
+                st = os.stat(src_path)
+                zinfo = zipfile.ZipInfo.from_file(src_path, arcname)
+                zinfo.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+                zinfo.file_size = st.st_size
+                with open(src_path, "rb") as src, zf.open(zinfo, "w") as dest:
+                    while True:
+                        block = src.read(chunk_size)
+                        if not block:
+                            break
+                        dest.write(block)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+            except OSError as e:
+                print(f"Could not add '{src_path}' to export: {e}")
+            data = buffer.drain()
+            if data:
+                yield data
+    data = buffer.drain()
+    if data:
+        yield data
+
+def compute_dhash(img, hash_size=8):
+    """Difference hash: compare horizontally adjacent pixels of a (hash_size+1) x hash_size grayscale downscale."""
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (1 if pixels[offset + col] > pixels[offset + col + 1] else 0)
+    return value
+
+def dhash_from_base64(image_b64, tiles=1):
+    try:
+        img = Image.open(io.BytesIO(base64.b64decode(image_b64)))
+        if tiles > 1:
+            tile_w = img.width // tiles
+            middle = tiles // 2
+            img = img.crop((middle * tile_w, 0, (middle + 1) * tile_w, img.height))
+        return compute_dhash(img)
+    except Exception as e:
+        print(f"Could not hash thumbnail: {e}")
+        return None
+
+def dhash_from_file(file_path):
+    try:
+        with Image.open(file_path) as img:
+            img.draft("L", (64, 64))
+            return compute_dhash(img)
+    except Exception as e:
+        print(f"Could not hash {os.path.basename(file_path)}: {e}")
+        return None
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes; radius queries only visit subtrees the triangle inequality allows."""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            dist = hamming_distance(value, node[0])
+            if dist == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, radius):
+        results = []
+        if self.root is None:
+            return results
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            dist = hamming_distance(value, node[0])
+            if dist <= radius:
+                results.extend((item, dist) for item in node[1])
+            for child_dist, child in node[2].items():
+                if dist - radius <= child_dist <= dist + radius:
+                    stack.append(child)
+        return results
+
+class ThumbPackStore:
+    """Append-only blob file addressed by (offset, length) refs and read through a shared mmap."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._fh = None
+        self._mm = None
+
+    def _open(self):
+        if self._fh is None:
+            self._fh = open(self.path, "a+b")
+
+    def _remap(self, min_size):
+        if self._mm is not None and len(self._mm) >= min_size:
+            return self._mm
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._open()
+        self._fh.flush()
+        if os.fstat(self._fh.fileno()).st_size == 0:
+            return None
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def size(self):
+        with self._lock:
+            self._open()
+            self._fh.flush()
+            return os.fstat(self._fh.fileno()).st_size
+
+    def append(self, data):
+        with self._lock:
+            self._open()
+            self._fh.seek(0, os.SEEK_END)
+            offset = self._fh.tell()
+            self._fh.write(data)
+            self._fh.flush()
+            return offset, len(data)
+
+    def read(self, offset, length):
+        with self._lock:
+            mm = self._remap(offset + length)
+            if mm is None or offset + length > len(mm):
+                return None
+            return mm[offset:offset + length]
+
+    def read_many(self, refs):
+        """Read refs in file order so a full warm-up is one forward pass over the pack."""
+        with self._lock:
+            refs = sorted(refs)
+            if not refs:
+                return {}
+            mm = self._remap(0)
+            if mm is None:
+                return {}
+            if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                try:
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                except Exception:
+                    pass
+            return {(off, ln): mm[off:off + ln] for off, ln in refs if off + ln <= len(mm)}
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+class InterProcessLock:
+    """Exclusive lock on a file shared by every server process using the same cache directory; re-entrant within a process."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.RLock()
+        self._depth = 0
+        self._fh = None
+
+    def __enter__(self):
+        self._local.acquire()
+        if self._depth == 0:
+            try:
+                self._fh = open(self.path, "a+b")
+                if os.name == 'nt':
+                    self._fh.seek(0)
+                    delay = 0.01
+                    while True:
+                        try:
+                            msvcrt.locking(self._fh.fileno(), msvcrt.LK_NBLCK, 1)
+                            break
+                        except OSError:
+                            time.sleep(delay)
+                            delay = min(delay * 2, 0.5)
+                else:
+                    fcntl.lockf(self._fh.fileno(), fcntl.LOCK_EX)
+            except Exception:
+                if self._fh is not None:
+                    self._fh.close()
+                    self._fh = None
+                self._local.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        try:
+            if self._depth == 0 and self._fh is not None:
+                try:
+                    if os.name == 'nt':
+                        self._fh.seek(0)
+                        msvcrt.locking(self._fh.fileno(), msvcrt.LK_UNLCK, 1)
+                    else:
+                        fcntl.lockf(self._fh.fileno(), fcntl.LOCK_UN)
+                finally:
+                    self._fh.close()
+                    self._fh = None
+        finally:
+            self._local.release()
+        return False
+
+class JoinedPathView(Sequence):
+    """Read-only sequence of `dir/name` paths built on access from a shared prefix and a tuple of names."""
+    __slots__ = ("_dir", "_names")
+
+    def __init__(self, dir_abs, names):
+        self._dir = dir_abs
+        self._names = names
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [os.path.join(self._dir, n) for n in self._names[i]]
+        return os.path.join(self._dir, self._names[i])
+
+    def __iter__(self):
+        d = self._dir
+        return (os.path.join(d, n) for n in self._names)
+
+class DirListing:
+    """Compact scan of one directory: interned names plus per-file size/mtime/ctime in parallel arrays."""
+    __slots__ = ("dir", "dir_mtime", "scanned_at", "folder_names", "file_names", "sizes", "mtimes", "ctimes")
+
+    def __init__(self, dir_abs, dir_mtime=None, folder_names=(), file_rows=(), scanned_at=None):
+        self.dir = dir_abs
+        self.dir_mtime = dir_mtime
+        self.scanned_at = time.time() if scanned_at is None else scanned_at
+        self.folder_names = tuple(sys.intern(n) for n in folder_names)
+        self.file_names = tuple(sys.intern(r[0]) for r in file_rows)
+        self.sizes = array("q", (int(r[1]) for r in file_rows))
+        self.mtimes = array("q", (int(r[2]) for r in file_rows))
+        self.ctimes = array("d", (float(r[3]) for r in file_rows))
+
+    @property
+    def folders(self):
+        return JoinedPathView(self.dir, self.folder_names)
+
+    @property
+    def files(self):
+        return JoinedPathView(self.dir, self.file_names)
+
+    def iter_folders(self):
+        for name in self.folder_names:
+            yield os.path.join(self.dir, name), name
+
+    def iter_file_stats(self):
+        for i, name in enumerate(self.file_names):
+            yield os.path.join(self.dir, name), self.sizes[i], self.mtimes[i], self.ctimes[i]
+
+    def rows(self):
+        return [[name, self.sizes[i], self.mtimes[i], self.ctimes[i]] for i, name in enumerate(self.file_names)]
+
+_COMPARE_OPS = {"==": operator.eq, "!=": operator.ne, ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+
+class FileColumns:
+    """Per-file attributes stored column-wise in typed arrays, so sorting and filtering is one vectorized pass (NumPy when available)."""
+    NUMERIC_COLUMNS = {"size": "q", "ctime": "d", "mtime": "q", "width": "i", "height": "i", "duration": "d", "fps": "d", "seed": "q"}
+    LABEL_COLUMNS = ("type", "model", "dir")
+    __slots__ = ("paths", "rows", "columns", "labels", "label_ids")
+
+    def __init__(self):
+        self.paths = []
+        self.rows = {}
+        self.columns = {name: array(code) for name, code in self.NUMERIC_COLUMNS.items()}
+        self.columns.update((name, array("i")) for name in self.LABEL_COLUMNS)
+        self.labels = {name: [] for name in self.LABEL_COLUMNS}
+        self.label_ids = {name: {} for name in self.LABEL_COLUMNS}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _label_id(self, name, value):
+        if value is None:
+            return -1
+        ids = self.label_ids[name]
+        i = ids.get(value)
+        if i is None:
+            i = ids[value] = len(self.labels[name])
+            self.labels[name].append(value)
+        return i
+
+    def set(self, path, **values):
+        """Insert or update one file; columns not given keep their value (-1, i.e. unknown, on a new row)."""
+        row = self.rows.get(path)
+        if row is None:
+            row = self.rows[path] = len(self.paths)
+            self.paths.append(path)
+            for col in self.columns.values():
+                col.append(-1)
+        for name, value in values.items():
+            col = self.columns[name]
+            if name in self.label_ids:
+                value = self._label_id(name, value)
+            elif value is None:
+                value = -1
+            col[row] = float(value) if col.typecode == "d" else int(value)
+
+    def remove(self, path):
+        row = self.rows.pop(path, None)
+        if row is None:
+            return
+        last = len(self.paths) - 1
+        if row != last:
+            moved = self.paths[last]
+            self.paths[row] = moved
+            self.rows[moved] = row
+            for col in self.columns.values():
+                col[row] = col[last]
+        self.paths.pop()
+        for col in self.columns.values():
+            col.pop()
+
+    def get(self, path, name):
+        row = self.rows.get(path)
+        if row is None:
+            return None
+        value = self.columns[name][row]
+        if name in self.labels:
+            return self.labels[name][value] if value >= 0 else None
+        return None if value == -1 else value
+
+    def _matching_labels(self, name, op, value):
+        # Folder paths are matched exactly: two directories differing only in case are different folders on most filesystems.
+        fold = str if name == "dir" else str.lower
+        wanted = [fold(str(v)) for v in (value if isinstance(value, (list, tuple, set)) else [value])]
+        matches = []
+        for i, label in enumerate(self.labels[name]):
+            text = fold(label)
+            hit = any(w in text for w in wanted) if op == "~" else text in wanted
+            if hit != (op == "!="):
+                matches.append(i)
+        return matches
+
+    def _label_ranks(self, name):
+        labels = self.labels[name]
+        ranks = [0] * (len(labels) + 1)
+        for rank, i in enumerate(sorted(range(len(labels)), key=lambda i: labels[i].lower()), 1):
+            ranks[i + 1] = rank
+        return ranks
+
+    def query(self, filters=(), sort="ctime", descending=True):
+        """Paths whose row passes every (column, op, value) filter, ordered by `sort`.
+
+        Numeric ops are == != > >= < <=; label columns (type, model, dir) take ==, != and "in" (case-insensitive, except dir) or "~" (substring).
+        Unknown numeric values never pass a comparison.
+        """
+        n = len(self.paths)
+        if not n:
+            return []
+        label_filters = {i: self._matching_labels(name, op, value) for i, (name, op, value) in enumerate(filters) if name in self.labels}
+        if np is not None:
+            mask = np.ones(n, dtype=bool)
+            for i, (name, op, value) in enumerate(filters):
+                col = np.frombuffer(self.columns[name], dtype=self.columns[name].typecode)
+                if i in label_filters:
+                    mask &= np.isin(col, label_filters[i])
+                else:
+                    mask &= (col != -1) & _COMPARE_OPS[op](col, value)
+            idx = np.flatnonzero(mask)
+            col = np.frombuffer(self.columns[sort], dtype=self.columns[sort].typecode)
+            key = np.asarray(self._label_ranks(sort))[col[idx] + 1] if sort in self.labels else col[idx]
+            order = idx[np.argsort(key, kind="stable")]
+            if descending:
+                order = order[::-1]
+            return [self.paths[i] for i in order.tolist()]
+        label_sets = {i: set(ids) for i, ids in label_filters.items()}
+        checks = [(self.columns[name], label_sets.get(i), _COMPARE_OPS.get(op), value) for i, (name, op, value) in enumerate(filters)]
+        rows = [r for r in range(n) if all((col[r] in allowed) if allowed is not None else (col[r] != -1 and compare(col[r], value)) for col, allowed, compare, value in checks)]
+        col = self.columns[sort]
+        if sort in self.labels:
+            ranks = self._label_ranks(sort)
+            rows.sort(key=lambda r: ranks[col[r] + 1], reverse=descending)
+        else:
+            rows.sort(key=col.__getitem__, reverse=descending)
+        return [self.paths[r] for r in rows]
@@ -2,14 +2,25 @@ import gradio as gr
 from shared.utils.plugins import WAN2GPPlugin
 import os
 import re
+import sys
+import html
 from PIL import Image
 import gc
 import subprocess
 import json
 import hashlib
+import base64
+import io
 import time
+import threading
+import shutil
+import secrets
+import shlex
+from urllib.parse import quote
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from .gallery_utils import get_thumbnails_in_batch_windows
+from .gallery_utils import get_thumbnails_in_batch_windows, encode_thumbnail_variants, get_video_preview_strips_in_batch, get_video_preview_strip_as_base64, dhash_from_base64, dhash_from_file, BKTree, ThumbPackStore, InterProcessLock, DirListing, open_video_decoder, close_video_decoder, read_video_frames, build_video_sprite, iter_zip_stream, compute_audio_peaks, render_waveform_as_base64, load_mosaic_tile, build_folder_mosaic, FileColumns, read_embedded_settings
 
 
 class GalleryPlugin(WAN2GPPlugin):
@@ -17,15 +28,151 @@ class GalleryPlugin(WAN2GPPlugin):
         super().__init__()
         self.loaded_once = False
         self.THUMB_CACHE_MAX_ENTRIES = 3000
+        self.THUMB_DISK_MAX_FILES = 6000
+        self._thumb_variant_pending = set()
+        self._thumb_variant_executor = None
+        self.THUMB_VARIANT_SIZES = (256, 384)
+        self._thumb_dir_versions = {}
+        self.WAVEFORM_BUCKETS = 256
+        self._waveform_pending = set()
+        self._waveform_executor = None
         self._thumb_cache = {}
-        self._scan_cache = {}
+        self.SCAN_CACHE_MAX_DIRS = 256
+        self.SCAN_MTIME_GRANULARITY_SECONDS = 2.0
+        self._scan_revalidate_pending = set()
+        self._scan_revalidate_executor = None
+        self._scan_cache = OrderedDict()
+        self._scan_lock = threading.Lock()
         self._disk_cache_initialized = False
         self._thumb_disk_cache_root = None
         self._thumb_disk_dir = None
         self._thumb_index_file = None
         self._thumb_disk_index = {}
+        self._thumb_fid_index = {}
         self._thumb_disk_index_dirty = False
+        self._thumb_disk_touched = set()
+        self._thumb_disk_removed = set()
+        self._thumb_disk_used = set()
         self._thumb_disk_last_save_ts = 0.0
+        self._thumb_index_seen_mtime = None
+        self._thumb_index_last_check_ts = 0.0
+        self._thumb_lock = threading.RLock()
+        self._cache_file_lock = None
+        self.CACHE_CLAIM_TTL_SECONDS = 600
+        self.THUMB_CACHE_PACKED = False
+        self.THUMB_PACK_COMPACT_MIN_BYTES = 8 * 1024 * 1024
+        self._thumb_pack_enabled = False
+        self._thumb_pack_gen = 0
+        self._thumb_packs = {}
+        self._thumb_pack_live_bytes = 0
+        self.CACHE_GC_BATCH = 500
+        self.CACHE_DISK_MAX_MB = 2048
+        self.CACHE_TOUCH_INTERVAL_SECONDS = 3600
+        self.CACHE_GC_START_DELAY_SECONDS = 60
+        self.CACHE_GC_PASS_PAUSE_SECONDS = 2
+        self.CACHE_GC_INTERVAL_SECONDS = 1800
+        self.CACHE_GC_GRACE_SECONDS = 3600
+        self.CACHE_GC_MOVED_GRACE_SECONDS = 7 * 86400
+        self.CACHE_GC_RECOVERY_SECONDS = 7 * 86400
+        self._cache_gc_thread = None
+        self._cache_gc_requested = threading.Event()
+        self.PREVIEW_STRIP_FRAMES = 6
+        self._preview_cache = {}
+        self._preview_pending = set()
+        self._preview_executor = None
+        self.PHASH_DUPLICATE_THRESHOLD = 6
+        self._phash_index = {}
+        self._phash_index_loaded = False
+        self._phash_index_dirty = False
+        self._phash_touched = set()
+        self._phash_removed = set()
+        self._phash_last_save_ts = 0.0
+        self._phash_version = 0
+        self._phash_trees = None
+        self._phash_trees_version = -1
+        self.FRAME_CACHE_MAX_ENTRIES = 48
+        self.FRAME_DECODER_MAX_OPEN = 4
+        self.FRAME_PREFETCH_RADIUS = 2
+        self._frame_cache = OrderedDict()
+        self._frame_decoders = OrderedDict()
+        self._frame_lock = threading.RLock()
+        self._frame_prefetch_pending = set()
+        self._frame_prefetch_executor = None
+        self.SPRITE_CACHE_MAX_ENTRIES = 32
+        self._sprite_cache = OrderedDict()
+        self._sprite_pending = set()
+        self._sprite_executor = None
+        self.PREVIEW_PROXY_MIN_BYTES = 16 * 1024 * 1024
+        self.PREVIEW_PROXY_MAX_HEIGHT = 480
+        self.PREVIEW_PROXY_CRF = 30
+        self.PREVIEW_PROXY_MAX_DISK_MB = 1024
+        self._proxy_cache = {}
+        self._proxy_pending = set()
+        self._proxy_executor = None
+        self.INFO_CACHE_MAX_ENTRIES = 256
+        self.NEIGHBOR_PREFETCH_RADIUS = 3
+        self._file_info_cache = OrderedDict()
+        self._info_lock = threading.Lock()
+        self._neighbor_prefetch_gen = 0
+        self._neighbor_prefetch_executor = None
+        self.PREWARM_START_DELAY_SECONDS = 5
+        self.PREWARM_WAIT_SECONDS = 60
+        self._prewarm_thread = None
+        self._prewarm_lock = threading.Lock()
+        self._prewarm_pending = threading.Event()
+        self.GENERATION_IDLE_SECONDS = 30
+        self.GENERATION_POLL_SECONDS = 2
+        self.GENERATION_BUSY_WORKERS = 1
+        self.BACKGROUND_NICE = 15
+        self._session_states = OrderedDict()
+        self._last_generation_activity_ts = 0
+        self._lowered_threads = set()
+        self._lineage_index = {}
+        self._lineage_children = {}
+        self._lineage_loaded = False
+        self._lineage_dirty = False
+        self._lineage_touched = set()
+        self._lineage_removed = set()
+        self._lineage_last_save_ts = 0
+        self.STORAGE_TOP_ROWS = 25
+        self._storage_index = {}
+        self._storage_by_dir = {}
+        self._storage_by_name = {}
+        self._storage_totals = {"folder": {}, "model": {}, "day": {}}
+        self._storage_loaded = False
+        self._storage_dirty = False
+        self._storage_touched = set()
+        self._storage_removed = set()
+        self._storage_last_save_ts = 0
+        self._storage_tree_scanned = False
+        self._storage_tree_scan_running = False
+        self.STORAGE_LOG_COMPACT_BYTES = 4 * 1024 * 1024
+        self._storage_base_sig = None
+        self._storage_log_offset = 0
+        self._file_attrs_pending = set()
+        self._file_attrs_executor = None
+        self._file_columns = None
+        self._storage_attrs_version = 0
+        self._listing_api_registered = False
+        self._listing_api_active = False
+        self.METADATA_SIDECAR_EXTENSIONS = ['.txt', '.json', '.metadata']
+        self.EXPORT_STORED_EXTENSIONS = {'.mp4', '.mkv', '.webm', '.mov', '.avi', '.jpg', '.jpeg', '.png', '.webp', '.gif', '.mp3', '.m4a', '.aac', '.ogg', '.flac', '.opus', '.zip'}
+        self.EXPORT_TOKEN_TTL_SECONDS = 600
+        self._export_tokens = {}
+        self.FOLDER_MOSAIC_TILE = 64
+        self._folder_summaries = {}
+        self._folder_summaries_loaded = False
+        self._folder_summaries_touched = set()
+        self._folder_summaries_removed = set()
+        self._folder_summaries_last_save_ts = 0
+        self._folder_summary_pending = set()
+        self._folder_summary_executor = None
+        self._phash_pending = set()
+        self._phash_executor = None
+        self.FRAGMENT_CACHE_MAX_ENTRIES = 6000
+        self._fragment_cache = OrderedDict()
+        self.GALLERY_QUERY_TERM = re.compile(r'^(\w+)\s*(<=|>=|!=|==|=|~|<|>)\s*(.+)$')
+        self.DISPLAY_NAME_PATTERN = re.compile(r'_seed\d+_(.+)\.(mp4|jpg|jpeg|png|webp|wav|mp3|flac|ogg|m4a|aac)$', re.IGNORECASE)
 
     def setup_ui(self):
         self.add_tab(
@@ -66,6 +213,125 @@ class GalleryPlugin(WAN2GPPlugin):
         self.request_component("image_prompt_type_endcheckbox")
         self.request_component("plugin_data")
         self.register_data_hook("before_metadata_save", self.add_merge_info_to_metadata)
+        self._start_prewarm_thread()
+        self._start_cache_gc_thread()
+
+    def _note_session_state(self, current_state):
+        if not isinstance(current_state, dict):
+            return
+        with self._info_lock:
+            self._session_states[id(current_state)] = current_state
+            self._session_states.move_to_end(id(current_state))
+            while len(self._session_states) > 8:
+                self._session_states.popitem(last=False)
+
+    def _host_queue_busy(self):
+        # The generator keeps every session's pending and running tasks in a module-level list it rebinds on each change,
+        # so it is read live from the host module rather than requested once as a global.
+        for name in ("wgp", "__main__"):
+            queue = getattr(sys.modules.get(name), "global_queue_ref", None)
+            if isinstance(queue, list):
+                return len(queue) > 0
+        return False
+
+    def _generation_active(self):
+        if self._host_queue_busy():
+            return True
+        # Fallbacks when the host does not expose its queue: a metadata save in the last few seconds, or a session that opened the gallery.
+        if time.time() - self._last_generation_activity_ts < self.GENERATION_IDLE_SECONDS:
+            return True
+        with self._info_lock:
+            states = list(self._session_states.values())
+        for st in states:
+            gen = st.get("gen")
+            if isinstance(gen, dict) and gen.get("in_progress"):
+                return True
+        return False
+
+    def _lower_background_priority(self):
+        # Only Linux accepts a thread id here; elsewhere the same call would renice the whole process or an unrelated one.
+        if not sys.platform.startswith("linux"):
+            return
+        tid = threading.get_native_id()
+        if tid in self._lowered_threads:
+            return
+        self._lowered_threads.add(tid)
+        try:
+            os.setpriority(os.PRIO_PROCESS, tid, self.BACKGROUND_NICE)
+        except Exception:
+            pass
+        if shutil.which("ionice"):
+            try:
+                subprocess.run(["ionice", "-c", "3", "-p", str(tid)], capture_output=True, check=False)
+            except Exception:
+                pass
+
+    def _background_command_prefix(self):
+        if os.name != "posix":
+            return []
+        prefix = ["nice", "-n", str(self.BACKGROUND_NICE)] if shutil.which("nice") else []
+        if shutil.which("ionice"):
+            prefix += ["ionice", "-c", "3"]
+        return prefix
+
+    def _wait_for_generation_idle(self):
+        """Called by background jobs between units of work: yields to the generator while it is busy."""
+        self._lower_background_priority()
+        while self._generation_active():
+            time.sleep(self.GENERATION_POLL_SECONDS)
+
+    def _foreground_workers(self):
+        return self.GENERATION_BUSY_WORKERS if self._generation_active() else None
+
+    def _start_prewarm_thread(self):
+        # setup_ui runs before globals are injected, but the host module has already loaded its config.
+        config = getattr(self, "server_config", None)
+        for name in ("wgp", "__main__"):
+            if not isinstance(config, dict):
+                config = getattr(sys.modules.get(name), "server_config", None)
+        if isinstance(config, dict) and not config.get("gallery_prewarm_on_startup", False):
+            return
+        self._prewarm_pending.set()
+        self._prewarm_thread = threading.Thread(target=self._prewarm_gallery, name="gallery-prewarm", daemon=True)
+        self._prewarm_thread.start()
+
+    def _wait_for_plugin_globals(self, timeout=120):
+        # Globals are injected after setup_ui returns; wait for them instead of racing app startup.
+        deadline = time.time() + timeout
+        while not isinstance(getattr(self, "server_config", None), dict) or not callable(getattr(self, "has_video_file_extension", None)):
+            if time.time() > deadline:
+                return False
+            time.sleep(1)
+        return True
+
+    def _prewarm_gallery(self):
+        if not self._wait_for_plugin_globals() or not self.server_config.get("gallery_prewarm_on_startup", False):
+            self._prewarm_pending.clear()
+            return
+        time.sleep(self.PREWARM_START_DELAY_SECONDS)
+        self._wait_for_generation_idle()
+        with self._prewarm_lock:
+            # A listing requested during the delay cleared the flag and builds the same caches itself.
+            if not self._prewarm_pending.is_set() or self.loaded_once:
+                return
+            try:
+                started = time.time()
+                self._ensure_disk_thumb_cache()
+                self._ensure_phash_index()
+                listing = self._build_gallery_listing(current_dir="")
+                print(f"Gallery cache pre-warmed: {len(listing['file_items'])} files in {time.time() - started:.1f}s")
+            except Exception as e:
+                print(f"Could not pre-warm gallery cache: {e}")
+            finally:
+                self._prewarm_pending.clear()
+
+    def _wait_for_prewarm(self):
+        if self._prewarm_thread is None or not self._prewarm_thread.is_alive():
+            return
+        # Cancel a pre-warm that has not started yet; one already running holds the lock until it is done.
+        self._prewarm_pending.clear()
+        if self._prewarm_lock.acquire(timeout=self.PREWARM_WAIT_SECONDS):
+            self._prewarm_lock.release()
 
     def _get_roots(self):
         save_path = os.path.abspath(self.server_config.get("save_path", "outputs"))
@@ -95,20 +361,62 @@ class GalleryPlugin(WAN2GPPlugin):
         except Exception:
             return None
 
+    def _file_identity(self, path: str):
+        try:
+            st = os.stat(path)
+            mtime_ns = getattr(st, "st_mtime_ns", int(st.st_mtime * 1_000_000_000))
+            if not st.st_ino:
+                return None
+            return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{mtime_ns}"
+        except Exception:
+            return None
+
+    def _relink_moved_thumb_entry(self, abs_path: str, sig):
+        # A rename or move keeps device, inode, size and mtime, so the entry recorded under the old path can be re-keyed without decoding anything.
+        fid = self._file_identity(abs_path)
+        if not fid:
+            return None
+        self._ensure_phash_index()
+        with self._thumb_lock:
+            old_path = self._thumb_fid_index.get(fid)
+            if not old_path or old_path == abs_path or abs_path in self._thumb_disk_index or os.path.exists(old_path):
+                return None
+            meta = self._thumb_disk_index.pop(old_path, None)
+            if not meta or meta.get("key") != [int(sig[0]), int(sig[1])]:
+                if meta:
+                    self._thumb_disk_index[old_path] = meta
+                return None
+            self._thumb_disk_index[abs_path] = meta
+            self._thumb_fid_index[fid] = abs_path
+            self._mark_thumb_index_dirty(touched=[abs_path], removed=[old_path])
+            for mem_cache in (self._thumb_cache, self._preview_cache):
+                if old_path in mem_cache:
+                    mem_cache[abs_path] = mem_cache.pop(old_path)
+            if old_path in self._phash_index:
+                self._phash_index[abs_path] = self._phash_index.pop(old_path)
+                self._mark_phash_index_dirty(touched=[abs_path], removed=[old_path])
+        return meta
+
     def _get_plugin_base_dir(self):
         try:
             return os.path.dirname(os.path.abspath(__file__))
         except Exception:
             return os.path.abspath(".")
 
-    def _ensure_disk_thumb_cache(self):
-        if self._disk_cache_initialized:
-            return
+    def _get_cache_base_dir(self):
+        configured = self.server_config.get("gallery_cache_dir", "") if self.server_config else ""
+        if configured:
+            return os.path.abspath(os.path.expanduser(configured))
         try:
             plugin_base = self._get_plugin_base_dir()
         except Exception:
             plugin_base = os.path.abspath(".")
-        cache_base = os.path.join(plugin_base, ".gallery_cache")
+        return os.path.join(plugin_base, ".gallery_cache")
+
+    def _ensure_disk_thumb_cache(self):
+        if self._disk_cache_initialized:
+            return
+        cache_base = self._get_cache_base_dir()
         thumb_dir = os.path.join(cache_base, "thumbs")
         index_file = os.path.join(cache_base, "thumb_index.json")
         try:
@@ -118,32 +426,360 @@ class GalleryPlugin(WAN2GPPlugin):
         self._thumb_disk_cache_root = cache_base
         self._thumb_disk_dir = thumb_dir
         self._thumb_index_file = index_file
+        self._cache_file_lock = InterProcessLock(os.path.join(cache_base, "cache.lock"))
         self._thumb_disk_index = {}
+        self._thumb_fid_index = {}
         self._thumb_disk_index_dirty = False
         try:
-            if os.path.exists(index_file):
-                with open(index_file, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                if isinstance(data, dict):
-                    for p, meta in data.items():
-                        if isinstance(meta, dict):
-                            key = meta.get("key")
-                            fn = meta.get("file")
-                            ts = meta.get("ts", 0)
-                            if isinstance(p, str) and isinstance(key, (list, tuple)) and len(key) == 2 and isinstance(fn, str):
-                                self._thumb_disk_index[p] = {
-                                    "key": [int(key[0]), int(key[1])],
-                                    "file": fn,
-                                    "ts": float(ts) if ts is not None else 0.0
-                                }
+            with self._cache_file_lock:
+                self._thumb_disk_index = self._read_thumb_index_file()
         except Exception as e:
             print(f"Could not load gallery thumb cache index: {e}")
             self._thumb_disk_index = {}
+            self._mark_thumb_index_lost()
+        if not self._thumb_disk_index and not os.path.exists(index_file):
+            try:
+                with os.scandir(thumb_dir) as it:
+                    if next(it, None) is not None:
+                        self._mark_thumb_index_lost()
+            except OSError:
+                pass
+        self._rebuild_thumb_fid_index()
         self._disk_cache_initialized = True
+        if self.server_config.get("gallery_packed_thumb_cache", self.THUMB_CACHE_PACKED):
+            self._open_thumb_pack()
+
+    def _mark_thumb_index_lost(self):
+        # Every cached file is unindexed now: let the reconciler re-adopt them right away, and keep the ones it cannot match
+        # for a while, since their source folders may simply not have been listed yet.
+        marker = os.path.join(self._thumb_disk_cache_root, "thumb_index.recovering")
+        try:
+            if not os.path.exists(marker):
+                with open(marker, "w", encoding="utf-8") as f:
+                    f.write(str(time.time()))
+        except OSError as e:
+            print(f"Could not record gallery thumb cache recovery: {e}")
+        self._cache_gc_requested.set()
+
+    def _thumb_index_recovering(self, now: float):
+        marker = os.path.join(self._thumb_disk_cache_root, "thumb_index.recovering")
+        try:
+            if now - os.path.getmtime(marker) < self.CACHE_GC_RECOVERY_SECONDS:
+                return True
+            os.remove(marker)
+        except OSError:
+            pass
+        return False
+
+    def _read_thumb_index_file(self):
+        index = {}
+        try:
+            st = os.stat(self._thumb_index_file)
+        except OSError:
+            self._thumb_index_seen_mtime = None
+            return index
+        with open(self._thumb_index_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self._thumb_index_seen_mtime = st.st_mtime_ns
+        if isinstance(data, dict):
+            for p, meta in data.items():
+                if isinstance(meta, dict):
+                    key = meta.get("key")
+                    fn = meta.get("file")
+                    ts = meta.get("ts", 0)
+                    variants = meta.get("variants")
+                    variants = {k: v for k, v in variants.items() if isinstance(k, str) and isinstance(v, str)} if isinstance(variants, dict) else {}
+                    if isinstance(p, str) and isinstance(key, (list, tuple)) and len(key) == 2 and (isinstance(fn, str) or variants):
+                        index[p] = {
+                            "key": [int(key[0]), int(key[1])],
+                            "file": fn if isinstance(fn, str) else None,
+                            "ts": float(ts) if ts is not None else 0.0
+                        }
+                        if variants:
+                            index[p]["variants"] = variants
+                        if isinstance(meta.get("fid"), str):
+                            index[p]["fid"] = meta["fid"]
+        return index
+
+    def _rebuild_thumb_fid_index(self):
+        with self._thumb_lock:
+            self._thumb_fid_index = {meta["fid"]: p for p, meta in self._thumb_disk_index.items() if meta.get("fid")}
+
+    def _mark_thumb_index_dirty(self, touched=(), removed=()):
+        with self._thumb_lock:
+            for p in removed:
+                self._thumb_disk_touched.discard(p)
+                self._thumb_disk_used.discard(p)
+                self._thumb_disk_removed.add(p)
+            for p in touched:
+                self._thumb_disk_removed.discard(p)
+                self._thumb_disk_touched.add(p)
+            self._thumb_disk_index_dirty = True
+
+    def _mark_thumb_index_used(self, abs_path: str):
+        # A read only refreshes the LRU timestamp; it must never write our copy of file/variants back over another process's.
+        with self._thumb_lock:
+            self._thumb_disk_used.add(abs_path)
+            self._thumb_disk_index_dirty = True
+
+    def _drop_compacted_pack_refs(self, meta, gen_exists):
+        # Another process compacted a generation we appended to before our entry reached the index: those blobs are gone.
+        def stale(fname):
+            ref = self._parse_pack_ref(fname)
+            if not ref:
+                return False
+            if ref[2] not in gen_exists:
+                gen_exists[ref[2]] = os.path.exists(self._thumb_pack_path(ref[2]))
+            return not gen_exists[ref[2]]
+        if stale(meta.get("file")):
+            meta["file"] = None
+        variants = meta.get("variants")
+        if variants:
+            for variant in [v for v, fname in variants.items() if stale(fname)]:
+                variants.pop(variant, None)
+        return meta if self._thumb_disk_entry_files(meta) else None
 
-    def _thumb_disk_file_name(self, abs_path: str) -> str:
+    def _merge_thumb_disk_index_locked(self):
+        # Caller holds the cache file lock: adopt what other processes wrote, then lay our own pending changes on top.
+        try:
+            disk = self._read_thumb_index_file()
+        except Exception as e:
+            print(f"Could not reload gallery thumb cache index: {e}")
+            return
+        with self._thumb_lock:
+            for p in self._thumb_disk_removed:
+                disk.pop(p, None)
+            gen_exists = {}
+            for p in self._thumb_disk_touched:
+                meta = self._thumb_disk_index.get(p)
+                if meta and self._thumb_pack_enabled:
+                    meta = self._drop_compacted_pack_refs(meta, gen_exists)
+                if meta:
+                    disk[p] = meta
+            for p in self._thumb_disk_used - self._thumb_disk_touched:
+                meta = self._thumb_disk_index.get(p)
+                theirs = disk.get(p)
+                if meta and theirs and theirs["key"] == list(meta["key"]):
+                    theirs["ts"] = max(theirs.get("ts", 0), meta.get("ts", 0))
+            self._thumb_disk_index = disk
+            self._rebuild_thumb_fid_index()
+
+    def _refresh_thumb_disk_index_if_changed(self):
+        self._ensure_disk_thumb_cache()
+        now = time.time()
+        if now - self._thumb_index_last_check_ts < 1.0:
+            return
+        self._thumb_index_last_check_ts = now
+        try:
+            mtime = os.stat(self._thumb_index_file).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._thumb_index_seen_mtime:
+            return
+        with self._cache_file_lock:
+            self._merge_thumb_disk_index_locked()
+
+    def _open_thumb_pack(self):
+        try:
+            self._thumb_pack_enabled = True
+            refs = {}
+            for p, meta in self._thumb_disk_index.items():
+                for variant, fname in [(None, meta.get("file"))] + list((meta.get("variants") or {}).items()):
+                    ref = self._parse_pack_ref(fname)
+                    if ref:
+                        refs[ref] = (p, variant, meta)
+                        self._thumb_pack_gen = max(self._thumb_pack_gen, ref[2])
+            self._sync_thumb_pack_gen()
+            self._thumb_pack_live_bytes = sum(ref[1] for ref in refs)
+            newest = sorted(refs.items(), key=lambda kv: kv[1][2].get("ts", 0), reverse=True)[:self.THUMB_CACHE_MAX_ENTRIES]
+            by_gen = {}
+            for ref, _ in newest:
+                by_gen.setdefault(ref[2], []).append(ref[:2])
+            blobs = {}
+            for gen, gen_refs in by_gen.items():
+                store = self._thumb_pack_store(gen)
+                if store is not None:
+                    blobs.update({(off, ln, gen): data for (off, ln), data in store.read_many(gen_refs).items()})
+            for ref, (p, variant, meta) in newest:
+                data = blobs.get(ref)
+                if not data:
+                    continue
+                entry = {"key": tuple(meta["key"]), "ts": meta.get("ts", 0)}
+                if variant == "preview":
+                    entry["preview"] = base64.b64encode(data).decode("utf-8")
+                    self._preview_cache.setdefault(p, entry)
+                elif variant is None:
+                    entry["thumb"] = base64.b64encode(data).decode("utf-8")
+                    self._thumb_cache.setdefault(p, entry)
+        except Exception as e:
+            print(f"Could not open packed gallery thumb cache: {e}")
+            self._thumb_pack_enabled = False
+
+    def _thumb_pack_path(self, gen: int):
+        return os.path.join(self._thumb_disk_cache_root, "thumbs.pack" if gen == 0 else f"thumbs.{gen}.pack")
+
+    def _sync_thumb_pack_gen(self):
+        # Another process may have compacted into a newer generation; appends must always go to the newest pack.
+        while os.path.exists(self._thumb_pack_path(self._thumb_pack_gen + 1)):
+            self._thumb_pack_gen += 1
+
+    def _thumb_pack_store(self, gen: int):
+        store = self._thumb_packs.get(gen)
+        if store is None:
+            path = self._thumb_pack_path(gen)
+            if gen != self._thumb_pack_gen and not os.path.exists(path):
+                return None
+            store = ThumbPackStore(path)
+            self._thumb_packs[gen] = store
+        return store
+
+    def _parse_pack_ref(self, fname):
+        if not isinstance(fname, str) or not fname.startswith("pack:"):
+            return None
+        try:
+            parts = fname.split(":")
+            return int(parts[1]), int(parts[2]), int(parts[3]) if len(parts) > 3 else 0
+        except Exception:
+            return None
+
+    def _format_pack_ref(self, offset: int, length: int, gen: int):
+        return f"pack:{offset}:{length}" if gen == 0 else f"pack:{offset}:{length}:{gen}"
+
+    def _compact_thumb_pack(self, force=False):
+        if not self._thumb_pack_enabled:
+            return
+        store = self._thumb_pack_store(self._thumb_pack_gen)
+        if store is None:
+            return
+        total = store.size()
+        dead = total - self._thumb_pack_live_bytes
+        if not force and (dead < self.THUMB_PACK_COMPACT_MIN_BYTES or dead < total // 2):
+            return
+        with self._cache_file_lock:
+            self._merge_thumb_disk_index_locked()
+            self._sync_thumb_pack_gen()
+            refs = []
+            with self._thumb_lock:
+                for meta in self._thumb_disk_index.values():
+                    refs.extend(r for r in map(self._parse_pack_ref, self._thumb_disk_entry_files(meta)) if r)
+            live = sum(ref[1] for ref in refs)
+            old_gens = sorted(g for g in range(self._thumb_pack_gen + 1) if os.path.exists(self._thumb_pack_path(g)))
+            total = sum(os.path.getsize(self._thumb_pack_path(g)) for g in old_gens)
+            if not force and (total - live < self.THUMB_PACK_COMPACT_MIN_BYTES or total - live < total // 2):
+                self._thumb_pack_live_bytes = live
+                return
+            new_gen = self._thumb_pack_gen + 1
+            dest = self._thumb_pack_path(new_gen)
+            mapping = {}
+            try:
+                by_gen = {}
+                for ref in refs:
+                    by_gen.setdefault(ref[2], []).append(ref[:2])
+                with open(dest + ".tmp", "wb") as out:
+                    for gen in sorted(by_gen):
+                        src = self._thumb_pack_store(gen)
+                        blobs = src.read_many(by_gen[gen]) if src is not None else {}
+                        for (off, ln) in sorted(blobs):
+                            mapping[(off, ln, gen)] = (out.tell(), ln, new_gen)
+                            out.write(blobs[(off, ln)])
+                os.replace(dest + ".tmp", dest)
+            except Exception as e:
+                print(f"Could not compact packed gallery thumb cache: {e}")
+                return
+            with self._thumb_lock:
+                for p, meta in self._thumb_disk_index.items():
+                    ref = self._parse_pack_ref(meta.get("file"))
+                    if ref:
+                        meta["file"] = self._format_pack_ref(*mapping[ref]) if ref in mapping else None
+                    for variant, fname in list((meta.get("variants") or {}).items()):
+                        ref = self._parse_pack_ref(fname)
+                        if ref:
+                            if ref in mapping:
+                                meta["variants"][variant] = self._format_pack_ref(*mapping[ref])
+                            else:
+                                meta["variants"].pop(variant, None)
+                self._thumb_pack_gen = new_gen
+                self._thumb_pack_live_bytes = sum(ref[1] for ref in mapping.values())
+                self._mark_thumb_index_dirty(touched=list(self._thumb_disk_index))
+            self._save_thumb_disk_index(force=True)
+            for gen in old_gens:
+                old_store = self._thumb_packs.pop(gen, None)
+                if old_store is not None:
+                    old_store.close()
+                try:
+                    os.remove(self._thumb_pack_path(gen))
+                except Exception:
+                    # Still mapped by another process (Windows); it is unreferenced now and will be collected later.
+                    pass
+
+    def _gallery_cache_subdir(self, name: str):
+        self._ensure_disk_thumb_cache()
+        if not self._thumb_disk_cache_root:
+            return None
+        path = os.path.join(self._thumb_disk_cache_root, name)
+        try:
+            os.makedirs(path, exist_ok=True)
+        except Exception as e:
+            print(f"Could not create gallery cache dir '{path}': {e}")
+            return None
+        return path
+
+    def _claim_cache_work(self, kind: str, abs_path: str):
+        """Claim an expensive cache build so concurrent server processes sharing the cache don't redo it."""
+        claims_dir = self._gallery_cache_subdir("claims")
+        if not claims_dir:
+            return True
+        h = hashlib.sha1(f"{kind}:{abs_path}".encode("utf-8", errors="ignore")).hexdigest()
+        claim_file = os.path.join(claims_dir, f"{h}.claim")
+        for _ in range(2):
+            try:
+                fd = os.open(claim_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode("ascii"))
+                os.close(fd)
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(claim_file) < self.CACHE_CLAIM_TTL_SECONDS:
+                        return False
+                    os.remove(claim_file)
+                except OSError:
+                    return False
+            except OSError:
+                return True
+        return False
+
+    def _release_cache_work(self, kind: str, abs_path: str):
+        claims_dir = self._gallery_cache_subdir("claims")
+        if not claims_dir:
+            return
+        h = hashlib.sha1(f"{kind}:{abs_path}".encode("utf-8", errors="ignore")).hexdigest()
+        try:
+            os.remove(os.path.join(claims_dir, f"{h}.claim"))
+        except OSError:
+            pass
+
+    def _thumb_disk_file_name(self, abs_path: str, variant=None) -> str:
         h = hashlib.sha1(abs_path.encode("utf-8", errors="ignore")).hexdigest()
-        return f"{h}.b64"
+        return f"{h}.{variant}.b64" if variant else f"{h}.b64"
+
+    def _thumb_disk_entry_files(self, meta):
+        files = [meta.get("file")] + list((meta.get("variants") or {}).values())
+        return [fn for fn in files if fn]
+
+    def _thumb_disk_release_files(self, fnames):
+        for fname in fnames:
+            ref = self._parse_pack_ref(fname)
+            if ref:
+                self._thumb_pack_live_bytes -= ref[1]
+                continue
+            if not self._thumb_disk_dir:
+                break
+            fpath = os.path.join(self._thumb_disk_dir, fname)
+            try:
+                if os.path.exists(fpath):
+                    os.remove(fpath)
+            except Exception as e:
+                print(f"Could not delete cached thumbnail '{fpath}': {e}")
 
     def _save_thumb_disk_index(self, force=False):
         self._ensure_disk_thumb_cache()
@@ -154,20 +790,28 @@ class GalleryPlugin(WAN2GPPlugin):
             return
         try:
             if self._thumb_index_file:
-                tmp = self._thumb_index_file + ".tmp"
-                with open(tmp, "w", encoding="utf-8") as f:
-                    json.dump(self._thumb_disk_index, f, ensure_ascii=False)
-                os.replace(tmp, self._thumb_index_file)
+                with self._cache_file_lock:
+                    self._merge_thumb_disk_index_locked()
+                    with self._thumb_lock:
+                        snapshot = {p: dict(meta) for p, meta in self._thumb_disk_index.items()}
+                        self._thumb_disk_touched.clear()
+                        self._thumb_disk_removed.clear()
+                        self._thumb_disk_used.clear()
+                        self._thumb_disk_index_dirty = False
+                    tmp = self._thumb_index_file + ".tmp"
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        json.dump(snapshot, f, ensure_ascii=False)
+                    os.replace(tmp, self._thumb_index_file)
+                    self._thumb_index_seen_mtime = os.stat(self._thumb_index_file).st_mtime_ns
                 self._thumb_disk_last_save_ts = now
-                self._thumb_disk_index_dirty = False
         except Exception as e:
             print(f"Could not save gallery thumb cache index: {e}")
 
-    def _disk_thumb_get(self, abs_path: str, sig):
+    def _disk_thumb_get(self, abs_path: str, sig, variant=None):
         self._ensure_disk_thumb_cache()
         if not sig:
             return None
-        meta = self._thumb_disk_index.get(abs_path)
+        meta = self._thumb_disk_index.get(abs_path) or self._relink_moved_thumb_entry(abs_path, sig)
         if not meta:
             return None
         cached_key = meta.get("key")
@@ -175,9 +819,18 @@ class GalleryPlugin(WAN2GPPlugin):
             return None
         if [int(sig[0]), int(sig[1])] != [int(cached_key[0]), int(cached_key[1])]:
             return None
-        fname = meta.get("file")
+        fname = (meta.get("variants") or {}).get(variant) if variant else meta.get("file")
         if not fname or not self._thumb_disk_dir:
             return None
+        ref = self._parse_pack_ref(fname)
+        if ref:
+            store = self._thumb_pack_store(ref[2]) if self._thumb_pack_enabled else None
+            data = store.read(ref[0], ref[1]) if store is not None else None
+            if not data:
+                return None
+            meta["ts"] = time.time()
+            self._mark_thumb_index_used(abs_path)
+            return base64.b64encode(data).decode("utf-8")
         fpath = os.path.join(self._thumb_disk_dir, fname)
         try:
             if not os.path.exists(fpath):
@@ -187,167 +840,2325 @@ class GalleryPlugin(WAN2GPPlugin):
             if not thumb_b64:
                 return None
             meta["ts"] = time.time()
-            self._thumb_disk_index_dirty = True
+            self._mark_thumb_index_used(abs_path)
             return thumb_b64
         except Exception as e:
             print(f"Could not read cached thumbnail '{fpath}': {e}")
             return None
 
-    def _disk_thumb_put(self, abs_path: str, sig, thumb_b64: str):
+    def _disk_thumb_put(self, abs_path: str, sig, thumb_b64: str, variant=None):
         self._ensure_disk_thumb_cache()
         if not sig or not thumb_b64 or not self._thumb_disk_dir:
             return
         try:
-            fname = self._thumb_disk_file_name(abs_path)
-            fpath = os.path.join(self._thumb_disk_dir, fname)
-            tmp = fpath + ".tmp"
-            with open(tmp, "w", encoding="utf-8") as f:
-                f.write(thumb_b64)
-            os.replace(tmp, fpath)
-            self._thumb_disk_index[abs_path] = {
-                "key": [int(sig[0]), int(sig[1])],
-                "file": fname,
-                "ts": time.time(),
-            }
-            self._thumb_disk_index_dirty = True
+            if self._thumb_pack_enabled:
+                # Append and index under one lock, so a compaction never sees the blob without the entry that references it.
+                with self._cache_file_lock:
+                    self._sync_thumb_pack_gen()
+                    gen = self._thumb_pack_gen
+                    offset, length = self._thumb_pack_store(gen).append(base64.b64decode(thumb_b64))
+                    fname = self._format_pack_ref(offset, length, gen)
+                    with self._thumb_lock:
+                        self._thumb_pack_live_bytes += length
+                        replaced = self._thumb_disk_index_insert(abs_path, sig, fname, variant)
+            else:
+                fname = self._thumb_disk_file_name(abs_path, variant)
+                fpath = os.path.join(self._thumb_disk_dir, fname)
+                tmp = f"{fpath}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(thumb_b64)
+                os.replace(tmp, fpath)
+                replaced = self._thumb_disk_index_insert(abs_path, sig, fname, variant)
+            self._thumb_disk_release_files([fn for fn in replaced if fn and fn != fname])
+            # Size variants never change what the listing API reports, only a new base thumbnail or preview strip does.
+            if variant in (None, "preview"):
+                self._bump_thumb_dir_version(abs_path)
         except Exception as e:
             print(f"Could not write cached thumbnail for '{abs_path}': {e}")
 
+    def _thumb_disk_index_insert(self, abs_path: str, sig, fname: str, variant=None):
+        key = [int(sig[0]), int(sig[1])]
+        with self._thumb_lock:
+            meta = self._thumb_disk_index.get(abs_path)
+            replaced = []
+            if not meta or meta.get("key") != key:
+                if meta:
+                    replaced = self._thumb_disk_entry_files(meta)
+                meta = {"key": key, "file": None, "ts": time.time()}
+                fid = self._file_identity(abs_path)
+                if fid:
+                    meta["fid"] = fid
+                    self._thumb_fid_index[fid] = abs_path
+                self._thumb_disk_index[abs_path] = meta
+            elif variant:
+                replaced = [(meta.get("variants") or {}).get(variant)]
+            else:
+                replaced = [meta.get("file")]
+            if variant:
+                meta.setdefault("variants", {})[variant] = fname
+            else:
+                meta["file"] = fname
+            meta["ts"] = time.time()
+            self._mark_thumb_index_dirty(touched=[abs_path])
+        return replaced
+
     def _disk_thumb_delete(self, abs_path: str):
         self._ensure_disk_thumb_cache()
-        meta = self._thumb_disk_index.pop(abs_path, None)
+        with self._thumb_lock:
+            meta = self._thumb_disk_index.pop(abs_path, None)
+            if meta and self._thumb_fid_index.get(meta.get("fid")) == abs_path:
+                self._thumb_fid_index.pop(meta.get("fid"), None)
         if meta:
-            self._thumb_disk_index_dirty = True
-            fname = meta.get("file")
-            if fname and self._thumb_disk_dir:
-                fpath = os.path.join(self._thumb_disk_dir, fname)
-                try:
-                    if os.path.exists(fpath):
-                        os.remove(fpath)
-                except Exception as e:
-                    print(f"Could not delete cached thumbnail '{fpath}': {e}")
+            self._mark_thumb_index_dirty(removed=[abs_path])
+            self._thumb_disk_release_files(self._thumb_disk_entry_files(meta))
+            self._bump_thumb_dir_version(abs_path)
+
+    def _bump_thumb_dir_version(self, abs_path: str):
+        d = os.path.dirname(abs_path)
+        with self._thumb_lock:
+            self._thumb_dir_versions[d] = self._thumb_dir_versions.get(d, 0) + 1
 
     def _prune_thumb_cache(self):
-        if len(self._thumb_cache) > self.THUMB_CACHE_MAX_ENTRIES:
-            items = sorted(self._thumb_cache.items(), key=lambda kv: kv[1].get("ts", 0))
-            remove_count = len(self._thumb_cache) - self.THUMB_CACHE_MAX_ENTRIES
-            for i in range(remove_count):
+        with self._thumb_lock:
+            for mem_cache in (self._thumb_cache, self._preview_cache):
+                if len(mem_cache) > self.THUMB_CACHE_MAX_ENTRIES:
+                    items = sorted(list(mem_cache.items()), key=lambda kv: kv[1].get("ts", 0))
+                    remove_count = len(mem_cache) - self.THUMB_CACHE_MAX_ENTRIES
+                    for i in range(remove_count):
+                        try:
+                            p, _ = items[i]
+                            mem_cache.pop(p, None)
+                        except Exception:
+                            break
+        self._ensure_disk_thumb_cache()
+        # The disk limit counts files, not entries: base, preview strip and every size variant each take space.
+        with self._thumb_lock:
+            counts = [(meta.get("ts", 0), p, len(self._thumb_disk_entry_files(meta))) for p, meta in self._thumb_disk_index.items() if isinstance(meta, dict)]
+        total = sum(n for _, _, n in counts)
+        if len(counts) > self.THUMB_CACHE_MAX_ENTRIES or total > self.THUMB_DISK_MAX_FILES:
+            counts.sort()
+            remove_entries = len(counts) - self.THUMB_CACHE_MAX_ENTRIES
+            for _, p, n in counts:
+                if remove_entries <= 0 and total <= self.THUMB_DISK_MAX_FILES:
+                    break
                 try:
-                    p, _ = items[i]
-                    self._thumb_cache.pop(p, None)
+                    self._disk_thumb_delete(p)
                 except Exception:
                     break
+                remove_entries -= 1
+                total -= n
+        self._compact_thumb_pack()
+        self._save_thumb_disk_index(force=False)
+
+    def _start_cache_gc_thread(self):
+        self._cache_gc_thread = threading.Thread(target=self._cache_gc_loop, name="gallery-cache-gc", daemon=True)
+        self._cache_gc_thread.start()
+
+    def _cache_gc_loop(self):
+        if not self._wait_for_plugin_globals() or not self.server_config.get("gallery_cache_gc", True):
+            return
+        self._cache_gc_requested.wait(self.CACHE_GC_START_DELAY_SECONDS)
+        while True:
+            self._cache_gc_requested.clear()
+            try:
+                stats = self.reconcile_gallery_cache()
+                if any(stats.values()):
+                    print("Gallery cache reconciled: " + ", ".join(f"{v} {k}" for k, v in stats.items() if v))
+            except Exception as e:
+                print(f"Could not reconcile gallery cache: {e}")
+            self._cache_gc_requested.wait(self.CACHE_GC_INTERVAL_SECONDS)
+
+    def reconcile_gallery_cache(self, budget=None, pause=None):
+        """Bring the on-disk caches back in line with their indexes and the output folders, `budget` file system operations per pass."""
+        budget = budget or self.CACHE_GC_BATCH
+        pause = self.CACHE_GC_PASS_PAUSE_SECONDS if pause is None else pause
+        stats = {"adopted": 0, "orphans deleted": 0, "orphans kept": 0, "temp files deleted": 0, "entries dropped": 0, "packs deleted": 0, "evicted": 0}
+        # An unmounted or offline output folder would look like every file in it was deleted.
+        unreachable = [r for r in self._get_roots() if not os.path.isdir(r)]
+        if unreachable:
+            print(f"Skipping gallery cache reconcile: output folder(s) not reachable: {', '.join(unreachable)}")
+            return stats
+        spent = 0
+        for cost in self._iter_cache_reconcile_steps(stats):
+            spent += cost
+            if spent >= budget:
+                self._save_thumb_disk_index(force=True)
+                time.sleep(pause)
+                self._wait_for_generation_idle()
+                spent = 0
+        if self._thumb_pack_enabled:
+            with self._thumb_lock:
+                self._thumb_pack_live_bytes = sum(ref[1] for meta in self._thumb_disk_index.values() for ref in map(self._parse_pack_ref, self._thumb_disk_entry_files(meta)) if ref)
+        self._prune_thumb_cache()
+        self._save_thumb_disk_index(force=True)
+        self._save_phash_index(force=True)
+        self._save_lineage_index(force=True)
+        self._save_storage_index(force=True)
+        self._save_folder_summaries(force=True)
+        return stats
+
+    def _cache_file_is_stale(self, path: str, now: float):
+        # Young files may belong to a write whose index update (possibly in another process) has not landed yet.
+        try:
+            return now - os.stat(path).st_mtime > self.CACHE_GC_GRACE_SECONDS
+        except OSError:
+            return False
+
+    def _cache_gc_remove(self, path: str):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def _touch_cache_file(self, path: str):
+        # Sprites, proxies and snapshots are evicted least recently used by file mtime; refresh it at most hourly so hits stay cheap.
+        try:
+            if time.time() - os.stat(path).st_mtime > self.CACHE_TOUCH_INTERVAL_SECONDS:
+                os.utime(path)
+        except OSError:
+            pass
+
+    def _cache_artifact_groups(self, subdir: str):
+        """[(last use, bytes, paths)] per cached source in a sprites/proxies/dir_snapshots folder, temp files excluded."""
+        cache_dir = self._gallery_cache_subdir(subdir)
+        groups = {}
+        try:
+            with os.scandir(cache_dir) as it:
+                for e in it:
+                    if not e.is_file() or e.name.endswith(".tmp") or ".tmp." in e.name:
+                        continue
+                    st = e.stat()
+                    group = groups.setdefault(e.name.split(".", 1)[0], [0.0, 0, []])
+                    group[0] = max(group[0], st.st_mtime)
+                    group[1] += st.st_size
+                    group[2].append(e.path)
+        except (OSError, TypeError):
+            return []
+        return [tuple(g) for g in groups.values()]
+
+    def _cache_disk_max_bytes(self):
+        try:
+            return int(self.server_config.get("gallery_cache_max_mb", self.CACHE_DISK_MAX_MB)) * 1024 * 1024
+        except (TypeError, ValueError):
+            return self.CACHE_DISK_MAX_MB * 1024 * 1024
+
+    def _iter_cache_reconcile_steps(self, stats):
+        """Generator behind reconcile_gallery_cache: does the work and yields the I/O cost of each step."""
         self._ensure_disk_thumb_cache()
-        if len(self._thumb_disk_index) > self.THUMB_CACHE_MAX_ENTRIES:
-            items = sorted(self._thumb_disk_index.items(), key=lambda kv: (kv[1].get("ts", 0) if isinstance(kv[1], dict) else 0))
-            remove_count = len(self._thumb_disk_index) - self.THUMB_CACHE_MAX_ENTRIES
-            for i in range(remove_count):
+        self._ensure_phash_index()
+        self._ensure_lineage_index()
+        self._ensure_storage_index()
+        self._ensure_folder_summaries()
+        self._refresh_thumb_disk_index_if_changed()
+        now = time.time()
+
+        # 1. Entries whose source output is gone.
+        with self._thumb_lock:
+            known = set(self._thumb_disk_index) | set(self._phash_index) | set(self._lineage_index) | set(self._storage_index)
+        for p in sorted(known):
+            yield 1
+            if os.path.exists(p):
+                continue
+            meta = self._thumb_disk_index.get(p)
+            # Moved files keep their thumbnails until the new folder is listed and the entry is re-linked by file identity.
+            if meta and meta.get("fid") and now - meta.get("ts", 0) < self.CACHE_GC_MOVED_GRACE_SECONDS:
+                continue
+            known.discard(p)
+            self._disk_thumb_delete(p)
+            self._phash_delete(p)
+            self._lineage_remove_files([p])
+            self._storage_remove_files([p])
+            self._sprite_disk_delete(p)
+            self._proxy_disk_delete(p)
+            stats["entries dropped"] += 1
+        with self._thumb_lock:
+            summarized = list(self._folder_summaries)
+        for p in summarized:
+            yield 1
+            if not os.path.isdir(p):
+                self._folder_summaries_remove(p)
+                stats["entries dropped"] += 1
+        by_hash = {hashlib.sha1(p.encode("utf-8", errors="ignore")).hexdigest(): p for p in known}
+        recovering = self._thumb_index_recovering(now)
+
+        # 2. Thumbnail files: re-adopt the ones an index entry was lost for, delete the rest.
+        with self._thumb_lock:
+            referenced = {fn for meta in self._thumb_disk_index.values() for fn in self._thumb_disk_entry_files(meta)}
+        try:
+            with os.scandir(self._thumb_disk_dir) as it:
+                names = sorted(e.name for e in it if e.is_file())
+        except OSError:
+            names = []
+        yield 1
+        for name in names:
+            if name in referenced:
+                continue
+            fpath = os.path.join(self._thumb_disk_dir, name)
+            yield 1
+            if not self._cache_file_is_stale(fpath, now):
+                continue
+            if name.endswith(".tmp"):
+                stats["temp files deleted"] += self._cache_gc_remove(fpath)
+                continue
+            h, _, variant = name[:-4].partition(".") if name.endswith(".b64") else (None, None, None)
+            if h and self._adopt_thumb_file(by_hash.get(h), name, variant or None, fpath):
+                stats["adopted"] += 1
+                continue
+            if recovering:
+                stats["orphans kept"] += 1
+                continue
+            stats["orphans deleted"] += self._cache_gc_remove(fpath)
+
+        # 3. Sprites and preview proxies: one image/video plus a JSON key file per source.
+        for subdir in ("sprites", "proxies"):
+            cache_dir = self._gallery_cache_subdir(subdir)
+            try:
+                with os.scandir(cache_dir) as it:
+                    names = sorted(e.name for e in it if e.is_file())
+            except (OSError, TypeError):
+                continue
+            yield 1
+            groups = {}
+            for name in names:
+                groups.setdefault(name.split(".", 1)[0], []).append(name)
+            for h, group in groups.items():
+                yield 1
+                temps = [n for n in group if n.endswith(".tmp") or ".tmp." in n]
+                for n in temps:
+                    if self._cache_file_is_stale(os.path.join(cache_dir, n), now):
+                        stats["temp files deleted"] += self._cache_gc_remove(os.path.join(cache_dir, n))
+                paths = [os.path.join(cache_dir, n) for n in group if n not in temps]
+                if not paths or not all(self._cache_file_is_stale(fp, now) for fp in paths):
+                    continue
+                meta = {}
+                meta_file = os.path.join(cache_dir, f"{h}.json")
                 try:
-                    p, _ = items[i]
-                    self._disk_thumb_delete(p)
+                    with open(meta_file, "r", encoding="utf-8") as f:
+                        meta = json.load(f)
                 except Exception:
+                    pass
+                source = by_hash.get(h) or (meta.get("path") if isinstance(meta, dict) else None)
+                sig = self._thumb_sig_from_path(source) if source else None
+                live = sig and isinstance(meta, dict) and meta.get("key") == [int(sig[0]), int(sig[1])] and len(paths) == 2
+                for fp in ([] if live else paths):
+                    stats["orphans deleted"] += self._cache_gc_remove(fp)
+
+        # 4. Directory snapshots of folders that no longer exist, expired claims and leftover temp files.
+        snapshot_dir = self._gallery_cache_subdir("dir_snapshots")
+        try:
+            with os.scandir(snapshot_dir) as it:
+                names = sorted(e.name for e in it if e.is_file())
+        except (OSError, TypeError):
+            names = []
+        for name in names:
+            fpath = os.path.join(snapshot_dir, name)
+            yield 1
+            if name.endswith(".tmp"):
+                if self._cache_file_is_stale(fpath, now):
+                    stats["temp files deleted"] += self._cache_gc_remove(fpath)
+                continue
+            try:
+                with open(fpath, "r", encoding="utf-8") as f:
+                    snapshot_of = json.loads(f.readline())
+            except Exception:
+                snapshot_of = None
+            if not (isinstance(snapshot_of, str) and os.path.isdir(snapshot_of)):
+                stats["orphans deleted"] += self._cache_gc_remove(fpath)
+        claims_dir = self._gallery_cache_subdir("claims")
+        try:
+            with os.scandir(claims_dir) as it:
+                claims = [e.path for e in it if e.is_file()]
+        except (OSError, TypeError):
+            claims = []
+        for fpath in claims:
+            yield 1
+            try:
+                if now - os.path.getmtime(fpath) > self.CACHE_CLAIM_TTL_SECONDS:
+                    self._cache_gc_remove(fpath)
+            except OSError:
+                pass
+        try:
+            with os.scandir(self._thumb_disk_cache_root) as it:
+                root_files = [e.name for e in it if e.is_file()]
+        except OSError:
+            root_files = []
+        yield 1
+        for name in root_files:
+            fpath = os.path.join(self._thumb_disk_cache_root, name)
+            if name.endswith(".tmp"):
+                yield 1
+                if self._cache_file_is_stale(fpath, now):
+                    stats["temp files deleted"] += self._cache_gc_remove(fpath)
+
+        # 5. Pack generations that compaction replaced but could not delete at the time.
+        with self._cache_file_lock:
+            self._merge_thumb_disk_index_locked()
+            self._sync_thumb_pack_gen()
+            with self._thumb_lock:
+                live_gens = {ref[2] for meta in self._thumb_disk_index.values() for ref in map(self._parse_pack_ref, self._thumb_disk_entry_files(meta)) if ref}
+            for gen in range(self._thumb_pack_gen):
+                pack = self._thumb_pack_path(gen)
+                if gen in live_gens or not os.path.exists(pack):
+                    continue
+                old_store = self._thumb_packs.pop(gen, None)
+                if old_store is not None:
+                    old_store.close()
+                stats["packs deleted"] += self._cache_gc_remove(pack)
+        yield 1
+
+        # 6. Disk budget: thumbnails, sprites, proxies and directory snapshots are evicted least recently used first, across all kinds.
+        items = []
+        with self._thumb_lock:
+            thumb_entries = [(meta.get("ts", 0), p, self._thumb_disk_entry_files(meta)) for p, meta in self._thumb_disk_index.items() if isinstance(meta, dict)]
+        for ts, p, files in thumb_entries:
+            size = 0
+            for fname in files:
+                ref = self._parse_pack_ref(fname)
+                if ref:
+                    size += ref[1]
+                    continue
+                yield 1
+                try:
+                    size += os.path.getsize(os.path.join(self._thumb_disk_dir, fname))
+                except OSError:
+                    pass
+            items.append((ts, size, p, None))
+        for subdir in ("sprites", "proxies", "dir_snapshots"):
+            groups = self._cache_artifact_groups(subdir)
+            yield 1 + len(groups)
+            items.extend((ts, size, None, paths) for ts, size, paths in groups)
+        max_bytes = self._cache_disk_max_bytes()
+        total = sum(size for _, size, _, _ in items)
+        if total > max_bytes:
+            items.sort(key=lambda item: item[0])
+            for _, size, thumb_source, paths in items:
+                if total <= max_bytes:
                     break
-        self._save_thumb_disk_index(force=False)
+                yield 1
+                if thumb_source is not None:
+                    self._disk_thumb_delete(thumb_source)
+                else:
+                    for fpath in paths:
+                        self._cache_gc_remove(fpath)
+                total -= size
+                stats["evicted"] += 1
+
+    def _adopt_thumb_file(self, source, fname: str, variant, fpath: str):
+        """Re-index a cached thumbnail file that lost its index entry, if it is newer than its source and the source is unchanged since."""
+        sig = self._thumb_sig_from_path(source) if source else None
+        if not sig:
+            return False
+        try:
+            file_mtime_ns = os.stat(fpath).st_mtime_ns
+        except OSError:
+            return False
+        if file_mtime_ns < sig[0]:
+            return False
+        key = [int(sig[0]), int(sig[1])]
+        with self._thumb_lock:
+            meta = self._thumb_disk_index.get(source)
+            if meta is None:
+                meta = {"key": key, "file": None, "ts": file_mtime_ns / 1e9}
+                fid = self._file_identity(source)
+                if fid:
+                    meta["fid"] = fid
+                    self._thumb_fid_index[fid] = source
+                self._thumb_disk_index[source] = meta
+            elif meta.get("key") != key or ((meta.get("variants") or {}).get(variant) if variant else meta.get("file")):
+                return False
+            if variant:
+                meta.setdefault("variants", {})[variant] = fname
+            else:
+                meta["file"] = fname
+            self._mark_thumb_index_dirty(touched=[source])
+        return True
+
+    def _invalidate_scan_cache_for_dir(self, dir_path: str):
+        dir_abs = os.path.abspath(dir_path)
+        with self._scan_lock:
+            self._scan_cache.pop(dir_abs, None)
+        snapshot_file = self._dir_snapshot_file(dir_abs)
+        try:
+            if snapshot_file and os.path.exists(snapshot_file):
+                os.remove(snapshot_file)
+        except Exception as e:
+            print(f"Could not delete directory snapshot for {dir_abs}: {e}")
+
+    def _scan_cache_get(self, dir_abs: str, touch=True):
+        # Listings are read from UI handlers, FastAPI threads and background workers at once.
+        with self._scan_lock:
+            listing = self._scan_cache.get(dir_abs)
+            if listing is not None and touch:
+                self._scan_cache.move_to_end(dir_abs)
+        return listing
+
+    def _scan_cache_put(self, dir_abs: str, listing):
+        with self._scan_lock:
+            self._scan_cache[dir_abs] = listing
+            self._scan_cache.move_to_end(dir_abs)
+            while len(self._scan_cache) > self.SCAN_CACHE_MAX_DIRS:
+                self._scan_cache.popitem(last=False)
+
+    def _dir_snapshot_file(self, dir_abs: str):
+        snapshot_dir = self._gallery_cache_subdir("dir_snapshots")
+        if not snapshot_dir:
+            return None
+        h = hashlib.sha1(dir_abs.encode("utf-8", errors="ignore")).hexdigest()
+        return os.path.join(snapshot_dir, f"{h}.json")
+
+    def _dir_mtime_ns(self, dir_abs: str):
+        try:
+            st = os.stat(dir_abs)
+            return getattr(st, "st_mtime_ns", int(st.st_mtime * 1_000_000_000))
+        except Exception:
+            return None
+
+    def _load_dir_snapshot(self, dir_abs: str, dir_mtime=None):
+        snapshot_file = self._dir_snapshot_file(dir_abs)
+        if not snapshot_file or not os.path.exists(snapshot_file):
+            return None
+        try:
+            with open(snapshot_file, "r", encoding="utf-8") as f:
+                # Older snapshots are a single JSON object with no header line: treat them as missing, the next scan rewrites them.
+                if f.readline().startswith("{"):
+                    return None
+                data = json.load(f)
+            if not isinstance(data, dict) or data.get("dir") != dir_abs:
+                return None
+            if dir_mtime is not None and data.get("dir_mtime") != dir_mtime:
+                return None
+            folder_names = [name for name in data.get("folders", []) if isinstance(name, str)]
+            file_rows = [row for row in data.get("files", []) if isinstance(row, list) and len(row) == 4 and isinstance(row[0], str)]
+            scanned_at = data.get("scanned_at")
+            self._touch_cache_file(snapshot_file)
+            return DirListing(dir_abs, data.get("dir_mtime"), folder_names, file_rows, scanned_at=float(scanned_at) if isinstance(scanned_at, (int, float)) else 0.0)
+        except Exception as e:
+            print(f"Could not load directory snapshot for {dir_abs}: {e}")
+            return None
+
+    def _save_dir_snapshot(self, listing):
+        snapshot_file = self._dir_snapshot_file(listing.dir)
+        if not snapshot_file or listing.dir_mtime is None:
+            return
+        data = {
+            "dir": listing.dir,
+            "dir_mtime": listing.dir_mtime,
+            "scanned_at": listing.scanned_at,
+            "folders": list(listing.folder_names),
+            "files": listing.rows(),
+        }
+        try:
+            tmp = f"{snapshot_file}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                # The folder path goes first on its own line, so the cache sweep can read it without parsing the listing.
+                f.write(json.dumps(listing.dir, ensure_ascii=False) + "\n")
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, snapshot_file)
+        except Exception as e:
+            print(f"Could not save directory snapshot for {listing.dir}: {e}")
+
+    def _scan_dir_non_recursive_cached(self, dir_path: str, force_refresh=False, incremental_refresh=False):
+        dir_abs = os.path.abspath(dir_path)
+        if not force_refresh:
+            cached = self._scan_cache_get(dir_abs)
+            if cached is not None:
+                self._revalidate_scan_if_stale(cached)
+                return cached
+        dir_mtime = self._dir_mtime_ns(dir_abs)
+        if not force_refresh and dir_mtime is not None:
+            snapshot = self._load_dir_snapshot(dir_abs, dir_mtime)
+            if snapshot:
+                self._scan_cache_put(dir_abs, snapshot)
+                self._storage_sync_listing(snapshot)
+                self._revalidate_scan_if_stale(snapshot)
+                return snapshot
+        old = self._scan_cache_get(dir_abs, touch=False) or (self._load_dir_snapshot(dir_abs) if incremental_refresh else None)
+        old_files_set = set(old.files) if old is not None else set()
+        try:
+            listing = self._read_dir_listing(dir_abs, dir_mtime)
+        except Exception as e:
+            print(f"Could not list dir {dir_abs}: {e}")
+            listing = DirListing(dir_abs)
+            self._scan_cache_put(dir_abs, listing)
+            return listing
+        if incremental_refresh:
+            new_sigs = {p: (mtime_ns, size) for p, size, mtime_ns, _ in listing.iter_file_stats()}
+            deleted_files = old_files_set - new_sigs.keys()
+            self._lineage_remove_files(deleted_files)
+            for p in deleted_files:
+                # Keep disk entries that carry a file identity: the file may have been moved and will be re-linked when its new folder is listed.
+                self._thumb_cache.pop(p, None)
+                self._preview_cache.pop(p, None)
+                if not (self._thumb_disk_index.get(p) or {}).get("fid"):
+                    self._disk_thumb_delete(p)
+                    self._phash_delete(p)
+            for p, current_sig in new_sigs.items():
+                cached_thumb = self._thumb_cache.get(p)
+                if cached_thumb and ((not current_sig) or (cached_thumb.get("key") != current_sig)):
+                    self._thumb_cache.pop(p, None)
+                cached_preview = self._preview_cache.get(p)
+                if cached_preview and cached_preview.get("key") != current_sig:
+                    self._preview_cache.pop(p, None)
+                disk_meta = self._thumb_disk_index.get(p) if self._disk_cache_initialized else None
+                if disk_meta and current_sig:
+                    dkey = disk_meta.get("key")
+                    if not (isinstance(dkey, (list, tuple)) and len(dkey) == 2 and [int(dkey[0]), int(dkey[1])] == [int(current_sig[0]), int(current_sig[1])]):
+                        self._disk_thumb_delete(p)
+                elif disk_meta and not current_sig:
+                    self._disk_thumb_delete(p)
+        self._scan_cache_put(dir_abs, listing)
+        self._save_dir_snapshot(listing)
+        self._save_lineage_index(force=False)
+        self._storage_sync_listing(listing)
+        self._save_storage_index(force=False)
+        return listing
+
+    def _read_dir_listing(self, dir_abs: str, dir_mtime=None):
+        """List one directory into a DirListing without touching any cache; raises when the directory cannot be read."""
+        folder_names = []
+        file_rows = []
+        with os.scandir(dir_abs) as it:
+            entries = list(it)
+        for entry in entries:
+            name = entry.name
+            try:
+                if entry.is_dir():
+                    folder_names.append(name)
+                elif entry.is_file() and (
+                    self.has_video_file_extension(name)
+                    or self.has_image_file_extension(name)
+                    or self.has_audio_file_extension(name)
+                ):
+                    st = entry.stat()
+                    mtime_ns = getattr(st, "st_mtime_ns", int(st.st_mtime * 1_000_000_000))
+                    file_rows.append((name, int(st.st_size), int(mtime_ns), float(st.st_ctime)))
+            except Exception:
+                continue
+        return DirListing(dir_abs, dir_mtime, folder_names, file_rows)
+
+    def _revalidate_scan_if_stale(self, listing):
+        # A change made in the same timestamp tick as the scan leaves the directory mtime unchanged (racy timestamp): re-list such
+        # listings once in the background. In-place rewrites are caught by the fresh stat of visible items instead.
+        if listing.dir_mtime is None or listing.scanned_at - listing.dir_mtime / 1e9 > self.SCAN_MTIME_GRANULARITY_SECONDS:
+            return
+        with self._thumb_lock:
+            if listing.dir in self._scan_revalidate_pending:
+                return
+            self._scan_revalidate_pending.add(listing.dir)
+            if self._scan_revalidate_executor is None:
+                self._scan_revalidate_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gallery-scan-revalidate")
+        self._scan_revalidate_executor.submit(self._revalidate_scan_job, listing.dir)
+
+    def _revalidate_scan_job(self, dir_abs: str):
+        try:
+            self._lower_background_priority()
+            self._wait_for_generation_idle()
+            self._scan_dir_non_recursive_cached(dir_abs, force_refresh=True, incremental_refresh=True)
+        except Exception as e:
+            print(f"Could not revalidate directory scan for {dir_abs}: {e}")
+        finally:
+            with self._thumb_lock:
+                self._scan_revalidate_pending.discard(dir_abs)
+
+    def _scan_sig(self, stats, path: str, fresh=False):
+        # Visible items always get their own stat, so a file rewritten since the scan never shows a stale thumbnail.
+        st = stats.get(path) if stats and not fresh else None
+        return (st[1], st[0]) if st else self._thumb_sig_from_path(path)
+
+    def _get_thumbnails_cached(self, file_paths, priority_paths=None, file_stats=None):
+        self._refresh_thumb_disk_index_if_changed()
+        result = {}
+        priority_set = set(priority_paths or [])
+        priority_misses = []
+        normal_misses = []
+        for p in file_paths:
+            sig = self._scan_sig(file_stats, p, fresh=p in priority_set)
+            if not sig:
+                continue
+            cached = self._thumb_cache.get(p)
+            if cached and cached.get("key") == sig and cached.get("thumb"):
+                cached["ts"] = time.time()
+                result[p] = cached["thumb"]
+                self._phash_record(p, sig, cached["thumb"])
+                continue
+            disk_thumb = self._disk_thumb_get(p, sig)
+            if disk_thumb:
+                self._thumb_cache[p] = {"key": sig, "thumb": disk_thumb, "ts": time.time()}
+                result[p] = disk_thumb
+                self._phash_record(p, sig, disk_thumb)
+                continue
+            if p in priority_set:
+                priority_misses.append(p)
+            else:
+                normal_misses.append(p)
+        to_generate = priority_misses + normal_misses
+        if to_generate:
+            # One decode at the largest variant size; only the base is encoded before rendering, the decoded images
+            # go to the background job that encodes the larger variants.
+            generated = get_thumbnails_in_batch_windows(to_generate, variant_sizes=self.THUMB_VARIANT_SIZES, defer_variants=True) or {}
+            decoded = {}
+            for p in to_generate:
+                thumb, img = generated.get(p, (None, None))
+                if thumb:
+                    sig = self._thumb_sig_from_path(p)
+                    if sig:
+                        now = time.time()
+                        self._thumb_cache[p] = {"key": sig, "thumb": thumb, "ts": now}
+                        self._disk_thumb_put(p, sig, thumb)
+                        self._phash_record(p, sig, thumb)
+                        result[p] = thumb
+                        if img is not None:
+                            decoded[p] = (sig, img)
+            if decoded and self.THUMB_VARIANT_SIZES:
+                self._schedule_thumb_variants(decoded)
+        self._prune_thumb_cache()
+        self._save_phash_index(force=False)
+        return result
+
+    def _schedule_thumb_variants(self, decoded):
+        """Queue variant encoding for {path: (sig, decoded image)} from the thumbnail pass."""
+        with self._thumb_lock:
+            decoded = {p: v for p, v in decoded.items() if p not in self._thumb_variant_pending}
+            if not decoded:
+                return
+            self._thumb_variant_pending.update(decoded)
+            if self._thumb_variant_executor is None:
+                self._thumb_variant_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gallery-thumb-variants")
+        self._thumb_variant_executor.submit(self._build_thumb_variants_job, decoded)
+
+    def _build_thumb_variants_job(self, decoded):
+        try:
+            for p, (sig, img) in decoded.items():
+                self._wait_for_generation_idle()
+                with self._thumb_lock:
+                    meta = self._thumb_disk_index.get(p)
+                # The base entry may have been pruned or replaced meanwhile: variants alone are never stored.
+                if not meta or meta.get("key") != [int(sig[0]), int(sig[1])]:
+                    continue
+                try:
+                    _, variants = encode_thumbnail_variants(img, 0, self.THUMB_VARIANT_SIZES)
+                except Exception as e:
+                    print(f"Could not encode thumbnail variants for {os.path.basename(p)}: {e}")
+                    continue
+                for variant, data in variants.items():
+                    self._disk_thumb_put(p, sig, data, variant=variant)
+            self._save_thumb_disk_index(force=True)
+        except Exception as e:
+            print(f"Could not build thumbnail variants: {e}")
+        finally:
+            with self._thumb_lock:
+                self._thumb_variant_pending.difference_update(decoded)
+
+    def _get_video_previews_cached(self, video_paths, priority_paths=None, file_stats=None):
+        """{path: strip} for inlining, or {path: True} for strips already cached when the thumb route can serve them by URL."""
+        result = {}
+        by_url = self._listing_api_active
+        priority_set = set(priority_paths or [])
+        priority_misses = []
+        background_misses = []
+        for p in video_paths:
+            sig = self._scan_sig(file_stats, p, fresh=p in priority_set)
+            if not sig:
+                continue
+            if by_url:
+                if self._preview_available(p, sig):
+                    result[p] = True
+                elif p in priority_set and p not in self._preview_pending:
+                    # Off-screen strips are built when the thumb route is first asked for them, i.e. on first hover.
+                    priority_misses.append(p)
+                continue
+            cached = self._preview_cache.get(p)
+            if cached and cached.get("key") == sig and cached.get("preview"):
+                cached["ts"] = time.time()
+                result[p] = cached["preview"]
+                continue
+            disk_preview = self._disk_thumb_get(p, sig, variant="preview")
+            if disk_preview:
+                self._preview_cache[p] = {"key": sig, "preview": disk_preview, "ts": time.time()}
+                self._phash_record(p, sig, disk_preview, tiles=self.PREVIEW_STRIP_FRAMES)
+                result[p] = disk_preview
+                continue
+            if p in self._preview_pending:
+                continue
+            if p in priority_set:
+                priority_misses.append(p)
+            else:
+                background_misses.append(p)
+        # Strips are only a hover extra: never block the listing on them, but queue the visible ones first.
+        if priority_misses:
+            self._schedule_video_previews(priority_misses)
+        if background_misses:
+            self._schedule_video_previews(background_misses)
+        return result
+
+    def _preview_available(self, abs_path: str, sig):
+        """Whether a strip is cached for this file version, without reading it."""
+        with self._thumb_lock:
+            cached = self._preview_cache.get(abs_path)
+            if cached and cached.get("key") == sig and cached.get("preview"):
+                return True
+            meta = self._thumb_disk_index.get(abs_path)
+        key = meta.get("key") if isinstance(meta, dict) else None
+        return bool(key and list(key) == [int(sig[0]), int(sig[1])] and "preview" in (meta.get("variants") or {}))
+
+    def _get_preview_strip_bytes(self, abs_path: str, sig):
+        cached = self._preview_cache.get(abs_path)
+        strip = cached["preview"] if cached and cached.get("key") == sig else self._disk_thumb_get(abs_path, sig, variant="preview")
+        if not strip:
+            if self.has_video_file_extension(abs_path) and abs_path not in self._preview_pending:
+                self._schedule_video_previews([abs_path])
+            return None, None
+        try:
+            return base64.b64decode(strip), "image/jpeg"
+        except Exception:
+            return None, None
+
+    def _generate_video_previews(self, video_paths, max_workers=None):
+        result = {}
+        generated = get_video_preview_strips_in_batch(video_paths, frames=self.PREVIEW_STRIP_FRAMES, max_workers=max_workers) or {}
+        for p, preview in generated.items():
+            sig = self._thumb_sig_from_path(p)
+            if sig:
+                self._preview_cache[p] = {"key": sig, "preview": preview, "ts": time.time()}
+                self._disk_thumb_put(p, sig, preview, variant="preview")
+                self._phash_record(p, sig, preview, tiles=self.PREVIEW_STRIP_FRAMES)
+                result[p] = preview
+        return result
+
+    def _schedule_video_previews(self, video_paths):
+        with self._thumb_lock:
+            self._preview_pending.update(video_paths)
+            if self._preview_executor is None:
+                self._preview_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gallery-previews")
+        self._preview_executor.submit(self._build_video_previews_job, list(video_paths))
+
+    def _build_video_previews_job(self, video_paths):
+        try:
+            batch_size = 16
+            for i in range(0, len(video_paths), batch_size):
+                self._wait_for_generation_idle()
+                self._refresh_thumb_disk_index_if_changed()
+                batch = []
+                for p in video_paths[i:i + batch_size]:
+                    sig = self._thumb_sig_from_path(p)
+                    if sig and not self._disk_thumb_get(p, sig, variant="preview") and self._claim_cache_work("preview", p):
+                        batch.append(p)
+                try:
+                    self._generate_video_previews(batch, max_workers=self._foreground_workers())
+                finally:
+                    for p in batch:
+                        self._release_cache_work("preview", p)
+            self._save_thumb_disk_index(force=True)
+            self._save_phash_index(force=True)
+        except Exception as e:
+            print(f"Could not build video previews: {e}")
+        finally:
+            with self._thumb_lock:
+                self._preview_pending.difference_update(video_paths)
+
+    def _get_audio_probe_cached(self, file_path: str):
+        return self._file_info_cached("audio_probe", file_path, lambda: self.probe_audio_ffprobe(file_path))
+
+    def _get_waveforms_cached(self, audio_paths, file_stats=None, schedule=True):
+        result = {}
+        misses = []
+        for p in audio_paths:
+            sig = self._scan_sig(file_stats, p)
+            if not sig:
+                continue
+            cached = self._thumb_cache.get(p)
+            if cached and cached.get("key") == sig and cached.get("thumb"):
+                cached["ts"] = time.time()
+                result[p] = cached["thumb"]
+                continue
+            disk_thumb = self._disk_thumb_get(p, sig)
+            if disk_thumb:
+                self._thumb_cache[p] = {"key": sig, "thumb": disk_thumb, "ts": time.time()}
+                result[p] = disk_thumb
+                continue
+            if p not in self._waveform_pending:
+                misses.append(p)
+        if misses and schedule:
+            self._schedule_waveforms(misses)
+        return result
+
+    def _schedule_waveforms(self, audio_paths):
+        with self._thumb_lock:
+            self._waveform_pending.update(audio_paths)
+            if self._waveform_executor is None:
+                self._waveform_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gallery-waveforms")
+        self._waveform_executor.submit(self._build_waveforms_job, list(audio_paths))
+
+    def _build_waveforms_job(self, audio_paths):
+        try:
+            for p in audio_paths:
+                self._wait_for_generation_idle()
+                sig = self._thumb_sig_from_path(p)
+                if not sig or self._disk_thumb_get(p, sig) or not self._claim_cache_work("waveform", p):
+                    continue
+                try:
+                    probe = self._get_audio_probe_cached(p) or {}
+                    peaks = compute_audio_peaks(p, buckets=self.WAVEFORM_BUCKETS, duration_s=probe.get("duration_s"))
+                    thumb = render_waveform_as_base64(*peaks) if peaks else None
+                    if thumb and sig == self._thumb_sig_from_path(p):
+                        self._thumb_cache[p] = {"key": sig, "thumb": thumb, "ts": time.time()}
+                        self._disk_thumb_put(p, sig, thumb)
+                finally:
+                    self._release_cache_work("waveform", p)
+            self._save_thumb_disk_index(force=True)
+        except Exception as e:
+            print(f"Could not build audio waveforms: {e}")
+        finally:
+            with self._thumb_lock:
+                self._waveform_pending.difference_update(audio_paths)
+
+    def _frame_decoder_checkout(self, abs_path: str, sig):
+        # A decoder is used by one thread at a time: take it out of the pool (or open another one) so decoding runs without _frame_lock.
+        with self._frame_lock:
+            entry = self._frame_decoders.pop(abs_path, None)
+        if entry and entry["sig"] != sig:
+            close_video_decoder(entry["cap"])
+            entry = None
+        if entry is None:
+            cap, frame_count = open_video_decoder(abs_path)
+            if cap is None:
+                return None
+            entry = {"sig": sig, "cap": cap, "frames": frame_count}
+        return entry
+
+    def _frame_decoder_checkin(self, abs_path: str, entry):
+        evicted = []
+        with self._frame_lock:
+            other = self._frame_decoders.pop(abs_path, None)
+            if other is not None:
+                evicted.append(other)
+            self._frame_decoders[abs_path] = entry
+            while len(self._frame_decoders) > self.FRAME_DECODER_MAX_OPEN:
+                evicted.append(self._frame_decoders.popitem(last=False)[1])
+        for old in evicted:
+            close_video_decoder(old["cap"])
+
+    def _frame_cache_store(self, abs_path: str, sig, frames: dict):
+        for frame_no, img in frames.items():
+            key = (abs_path, sig, frame_no)
+            self._frame_cache[key] = img
+            self._frame_cache.move_to_end(key)
+        while len(self._frame_cache) > self.FRAME_CACHE_MAX_ENTRIES:
+            self._frame_cache.popitem(last=False)
+
+    def _frame_cache_drop(self, abs_path: str):
+        with self._frame_lock:
+            entry = self._frame_decoders.pop(abs_path, None)
+            for key in [k for k in self._frame_cache if k[0] == abs_path]:
+                self._frame_cache.pop(key, None)
+        if entry:
+            close_video_decoder(entry["cap"])
+
+    def _decode_frames(self, abs_path: str, sig, start_frame: int, count: int):
+        entry = self._frame_decoder_checkout(abs_path, sig)
+        if entry is None:
+            return {}
+        start_frame = max(0, start_frame)
+        if entry["frames"] > 0:
+            count = min(count, entry["frames"] - start_frame)
+        frames = {}
+        try:
+            frames = read_video_frames(entry["cap"], start_frame, count)
+        finally:
+            # A frame that failed verification leaves the decoder at an unknown position: drop it rather than trust its frame counter.
+            if len(frames) == count:
+                self._frame_decoder_checkin(abs_path, entry)
+            else:
+                close_video_decoder(entry["cap"])
+        with self._frame_lock:
+            self._frame_cache_store(abs_path, sig, frames)
+        return frames
+
+    def _get_video_frame_cached(self, video_path: str, frame_no: int, prefetch=True):
+        """A decoded frame as PIL. Cached frames are either timestamp-verified cv2 decodes or host decodes, so they are exact."""
+        abs_path = os.path.abspath(video_path)
+        sig = self._thumb_sig_from_path(abs_path)
+        frame_no = int(frame_no)
+        img = None
+        if sig and frame_no >= 0:
+            key = (abs_path, sig, frame_no)
+            with self._frame_lock:
+                img = self._frame_cache.get(key)
+                if img is not None:
+                    self._frame_cache.move_to_end(key)
+            if img is None:
+                img = self._decode_frames(abs_path, sig, frame_no, 1).get(frame_no)
+        if img is None:
+            img = self.get_video_frame(video_path, frame_no, return_PIL=True)
+            if img is not None and sig and frame_no >= 0:
+                with self._frame_lock:
+                    self._frame_cache_store(abs_path, sig, {frame_no: img})
+        if prefetch and sig and self.FRAME_PREFETCH_RADIUS > 0:
+            self._schedule_frame_prefetch(abs_path, sig, frame_no)
+        return img
+
+    def _schedule_frame_prefetch(self, abs_path: str, sig, frame_no: int):
+        job = (abs_path, sig, frame_no)
+        with self._frame_lock:
+            if job in self._frame_prefetch_pending:
+                return
+            self._frame_prefetch_pending.add(job)
+            if self._frame_prefetch_executor is None:
+                self._frame_prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gallery-frame-prefetch")
+        try:
+            self._frame_prefetch_executor.submit(self._prefetch_frames, abs_path, sig, frame_no)
+        except Exception:
+            with self._frame_lock:
+                self._frame_prefetch_pending.discard(job)
+
+    def _prefetch_frames(self, abs_path: str, sig, frame_no: int):
+        self._lower_background_priority()
+        radius = self.FRAME_PREFETCH_RADIUS
+        try:
+            with self._frame_lock:
+                fwd = [n for n in range(frame_no + 1, frame_no + radius + 1) if (abs_path, sig, n) not in self._frame_cache]
+                back = [n for n in range(max(0, frame_no - radius), frame_no) if (abs_path, sig, n) not in self._frame_cache]
+            # Forward first: the decoder already sits right after frame_no, so this needs no seek.
+            if fwd:
+                self._decode_frames(abs_path, sig, fwd[0], fwd[-1] - fwd[0] + 1)
+            if back:
+                self._decode_frames(abs_path, sig, back[0], back[-1] - back[0] + 1)
+        except Exception as e:
+            print(f"Frame prefetch failed for {os.path.basename(abs_path)}: {e}")
+        finally:
+            with self._frame_lock:
+                self._frame_prefetch_pending.discard((abs_path, sig, frame_no))
+
+    def _sprite_disk_paths(self, abs_path: str):
+        sprite_dir = self._gallery_cache_subdir("sprites")
+        if not sprite_dir:
+            return None, None
+        h = hashlib.sha1(abs_path.encode("utf-8", errors="ignore")).hexdigest()
+        return os.path.join(sprite_dir, f"{h}.jpg"), os.path.join(sprite_dir, f"{h}.json")
+
+    def _get_video_sprite(self, video_path: str, schedule=True):
+        abs_path = os.path.abspath(video_path)
+        sig = self._thumb_sig_from_path(abs_path)
+        if not sig:
+            return None
+        img_file, meta_file = self._sprite_disk_paths(abs_path)
+        with self._thumb_lock:
+            cached = self._sprite_cache.get(abs_path)
+            if cached and cached.get("key") == sig:
+                self._sprite_cache.move_to_end(abs_path)
+        if cached and cached.get("key") == sig:
+            if meta_file:
+                self._touch_cache_file(meta_file)
+            return cached
+        try:
+            if img_file and os.path.exists(meta_file) and os.path.exists(img_file):
+                with open(meta_file, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                if isinstance(meta, dict) and meta.get("key") == [int(sig[0]), int(sig[1])] and isinstance(meta.get("layout"), dict):
+                    with open(img_file, "rb") as f:
+                        sprite_b64 = base64.b64encode(f.read()).decode("utf-8")
+                    self._touch_cache_file(meta_file)
+                    return self._sprite_cache_put(abs_path, sig, sprite_b64, meta["layout"])
+        except Exception as e:
+            print(f"Could not read cached sprite for '{abs_path}': {e}")
+        if schedule:
+            self._schedule_video_sprite(abs_path)
+        return None
+
+    def _sprite_cache_put(self, abs_path: str, sig, sprite_b64: str, layout: dict):
+        entry = {"key": sig, "b64": sprite_b64, "layout": layout}
+        with self._thumb_lock:
+            self._sprite_cache[abs_path] = entry
+            self._sprite_cache.move_to_end(abs_path)
+            while len(self._sprite_cache) > self.SPRITE_CACHE_MAX_ENTRIES:
+                self._sprite_cache.popitem(last=False)
+        return entry
+
+    def _schedule_video_sprite(self, video_path: str):
+        abs_path = os.path.abspath(video_path)
+        with self._frame_lock:
+            if abs_path in self._sprite_pending:
+                return
+            self._sprite_pending.add(abs_path)
+            if self._sprite_executor is None:
+                self._sprite_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gallery-sprites")
+        try:
+            self._sprite_executor.submit(self._build_video_sprite_job, abs_path)
+        except Exception:
+            with self._frame_lock:
+                self._sprite_pending.discard(abs_path)
+
+    def _build_video_sprite_job(self, abs_path: str):
+        claimed = False
+        try:
+            self._wait_for_generation_idle()
+            sig = self._thumb_sig_from_path(abs_path)
+            if not sig or self._get_video_sprite(abs_path, schedule=False):
+                return
+            claimed = self._claim_cache_work("sprite", abs_path)
+            if not claimed:
+                return
+            sprite_bytes, layout = build_video_sprite(abs_path)
+            if not sprite_bytes or sig != self._thumb_sig_from_path(abs_path):
+                return
+            img_file, meta_file = self._sprite_disk_paths(abs_path)
+            if img_file:
+                for target, payload, mode in ((img_file, sprite_bytes, "wb"), (meta_file, json.dumps({"key": [int(sig[0]), int(sig[1])], "layout": layout, "path": abs_path}), "w")):
+                    tmp = f"{target}.{os.getpid()}.tmp"
+                    with open(tmp, mode) as f:
+                        f.write(payload)
+                    os.replace(tmp, target)
+            self._sprite_cache_put(abs_path, sig, base64.b64encode(sprite_bytes).decode("utf-8"), layout)
+        except Exception as e:
+            print(f"Could not build sprite sheet for '{abs_path}': {e}")
+        finally:
+            if claimed:
+                self._release_cache_work("sprite", abs_path)
+            with self._frame_lock:
+                self._sprite_pending.discard(abs_path)
+
+    def _sprite_disk_delete(self, abs_path: str):
+        with self._thumb_lock:
+            self._sprite_cache.pop(abs_path, None)
+        for fpath in self._sprite_disk_paths(abs_path):
+            try:
+                if fpath and os.path.exists(fpath):
+                    os.remove(fpath)
+            except Exception as e:
+                print(f"Could not delete cached sprite '{fpath}': {e}")
+
+    def _proxy_disk_paths(self, abs_path: str):
+        proxy_dir = self._gallery_cache_subdir("proxies")
+        if not proxy_dir:
+            return None, None
+        h = hashlib.sha1(abs_path.encode("utf-8", errors="ignore")).hexdigest()
+        return os.path.join(proxy_dir, f"{h}.mp4"), os.path.join(proxy_dir, f"{h}.json")
+
+    def _get_video_proxy(self, video_path: str, schedule=True):
+        abs_path = os.path.abspath(video_path)
+        sig = self._thumb_sig_from_path(abs_path)
+        if not sig or sig[1] < self.PREVIEW_PROXY_MIN_BYTES:
+            return None
+        proxy_file, meta_file = self._proxy_disk_paths(abs_path)
+        cached = self._proxy_cache.get(abs_path)
+        if cached and cached[0] == sig and os.path.exists(cached[1]):
+            self._touch_cache_file(meta_file)
+            return cached[1]
+        try:
+            if proxy_file and os.path.exists(meta_file) and os.path.exists(proxy_file):
+                with open(meta_file, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                if isinstance(meta, dict) and meta.get("key") == [int(sig[0]), int(sig[1])]:
+                    self._proxy_cache[abs_path] = (sig, proxy_file)
+                    self._touch_cache_file(meta_file)
+                    return proxy_file
+        except Exception as e:
+            print(f"Could not read cached preview proxy for '{abs_path}': {e}")
+        if schedule:
+            self._schedule_video_proxy(abs_path)
+        return None
+
+    def _schedule_video_proxy(self, video_path: str):
+        abs_path = os.path.abspath(video_path)
+        with self._frame_lock:
+            if abs_path in self._proxy_pending:
+                return
+            self._proxy_pending.add(abs_path)
+            if self._proxy_executor is None:
+                self._proxy_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gallery-proxies")
+        try:
+            self._proxy_executor.submit(self._build_video_proxy_job, abs_path)
+        except Exception:
+            with self._frame_lock:
+                self._proxy_pending.discard(abs_path)
+
+    def _build_video_proxy_job(self, abs_path: str):
+        claimed = False
+        tmp = None
+        try:
+            self._wait_for_generation_idle()
+            sig = self._thumb_sig_from_path(abs_path)
+            if not sig or self._get_video_proxy(abs_path, schedule=False):
+                return
+            proxy_file, meta_file = self._proxy_disk_paths(abs_path)
+            if not proxy_file:
+                return
+            claimed = self._claim_cache_work("proxy", abs_path)
+            if not claimed:
+                return
+            tmp = f"{proxy_file}.{os.getpid()}.tmp.mp4"
+            h = self.PREVIEW_PROXY_MAX_HEIGHT
+            cmd = self._background_command_prefix() + [
+                "ffmpeg", "-v", "error", "-y",
+                "-i", abs_path,
+                "-map", "0:v:0", "-map", "0:a:0?",
+                "-vf", f"scale=-2:'min({h},ih)'",
+                "-c:v", "libx264", "-preset", "veryfast", "-crf", str(self.PREVIEW_PROXY_CRF), "-pix_fmt", "yuv420p",
+                "-c:a", "aac", "-b:a", "64k",
+                "-movflags", "+faststart",
+                tmp,
+            ]
+            p = subprocess.run(cmd, capture_output=True, text=True, check=False)
+            if p.returncode != 0 or not os.path.exists(tmp):
+                print(f"ffmpeg preview proxy error for '{abs_path}': {p.stderr.strip()[-300:]}")
+                return
+            if sig != self._thumb_sig_from_path(abs_path) or os.path.getsize(tmp) >= sig[1]:
+                return
+            os.replace(tmp, proxy_file)
+            tmp = None
+            meta_tmp = f"{meta_file}.{os.getpid()}.tmp"
+            with open(meta_tmp, "w", encoding="utf-8") as f:
+                json.dump({"key": [int(sig[0]), int(sig[1])], "path": abs_path}, f)
+            os.replace(meta_tmp, meta_file)
+            self._proxy_cache[abs_path] = (sig, proxy_file)
+            self._prune_proxy_disk_cache()
+        except Exception as e:
+            print(f"Could not build preview proxy for '{abs_path}': {e}")
+        finally:
+            if tmp and os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except Exception:
+                    pass
+            if claimed:
+                self._release_cache_work("proxy", abs_path)
+            with self._frame_lock:
+                self._proxy_pending.discard(abs_path)
+
+    def _prune_proxy_disk_cache(self):
+        # Proxies are the largest artifacts by far: keep them under their own cap between reconciler passes, least recently used first.
+        groups = sorted(self._cache_artifact_groups("proxies"), key=lambda g: g[0])
+        total = sum(size for _, size, _ in groups)
+        max_bytes = self.PREVIEW_PROXY_MAX_DISK_MB * 1024 * 1024
+        for _, size, paths in groups:
+            if total <= max_bytes:
+                break
+            for fpath in paths:
+                self._cache_gc_remove(fpath)
+            total -= size
+
+    def _proxy_disk_delete(self, abs_path: str):
+        self._proxy_cache.pop(abs_path, None)
+        for fpath in self._proxy_disk_paths(abs_path):
+            try:
+                if fpath and os.path.exists(fpath):
+                    os.remove(fpath)
+            except Exception as e:
+                print(f"Could not delete cached preview proxy '{fpath}': {e}")
+
+    def _ensure_phash_index(self):
+        if self._phash_index_loaded:
+            return
+        self._ensure_disk_thumb_cache()
+        self._phash_index = {}
+        try:
+            with self._cache_file_lock:
+                self._phash_index = self._read_phash_index_file()
+        except Exception as e:
+            print(f"Could not load gallery perceptual hash index: {e}")
+            self._phash_index = {}
+        self._phash_index_loaded = True
+        self._phash_version += 1
+
+    def _read_phash_index_file(self):
+        index = {}
+        index_file = os.path.join(self._thumb_disk_cache_root, "phash_index.json") if self._thumb_disk_cache_root else None
+        if index_file and os.path.exists(index_file):
+            with open(index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                for p, meta in data.items():
+                    if isinstance(p, str) and isinstance(meta, dict):
+                        key, h = meta.get("key"), meta.get("hash")
+                        if isinstance(key, (list, tuple)) and len(key) == 2 and isinstance(h, str):
+                            index[p] = {"key": [int(key[0]), int(key[1])], "hash": h}
+        return index
+
+    def _mark_phash_index_dirty(self, touched=(), removed=()):
+        with self._thumb_lock:
+            for p in removed:
+                self._phash_touched.discard(p)
+                self._phash_removed.add(p)
+            for p in touched:
+                self._phash_removed.discard(p)
+                self._phash_touched.add(p)
+            self._phash_index_dirty = True
+            self._phash_version += 1
+
+    def _save_phash_index(self, force=False):
+        if not self._phash_index_loaded or not self._thumb_disk_cache_root:
+            return
+        if not self._phash_index_dirty:
+            return
+        now = time.time()
+        if (not force) and (now - self._phash_last_save_ts < 1.0):
+            return
+        index_file = os.path.join(self._thumb_disk_cache_root, "phash_index.json")
+        try:
+            with self._cache_file_lock:
+                disk = self._read_phash_index_file()
+                with self._thumb_lock:
+                    for p in self._phash_removed:
+                        disk.pop(p, None)
+                    for p in self._phash_touched:
+                        if p in self._phash_index:
+                            disk[p] = self._phash_index[p]
+                    self._phash_index = disk
+                    self._phash_touched.clear()
+                    self._phash_removed.clear()
+                    self._phash_index_dirty = False
+                    self._phash_version += 1
+                    snapshot = dict(disk)
+                tmp = index_file + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(snapshot, f, ensure_ascii=False)
+                os.replace(tmp, index_file)
+            self._phash_last_save_ts = now
+        except Exception as e:
+            print(f"Could not save gallery perceptual hash index: {e}")
+
+    def _phash_get(self, abs_path: str, sig):
+        self._ensure_phash_index()
+        meta = self._phash_index.get(abs_path)
+        if not meta or not sig or meta.get("key") != [int(sig[0]), int(sig[1])]:
+            return None
+        return int(meta["hash"], 16)
+
+    def _phash_put(self, abs_path: str, sig, value):
+        if value is None or not sig:
+            return
+        with self._thumb_lock:
+            self._phash_index[abs_path] = {"key": [int(sig[0]), int(sig[1])], "hash": f"{value:016x}"}
+            self._mark_phash_index_dirty(touched=[abs_path])
+
+    def _phash_record(self, abs_path: str, sig, image_b64: str, tiles=1):
+        if self._phash_get(abs_path, sig) is not None:
+            return
+        self._phash_put(abs_path, sig, dhash_from_base64(image_b64, tiles=tiles))
+
+    def _phash_delete(self, abs_path: str):
+        self._ensure_phash_index()
+        with self._thumb_lock:
+            if self._phash_index.pop(abs_path, None) is not None:
+                self._mark_phash_index_dirty(removed=[abs_path])
+
+    def _ensure_lineage_index(self):
+        if self._lineage_loaded:
+            return
+        self._ensure_disk_thumb_cache()
+        index = {}
+        try:
+            with self._cache_file_lock:
+                index = self._read_lineage_index_file()
+        except Exception as e:
+            print(f"Could not load gallery lineage index: {e}")
+        with self._thumb_lock:
+            self._lineage_index = index
+            self._rebuild_lineage_maps()
+            self._lineage_loaded = True
+
+    def _read_lineage_index_file(self):
+        index = {}
+        index_file = os.path.join(self._thumb_disk_cache_root, "lineage_index.json") if self._thumb_disk_cache_root else None
+        if index_file and os.path.exists(index_file):
+            with open(index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                for p, meta in data.items():
+                    # Only merged files are recorded; entries without sources are from older versions that listed every file.
+                    sources = meta.get("sources") if isinstance(meta, dict) else None
+                    if isinstance(p, str) and isinstance(sources, list) and len(sources) == 2:
+                        index[p] = {"sources": sources}
+        return index
+
+    def _rebuild_lineage_maps(self):
+        self._lineage_children = {}
+        for p, meta in self._lineage_index.items():
+            for src in meta.get("sources", ()):
+                self._lineage_children.setdefault(os.path.basename(src), set()).add(p)
+
+    def _mark_lineage_index_dirty(self, touched=(), removed=()):
+        for p in removed:
+            self._lineage_touched.discard(p)
+            self._lineage_removed.add(p)
+        for p in touched:
+            self._lineage_removed.discard(p)
+            self._lineage_touched.add(p)
+        self._lineage_dirty = True
+
+    def _lineage_remove_files(self, paths):
+        self._ensure_lineage_index()
+        with self._thumb_lock:
+            removed = []
+            for p in paths:
+                meta = self._lineage_index.pop(p, None)
+                if meta is None:
+                    continue
+                removed.append(p)
+                for src in meta.get("sources", ()):
+                    self._lineage_children.get(os.path.basename(src), set()).discard(p)
+            if removed:
+                self._mark_lineage_index_dirty(removed=removed)
+
+    def _lineage_record_merge(self, merged_path: str, merge_info):
+        try:
+            sources = [merge_info["source_video_1"].get("abs_path") or merge_info["source_video_1"]["path"],
+                       merge_info["source_video_2"].get("abs_path") or merge_info["source_video_2"]["path"]]
+        except Exception:
+            return
+        self._ensure_lineage_index()
+        merged_abs = os.path.abspath(merged_path)
+        with self._thumb_lock:
+            meta = self._lineage_index.get(merged_abs)
+            if meta is not None and meta.get("sources") == sources:
+                return
+            self._lineage_index[merged_abs] = {"sources": sources}
+            for src in sources:
+                self._lineage_children.setdefault(os.path.basename(src), set()).add(merged_abs)
+            self._mark_lineage_index_dirty(touched=[merged_abs])
+
+    def _lineage_candidates(self, name: str):
+        # Every scanned file is in the storage index, which keeps a basename map for exactly this lookup.
+        with self._thumb_lock:
+            return sorted(self._storage_by_name.get(name, ()))
+
+    def _lineage_resolve(self, source: str):
+        self._ensure_lineage_index()
+        self._ensure_storage_index()
+        with self._thumb_lock:
+            if os.path.isabs(source) and (source in self._storage_index or source in self._lineage_index):
+                return source
+        candidates = self._lineage_candidates(os.path.basename(source))
+        if len(candidates) <= 1:
+            return candidates[0] if candidates else None
+        # Older merges store only a basename; prefer the copy at the top of an output root, as the original lookup did.
+        for root in self._get_roots():
+            preferred = os.path.join(root, source)
+            if preferred in candidates:
+                return preferred
+        # Same basename in several folders and nothing to tell them apart: a wrong source is worse than none.
+        return None
+
+    def _resolve_merge_sources(self, merge_info):
+        resolved = []
+        save_path = self.server_config.get("save_path", "outputs")
+        image_save_path = self.server_config.get("image_save_path", "outputs")
+        for key in ("source_video_1", "source_video_2"):
+            src = merge_info[key].get("abs_path") or merge_info[key]["path"]
+            found = self._lineage_resolve(src)
+            if found is None and (self._storage_tree_scan_running or not self._storage_tree_scanned):
+                # Sources may sit in a subfolder that was never browsed: index the tree in the background so a later selection
+                # finds them, and until then try the path relative to the output roots.
+                self._start_storage_tree_scan(self._get_roots())
+                rel = merge_info[key]["path"]
+                found = next((os.path.abspath(p) for p in [os.path.join(save_path, rel), os.path.join(image_save_path, rel)] if os.path.exists(p)), None)
+            resolved.append(found)
+        return resolved[0], resolved[1]
+
+    def _lineage_children_of(self, source_path: str):
+        self._ensure_lineage_index()
+        source_abs = os.path.abspath(source_path)
+        with self._thumb_lock:
+            candidates = [(p, list(self._lineage_index.get(p, {}).get("sources", ()))) for p in self._lineage_children.get(os.path.basename(source_abs), ())]
+        return sorted(p for p, sources in candidates if any(self._lineage_resolve(src) == source_abs for src in sources))
+
+    def _save_lineage_index(self, force=False):
+        if not self._lineage_loaded or not self._thumb_disk_cache_root or not self._lineage_dirty:
+            return
+        now = time.time()
+        if (not force) and (now - self._lineage_last_save_ts < 5.0):
+            return
+        index_file = os.path.join(self._thumb_disk_cache_root, "lineage_index.json")
+        try:
+            with self._cache_file_lock:
+                disk = self._read_lineage_index_file()
+                with self._thumb_lock:
+                    for p in self._lineage_removed:
+                        disk.pop(p, None)
+                    for p in self._lineage_touched:
+                        if p in self._lineage_index:
+                            disk[p] = self._lineage_index[p]
+                    self._lineage_index = disk
+                    self._rebuild_lineage_maps()
+                    self._lineage_touched.clear()
+                    self._lineage_removed.clear()
+                    self._lineage_dirty = False
+                    snapshot = dict(disk)
+                tmp = index_file + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(snapshot, f, ensure_ascii=False)
+                os.replace(tmp, index_file)
+            self._lineage_last_save_ts = now
+        except Exception as e:
+            print(f"Could not save gallery lineage index: {e}")
+
+    def get_lineage_html(self, file_path: str):
+        children = self._lineage_children_of(file_path)
+        if not children:
+            return ""
+        names = ", ".join(html.escape(os.path.basename(p)) for p in children)
+        return f"<TABLE ID=video_lineage WIDTH=100%><TR><TD style='text-align: right; vertical-align: top; width:1%; white-space:nowrap;'>Used in merges</TD><TD><B>{names}</B></TD></TR></TABLE>"
+
+    def _ensure_storage_index(self):
+        if self._storage_loaded:
+            return
+        self._ensure_disk_thumb_cache()
+        index = {}
+        try:
+            with self._cache_file_lock:
+                index = self._read_storage_index_file()
+                self._storage_base_sig = self._storage_file_sig("storage_index.json")
+                records, self._storage_log_offset = self._read_storage_log(0)
+            for p, entry in records:
+                if entry is None:
+                    index.pop(p, None)
+                else:
+                    index[p] = entry
+        except Exception as e:
+            print(f"Could not load gallery storage index: {e}")
+        with self._thumb_lock:
+            self._storage_index = index
+            self._rebuild_storage_totals()
+            self._storage_loaded = True
+
+    def _storage_file_sig(self, name: str):
+        try:
+            st = os.stat(os.path.join(self._thumb_disk_cache_root, name))
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _read_storage_log(self, offset: int):
+        """Records `(path, entry or None)` appended to storage_index.log after `offset`, and the offset past the last complete line."""
+        records = []
+        try:
+            with open(os.path.join(self._thumb_disk_cache_root, "storage_index.log"), "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            return records, 0
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                p, entry = json.loads(line)
+            except Exception:
+                # A line torn by a crashed writer; the next append terminates it.
+                continue
+            if isinstance(p, str) and entry is None:
+                records.append((p, None))
+            elif isinstance(p, str) and isinstance(entry, list) and len(entry) == 10:
+                records.append((p, self._storage_entry(*entry)))
+        return records, offset + end
+
+    def _read_storage_index_file(self):
+        index = {}
+        index_file = os.path.join(self._thumb_disk_cache_root, "storage_index.json") if self._thumb_disk_cache_root else None
+        if index_file and os.path.exists(index_file):
+            with open(index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                for p, entry in data.items():
+                    # [size, mtime_ns, day, model, ctime, width, height, duration, fps, seed]; model is None until the file's attributes have been read.
+                    if isinstance(p, str) and isinstance(entry, list) and len(entry) == 10:
+                        index[p] = self._storage_entry(entry[0], entry[1], entry[2], entry[3], entry[4], *entry[5:])
+        return index
+
+    def _storage_entry(self, size, mtime_ns, day, model, ctime, width=-1, height=-1, duration=-1, fps=-1, seed=-1):
+        # Immutable tuples with interned day/model strings: a 100k-file index repeats the same few hundred of each.
+        return (int(size), int(mtime_ns), sys.intern(str(day)), sys.intern(model) if isinstance(model, str) else None, float(ctime),
+                float(width), float(height), float(duration), float(fps), float(seed))
+
+    def _rebuild_storage_totals(self):
+        self._storage_by_dir = {}
+        self._storage_by_name = {}
+        self._storage_totals = {"folder": {}, "model": {}, "day": {}}
+        self._file_columns = None
+        for p, entry in self._storage_index.items():
+            self._storage_by_dir.setdefault(os.path.dirname(p), set()).add(p)
+            self._storage_by_name.setdefault(os.path.basename(p), set()).add(p)
+            self._storage_account(p, entry, 1)
+
+    def _file_type(self, path: str):
+        if self.has_video_file_extension(path):
+            return "video"
+        if self.has_image_file_extension(path):
+            return "image"
+        return "audio" if self.has_audio_file_extension(path) else "other"
+
+    def _set_file_columns(self, path: str, entry):
+        size, mtime_ns, _, model, ctime, width, height, duration, fps, seed = entry
+        self._file_columns.set(path, type=self._file_type(path), dir=os.path.dirname(path), size=size, mtime=mtime_ns, ctime=ctime,
+                               width=width, height=height, duration=duration, fps=fps, model=model, seed=seed)
+
+    def _get_file_columns(self):
+        # Built lazily on the first query, then patched entry by entry as the index changes.
+        if self._file_columns is None:
+            self._file_columns = FileColumns()
+            for p, entry in self._storage_index.items():
+                self._set_file_columns(p, entry)
+        return self._file_columns
+
+    def _storage_account(self, path: str, entry, sign: int):
+        for kind, key in (("folder", os.path.dirname(path)), ("model", entry[3]), ("day", entry[2])):
+            totals = self._storage_totals[kind]
+            row = totals.setdefault(key, [0, 0])
+            row[0] += sign
+            row[1] += sign * entry[0]
+            if row[0] <= 0:
+                del totals[key]
+
+    def _storage_index_put(self, path: str, entry):
+        old = self._storage_index.get(path)
+        if old is not None:
+            self._storage_account(path, old, -1)
+        self._storage_index[path] = entry
+        self._storage_by_dir.setdefault(os.path.dirname(path), set()).add(path)
+        self._storage_by_name.setdefault(os.path.basename(path), set()).add(path)
+        self._storage_account(path, entry, 1)
+        if self._file_columns is not None:
+            self._set_file_columns(path, entry)
+
+    def _storage_index_pop(self, path: str):
+        entry = self._storage_index.pop(path, None)
+        if entry is None:
+            return None
+        self._storage_account(path, entry, -1)
+        if self._file_columns is not None:
+            self._file_columns.remove(path)
+        siblings = self._storage_by_dir.get(os.path.dirname(path))
+        if siblings is not None:
+            siblings.discard(path)
+            if not siblings:
+                del self._storage_by_dir[os.path.dirname(path)]
+        namesakes = self._storage_by_name.get(os.path.basename(path))
+        if namesakes is not None:
+            namesakes.discard(path)
+            if not namesakes:
+                del self._storage_by_name[os.path.basename(path)]
+        return entry
+
+    def _storage_set(self, path: str, entry):
+        self._storage_index_put(path, entry)
+        self._storage_attrs_version += 1
+        self._mark_storage_index_dirty(touched=[path])
+
+    def _mark_storage_index_dirty(self, touched=(), removed=()):
+        for p in removed:
+            self._storage_touched.discard(p)
+            self._storage_removed.add(p)
+        for p in touched:
+            self._storage_removed.discard(p)
+            self._storage_touched.add(p)
+        self._storage_dirty = True
+
+    def _storage_sync_listing(self, listing):
+        self._ensure_storage_index()
+        unresolved = []
+        with self._thumb_lock:
+            gone = set(self._storage_by_dir.get(listing.dir, ()))
+            for p, size, mtime_ns, ctime in listing.iter_file_stats():
+                gone.discard(p)
+                entry = self._storage_index.get(p)
+                if entry is None or entry[0] != size or entry[1] != mtime_ns:
+                    entry = self._storage_entry(size, mtime_ns, time.strftime("%Y-%m-%d", time.localtime(mtime_ns / 1e9)), None, ctime)
+                    self._storage_set(p, entry)
+                if entry[3] is None and p not in self._file_attrs_pending:
+                    unresolved.append(p)
+        self._storage_remove_files(gone)
+        if unresolved:
+            self._schedule_file_attrs(unresolved)
+
+    def _storage_remove_files(self, paths):
+        self._ensure_storage_index()
+        with self._thumb_lock:
+            removed = [p for p in paths if self._storage_index_pop(p) is not None]
+            if removed:
+                self._storage_attrs_version += 1
+                self._mark_storage_index_dirty(removed=removed)
+
+    def _schedule_file_attrs(self, paths):
+        with self._thumb_lock:
+            self._file_attrs_pending.update(paths)
+            if self._file_attrs_executor is None:
+                self._file_attrs_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gallery-file-attrs")
+        self._file_attrs_executor.submit(self._build_file_attrs_job, list(paths))
+
+    def _read_media_attrs(self, path: str):
+        """(width, height, duration, fps), -1 where the format has no such attribute."""
+        if self.has_image_file_extension(path):
+            with Image.open(path) as img:
+                width, height = img.size
+            return width, height, -1, -1
+        if self.has_video_file_extension(path):
+            fps, width, height, frames_count = self.get_video_info(path)
+            return width, height, (frames_count / fps) if fps else -1, fps or -1
+        if self.has_audio_file_extension(path):
+            duration = (self.probe_audio_ffprobe(path) or {}).get("duration_s")
+            return -1, -1, duration if duration else -1, -1
+        return -1, -1, -1, -1
+
+    def _storage_attrs_missing(self, path: str, sig):
+        """(settings unread, media unprobed) for a current storage entry."""
+        with self._thumb_lock:
+            entry = self._storage_index.get(path)
+        if entry is None or (entry[1], entry[0]) != tuple(sig) or entry[3] is not None:
+            return False, False
+        return True, all(v == -1 for v in entry[5:9])
+
+    def _apply_file_settings(self, path: str, configs):
+        """Model and seed for the storage index from a file's settings; also records merge lineage."""
+        if not configs:
+            return "", -1
+        if "merge_info" in configs:
+            self._lineage_record_merge(path, configs["merge_info"])
+        return str(configs.get("type", "")).split(" - ")[-1], int(configs.get("seed", -1))
+
+    def _storage_set_attrs(self, path: str, sig, configs, media):
+        # configs None means the format is not one read_embedded_settings understands: the model stays None so the
+        # server's attribute job, using the generator's own loader, still fills it in.
+        model, seed = self._apply_file_settings(path, configs) if configs is not None else (None, -1)
+        with self._thumb_lock:
+            entry = self._storage_index.get(path)
+            if entry is None or (entry[1], entry[0]) != tuple(sig) or entry[3] is not None:
+                return
+            media = media if media is not None else entry[5:9]
+            self._storage_set(path, self._storage_entry(*entry[:3], model, entry[4], *media, seed if configs is not None else entry[9]))
+
+    def _build_file_attrs_job(self, paths):
+        try:
+            for p in paths:
+                self._wait_for_generation_idle()
+                with self._info_lock:
+                    states = list(self._session_states.values())
+                # Settings are read through the generator's own loader, which needs a session state; retry on the next scan.
+                if not states:
+                    return
+                with self._thumb_lock:
+                    entry = self._storage_index.get(p)
+                if entry is None or entry[3] is not None:
+                    continue
+                model, seed, media = "", -1, (-1, -1, -1, -1)
+                try:
+                    result = self.get_settings_from_file(states[-1], p, False, False, False)
+                    model, seed = self._apply_file_settings(p, result[0] if result else None)
+                except Exception as e:
+                    print(f"Could not read settings for {os.path.basename(p)}: {e}")
+                try:
+                    # Offline warm-up may already have probed the file.
+                    media = entry[5:9] if any(v != -1 for v in entry[5:9]) else self._read_media_attrs(p)
+                except Exception as e:
+                    print(f"Could not read media info for {os.path.basename(p)}: {e}")
+                with self._thumb_lock:
+                    entry = self._storage_index.get(p)
+                    if entry is not None and entry[3] is None:
+                        self._storage_set(p, self._storage_entry(*entry[:3], model, entry[4], *media, seed))
+                self._save_storage_index(force=False)
+        except Exception as e:
+            print(f"Could not read gallery file attributes: {e}")
+        finally:
+            with self._thumb_lock:
+                self._file_attrs_pending.difference_update(paths)
+            self._save_storage_index(force=True)
+            self._save_lineage_index(force=True)
+
+    def _save_storage_index(self, force=False):
+        if not self._storage_loaded or not self._thumb_disk_cache_root or not self._storage_dirty:
+            return
+        now = time.time()
+        if (not force) and (now - self._storage_last_save_ts < 5.0):
+            return
+        index_file = os.path.join(self._thumb_disk_cache_root, "storage_index.json")
+        log_file = os.path.join(self._thumb_disk_cache_root, "storage_index.log")
+        try:
+            # Changes go to an append-only log read back from each process's last offset; the full index is only rewritten when the log outgrows it.
+            with self._cache_file_lock:
+                log_sig = self._storage_file_sig("storage_index.log")
+                compacted = self._storage_file_sig("storage_index.json") != self._storage_base_sig or (log_sig[1] if log_sig else 0) < self._storage_log_offset
+                disk = self._read_storage_index_file() if compacted else None
+                records, offset = self._read_storage_log(0 if compacted else self._storage_log_offset)
+                with self._thumb_lock:
+                    mine = self._storage_touched | self._storage_removed
+                    if disk is not None:
+                        for p, entry in records:
+                            if entry is None:
+                                disk.pop(p, None)
+                            else:
+                                disk[p] = entry
+                        for p in self._storage_removed:
+                            disk.pop(p, None)
+                        for p in self._storage_touched:
+                            if p in self._storage_index:
+                                disk[p] = self._storage_index[p]
+                        self._storage_adopt(disk)
+                    else:
+                        changed = False
+                        for p, entry in records:
+                            if p in mine:
+                                continue
+                            if entry is None:
+                                changed = self._storage_index_pop(p) is not None or changed
+                            elif self._storage_index.get(p) != entry:
+                                self._storage_index_put(p, entry)
+                                changed = True
+                        if changed:
+                            self._storage_attrs_version += 1
+                    lines = [json.dumps([p, self._storage_index.get(p)], ensure_ascii=False) for p in mine]
+                    self._storage_touched.clear()
+                    self._storage_removed.clear()
+                    self._storage_dirty = False
+                    log_size = (log_sig[1] if log_sig else 0) + sum(len(line) + 1 for line in lines)
+                    base_sig = self._storage_file_sig("storage_index.json")
+                    snapshot = dict(self._storage_index) if log_size > max(self.STORAGE_LOG_COMPACT_BYTES, base_sig[1] if base_sig else 0) else None
+                if snapshot is not None:
+                    tmp = index_file + ".tmp"
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        json.dump(snapshot, f, ensure_ascii=False)
+                    os.replace(tmp, index_file)
+                    open(log_file, "wb").close()
+                    self._storage_log_offset = 0
+                else:
+                    with open(log_file, "ab") as f:
+                        if f.tell() > offset:
+                            f.write(b"\n")
+                        f.write("".join(line + "\n" for line in lines).encode("utf-8"))
+                        self._storage_log_offset = f.tell()
+                self._storage_base_sig = self._storage_file_sig("storage_index.json")
+            self._storage_last_save_ts = now
+        except Exception as e:
+            print(f"Could not save gallery storage index: {e}")
+
+    def _storage_adopt(self, disk):
+        # Patch totals, folder groups and query columns with what other processes changed; rebuilding them all would stall queries for ~1 s per 100k files.
+        changed = [p for p in self._storage_index if p not in disk]
+        for p in changed:
+            self._storage_index_pop(p)
+        for p, entry in disk.items():
+            if self._storage_index.get(p) != entry:
+                self._storage_index_put(p, entry)
+                changed.append(p)
+        if changed:
+            self._storage_attrs_version += 1
+
+    def _start_storage_tree_scan(self, roots):
+        # Folders that were never browsed have no scan data yet: list the tree once in the background, later updates come from scans and deletes.
+        with self._thumb_lock:
+            if self._storage_tree_scanned:
+                return
+            self._storage_tree_scanned = True
+            self._storage_tree_scan_running = True
+        threading.Thread(target=self._storage_tree_scan_job, args=(roots,), name="gallery-storage-scan", daemon=True).start()
+
+    def _storage_tree_scan_job(self, roots):
+        try:
+            self._lower_background_priority()
+            self._iter_tree_files(roots)
+            self._save_storage_index(force=True)
+        except Exception as e:
+            print(f"Could not list gallery folders for storage usage: {e}")
+        finally:
+            self._storage_tree_scan_running = False
+
+    def get_storage_html(self):
+        roots = self._get_roots()
+        self._start_storage_tree_scan(roots)
+        self._ensure_storage_index()
+        with self._thumb_lock:
+            totals = {kind: dict(rows) for kind, rows in self._storage_totals.items()}
+            pending = len(self._file_attrs_pending)
+
+        def fmt(n):
+            return f"{n / (1024 ** 3):.2f} GB" if n >= 1024 ** 3 else f"{n / (1024 * 1024):.1f} MB"
+
+        def folder_label(d):
+            for root in roots:
+                if d == root or d.startswith(root + os.sep):
+                    return os.path.relpath(d, os.path.dirname(root))
+            return d
+
+        labels = {
+            "folder": folder_label,
+            "model": lambda m: "Not read yet" if m is None else (m or "Unknown model"),
+            "day": lambda d: d,
+        }
+        count = sum(c for c, _ in totals["folder"].values())
+        size = sum(b for _, b in totals["folder"].values())
+        parts = [f"<div class='metadata-content'><p><b>{count} files, {fmt(size)}</b></p>"]
+        for kind, title in (("folder", "Folder"), ("model", "Model"), ("day", "Day")):
+            rows = sorted(totals[kind].items(), key=lambda kv: (kv[0] if kind == "day" else -kv[1][1]), reverse=kind == "day")
+            parts.append(f"<TABLE ID=storage_{kind} WIDTH=100%><TR><TH style='text-align: left;'>{title}</TH><TH>Files</TH><TH>Size</TH></TR>")
+            for key, (n, b) in rows[:self.STORAGE_TOP_ROWS]:
+                parts.append(f"<TR><TD>{html.escape(labels[kind](key))}</TD><TD style='text-align: right;'>{n}</TD><TD style='text-align: right; white-space:nowrap;'>{fmt(b)}</TD></TR>")
+            parts.append("</TABLE>")
+        if self._storage_tree_scan_running:
+            parts.append("<p class='placeholder'>Listing folders that were never opened; reopen this panel for the full totals.</p>")
+        if pending:
+            parts.append(f"<p class='placeholder'>Reading model names for {pending} file(s)...</p>")
+        parts.append("</div>")
+        return "".join(parts)
+
+    def show_storage_usage(self, current_state):
+        self._note_session_state(current_state)
+        self._reset_panel_state(current_state)
+        return gr.HTML(value=self.get_storage_html(), visible=True)
+
+    def _ensure_folder_summaries(self):
+        if self._folder_summaries_loaded:
+            return
+        self._ensure_disk_thumb_cache()
+        summaries = {}
+        try:
+            with self._cache_file_lock:
+                summaries = self._read_folder_summaries_file()
+        except Exception as e:
+            print(f"Could not load gallery folder summaries: {e}")
+        with self._thumb_lock:
+            self._folder_summaries = summaries
+            self._folder_summaries_loaded = True
+
+    def _read_folder_summaries_file(self):
+        summaries = {}
+        index_file = os.path.join(self._thumb_disk_cache_root, "folder_summaries.json") if self._thumb_disk_cache_root else None
+        if index_file and os.path.exists(index_file):
+            with open(index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                for p, meta in data.items():
+                    if isinstance(p, str) and isinstance(meta, dict) and isinstance(meta.get("dir_mtime"), int):
+                        summaries[p] = meta
+        return summaries
+
+    def _save_folder_summaries(self, force=False):
+        if not self._folder_summaries_loaded or not self._thumb_disk_cache_root or not (self._folder_summaries_touched or self._folder_summaries_removed):
+            return
+        now = time.time()
+        if (not force) and (now - self._folder_summaries_last_save_ts < 5.0):
+            return
+        index_file = os.path.join(self._thumb_disk_cache_root, "folder_summaries.json")
+        try:
+            with self._cache_file_lock:
+                disk = self._read_folder_summaries_file()
+                with self._thumb_lock:
+                    for p in self._folder_summaries_removed:
+                        disk.pop(p, None)
+                    for p in self._folder_summaries_touched:
+                        if p in self._folder_summaries:
+                            disk[p] = self._folder_summaries[p]
+                    self._folder_summaries = disk
+                    self._folder_summaries_touched.clear()
+                    self._folder_summaries_removed.clear()
+                    snapshot = dict(disk)
+                tmp = index_file + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(snapshot, f, ensure_ascii=False)
+                os.replace(tmp, index_file)
+            self._folder_summaries_last_save_ts = now
+        except Exception as e:
+            print(f"Could not save gallery folder summaries: {e}")
 
-    def _invalidate_scan_cache_for_dir(self, dir_path: str):
-        self._scan_cache.pop(os.path.abspath(dir_path), None)
+    def _folder_summaries_remove(self, folder_path: str):
+        with self._thumb_lock:
+            if self._folder_summaries.pop(folder_path, None) is not None:
+                self._folder_summaries_touched.discard(folder_path)
+                self._folder_summaries_removed.add(folder_path)
 
-    def _scan_dir_non_recursive_cached(self, dir_path: str, force_refresh=False, incremental_refresh=False):
-        dir_abs = os.path.abspath(dir_path)
-        if (not force_refresh) and (dir_abs in self._scan_cache):
-            cached = self._scan_cache.get(dir_abs, {"folders": [], "files": []})
-            return {"folders": list(cached.get("folders", [])), "files": list(cached.get("files", []))}
-        old = self._scan_cache.get(dir_abs, {"folders": [], "files": []})
-        old_files_set = set(old.get("files", []))
-        folders = []
-        files = []
-        seen_folders = set()
+    def _get_folder_summaries(self, folder_paths):
+        """Summaries still valid for each folder's current mtime; the rest are queued and show up on a later render."""
+        self._ensure_folder_summaries()
+        result = {}
+        misses = []
+        for p in folder_paths:
+            dir_mtime = self._dir_mtime_ns(p)
+            if dir_mtime is None:
+                continue
+            meta = self._folder_summaries.get(p)
+            if meta and meta.get("dir_mtime") == dir_mtime:
+                result[p] = meta
+            elif p not in self._folder_summary_pending:
+                misses.append(p)
+        if misses:
+            self._schedule_folder_summaries(misses)
+        return result
+
+    def _schedule_folder_summaries(self, folder_paths):
+        with self._thumb_lock:
+            self._folder_summary_pending.update(folder_paths)
+            if self._folder_summary_executor is None:
+                self._folder_summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gallery-folder-summaries")
+        self._folder_summary_executor.submit(self._build_folder_summaries_job, list(folder_paths))
+
+    def _build_folder_summaries_job(self, folder_paths):
         try:
-            entries = os.listdir(dir_abs)
+            for p in folder_paths:
+                self._wait_for_generation_idle()
+                dir_mtime = self._dir_mtime_ns(p)
+                if dir_mtime is None:
+                    self._folder_summaries_remove(p)
+                    continue
+                # Read-only: a summary must not rescan the folder through the shared cache and its index side effects.
+                listing = self._scan_cache_get(p, touch=False)
+                if listing is None or listing.dir_mtime != dir_mtime:
+                    try:
+                        listing = self._load_dir_snapshot(p, dir_mtime) or self._read_dir_listing(p, dir_mtime)
+                    except OSError as e:
+                        print(f"Could not list dir {p}: {e}")
+                        continue
+                newest = sorted(listing.iter_file_stats(), key=lambda row: row[3], reverse=True)
+                tiles = []
+                for f, size, mtime_ns, _ in newest[:8]:
+                    tile = self._folder_mosaic_tile(f, (mtime_ns, size))
+                    if tile is not None:
+                        tiles.append(tile)
+                        if len(tiles) == 4:
+                            break
+                meta = {
+                    "dir_mtime": dir_mtime,
+                    "files": len(listing.files),
+                    "bytes": int(sum(listing.sizes)),
+                    "mosaic": build_folder_mosaic(tiles, tile_size=self.FOLDER_MOSAIC_TILE),
+                }
+                with self._thumb_lock:
+                    self._folder_summaries[p] = meta
+                    self._folder_summaries_touched.add(p)
+                    self._folder_summaries_removed.discard(p)
+                self._save_folder_summaries(force=False)
         except Exception as e:
-            print(f"Could not list dir {dir_abs}: {e}")
-            self._scan_cache[dir_abs] = {"folders": [], "files": []}
-            return {"folders": [], "files": []}
-        for name in entries:
-            full = os.path.abspath(os.path.join(dir_abs, name))
-            try:
-                if os.path.isdir(full):
-                    if full not in seen_folders:
-                        seen_folders.add(full)
-                        folders.append({"path": full, "name": name})
-            except Exception:
-                continue
-        for name in entries:
-            full = os.path.abspath(os.path.join(dir_abs, name))
-            try:
-                if os.path.isfile(full) and (
-                    self.has_video_file_extension(name)
-                    or self.has_image_file_extension(name)
-                    or self.has_audio_file_extension(name)
-                ):
-                    files.append(full)
-            except Exception:
+            print(f"Could not build gallery folder summaries: {e}")
+        finally:
+            with self._thumb_lock:
+                self._folder_summary_pending.difference_update(folder_paths)
+            self._save_folder_summaries(force=True)
+
+    def _folder_mosaic_tile(self, file_path: str, sig, size=128):
+        is_video = self.has_video_file_extension(file_path)
+        thumb = self._disk_thumb_get(file_path, sig)
+        if thumb:
+            return load_mosaic_tile(file_path, thumb, size=size)
+        preview = self._disk_thumb_get(file_path, sig, variant="preview") if is_video else None
+        if preview:
+            return load_mosaic_tile(file_path, preview, strip_frames=self.PREVIEW_STRIP_FRAMES, size=size)
+        if is_video or self.has_image_file_extension(file_path):
+            return load_mosaic_tile(file_path, is_video=is_video, size=size)
+        return None
+
+    def _iter_tree_files(self, roots, stats=None):
+        files = []
+        seen_dirs = set()
+        stack = list(roots)
+        while stack:
+            d = stack.pop()
+            if d in seen_dirs:
                 continue
-        if incremental_refresh:
-            new_files_set = set(files)
-            deleted_files = old_files_set - new_files_set
-            for p in deleted_files:
-                self._thumb_cache.pop(p, None)
-                self._disk_thumb_delete(p)
-            for p in new_files_set:
-                cached_thumb = self._thumb_cache.get(p)
-                current_sig = self._thumb_sig_from_path(p)
-                if cached_thumb and ((not current_sig) or (cached_thumb.get("key") != current_sig)):
-                    self._thumb_cache.pop(p, None)
-                disk_meta = self._thumb_disk_index.get(p) if self._disk_cache_initialized else None
-                if disk_meta and current_sig:
-                    dkey = disk_meta.get("key")
-                    if not (isinstance(dkey, (list, tuple)) and len(dkey) == 2 and [int(dkey[0]), int(dkey[1])] == [int(current_sig[0]), int(current_sig[1])]):
-                        self._disk_thumb_delete(p)
-                elif disk_meta and not current_sig:
-                    self._disk_thumb_delete(p)
-        self._scan_cache[dir_abs] = {"folders": folders, "files": files}
-        return {"folders": list(folders), "files": list(files)}
+            seen_dirs.add(d)
+            scan = self._scan_dir_non_recursive_cached(d)
+            files.extend(scan.files)
+            stack.extend(scan.folders)
+            if stats is not None:
+                for f, size, mtime_ns, ctime in scan.iter_file_stats():
+                    stats[f] = (size, mtime_ns, ctime)
+        return files
 
-    def _get_thumbnails_cached(self, file_paths, priority_paths=None):
-        result = {}
-        priority_set = set(priority_paths or [])
-        priority_misses = []
-        normal_misses = []
-        for p in file_paths:
+    def _indexed_tree_files(self, roots, stats=None):
+        """Files under `roots` known to the storage index, read without touching the disk; starts the background tree scan that fills it."""
+        self._ensure_storage_index()
+        self._start_storage_tree_scan(roots)
+        prefixes = tuple(os.path.join(r, "") for r in roots)
+        with self._thumb_lock:
+            files = [p for p in self._storage_index if p.startswith(prefixes)]
+            if stats is not None:
+                for p in files:
+                    entry = self._storage_index[p]
+                    stats[p] = (entry[0], entry[1], entry[4])
+        return files
+
+    def _missing_phashes(self, file_paths, file_stats=None):
+        return [p for p in file_paths if (self.has_image_file_extension(p) or self.has_video_file_extension(p))
+                and self._phash_get(p, self._scan_sig(file_stats, p)) is None]
+
+    def _schedule_phashes(self, file_paths):
+        with self._thumb_lock:
+            file_paths = [p for p in file_paths if p not in self._phash_pending]
+            if not file_paths:
+                return
+            self._phash_pending.update(file_paths)
+            if self._phash_executor is None:
+                self._phash_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gallery-phashes")
+        self._phash_executor.submit(self._build_phashes_job, file_paths)
+
+    def _build_phashes_job(self, file_paths):
+        try:
+            self._lower_background_priority()
+            batch_size = 32
+            for i in range(0, len(file_paths), batch_size):
+                self._wait_for_generation_idle()
+                self._ensure_phashes(file_paths[i:i + batch_size])
+        except Exception as e:
+            print(f"Could not build similarity hashes: {e}")
+        finally:
+            with self._thumb_lock:
+                self._phash_pending.difference_update(file_paths)
+
+    def _ensure_phashes(self, file_paths):
+        missing = self._missing_phashes(file_paths)
+        missing_images = [p for p in missing if self.has_image_file_extension(p)]
+        missing_videos = [p for p in missing if self.has_video_file_extension(p)]
+        if missing_images:
+            self._get_thumbnails_cached(missing_images)
+            for p in missing_images:
+                sig = self._thumb_sig_from_path(p)
+                if sig and self._phash_get(p, sig) is None:
+                    self._phash_put(p, sig, dhash_from_file(p))
+        if missing_videos:
+            self._get_thumbnails_cached(missing_videos)
+            still_missing = [p for p in missing_videos if self._phash_get(p, self._thumb_sig_from_path(p)) is None]
+            if still_missing:
+                self._generate_video_previews(still_missing)
+        self._save_phash_index(force=True)
+
+    def _warm_cache_chunk(self, chunk):
+        """Decode one chunk of files for warm_gallery_caches; touches no shared cache state."""
+        need_thumb = [p for p, sig, thumb, _, _, _ in chunk if thumb]
+        thumbs = get_thumbnails_in_batch_windows(need_thumb, variant_sizes=self.THUMB_VARIANT_SIZES) or {}
+        previews, hashes, attrs, claimed = {}, {}, {}, []
+        for p, sig, _, preview, need_settings, need_media in chunk:
+            if need_settings:
+                media = None
+                if need_media:
+                    try:
+                        media = self._read_media_attrs(p)
+                    except Exception as e:
+                        print(f"Could not read media info for {os.path.basename(p)}: {e}")
+                configs = read_embedded_settings(p)
+                if configs is None and (self.has_video_file_extension(p) or self.has_image_file_extension(p)):
+                    configs = {}
+                attrs[p] = (configs, media)
+            if preview and self._claim_cache_work("preview", p):
+                claimed.append(p)
+                b64, _ = get_video_preview_strip_as_base64(p, frames=self.PREVIEW_STRIP_FRAMES)
+                if b64:
+                    previews[p] = b64
+            elif self.has_image_file_extension(p) and p not in thumbs and self._phash_get(p, sig) is None:
+                hashes[p] = dhash_from_file(p)
+        return chunk, thumbs, previews, hashes, attrs, claimed
+
+    def warm_gallery_caches(self, workers=4, progress=None, chunk_size=16):
+        """Fill the on-disk thumbnail, preview, perceptual hash, file attribute and lineage caches for every file under the output roots."""
+        roots = self._get_roots()
+        self._ensure_disk_thumb_cache()
+        self._ensure_phash_index()
+        self._ensure_storage_index()
+        self._ensure_lineage_index()
+        self._refresh_thumb_disk_index_if_changed()
+        files = self._iter_tree_files(roots)
+        todo = []
+        for p in files:
             sig = self._thumb_sig_from_path(p)
             if not sig:
                 continue
-            cached = self._thumb_cache.get(p)
-            if cached and cached.get("key") == sig and cached.get("thumb"):
-                cached["ts"] = time.time()
-                result[p] = cached["thumb"]
-                continue
-            disk_thumb = self._disk_thumb_get(p, sig)
-            if disk_thumb:
-                self._thumb_cache[p] = {"key": sig, "thumb": disk_thumb, "ts": time.time()}
-                result[p] = disk_thumb
+            is_video = self.has_video_file_extension(p)
+            need_thumb = os.name == "nt" and (is_video or self.has_image_file_extension(p)) and not self._disk_thumb_get(p, sig)
+            need_preview = is_video and not self._disk_thumb_get(p, sig, variant="preview")
+            need_hash = self._phash_get(p, sig) is None and not is_video and self.has_image_file_extension(p)
+            need_settings, need_media = self._storage_attrs_missing(p, sig)
+            if need_settings or need_thumb or need_preview or need_hash:
+                todo.append((p, sig, need_thumb, need_preview, need_settings, need_media))
+        # Newest first: the disk cache is capped, so the most recent outputs are the ones worth keeping.
+        todo.sort(key=lambda t: t[1][0], reverse=True)
+        total, done = len(todo), 0
+        if progress:
+            progress(0, total, len(files))
+        chunks = [todo[i:i + chunk_size] for i in range(0, total, chunk_size)]
+        last_save = time.time()
+        executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="gallery-warm")
+        futures = [executor.submit(self._warm_cache_chunk, c) for c in chunks]
+        try:
+            for fut in as_completed(futures):
+                try:
+                    chunk, thumbs, previews, hashes, attrs, claimed = fut.result()
+                except Exception as e:
+                    print(f"Could not warm gallery cache chunk: {e}")
+                    continue
+                try:
+                    for p, sig, _, _, _, _ in chunk:
+                        if sig != self._thumb_sig_from_path(p):
+                            continue
+                        if p in attrs:
+                            self._storage_set_attrs(p, sig, *attrs[p])
+                        if p in thumbs:
+                            thumb, variants = thumbs[p]
+                            self._disk_thumb_put(p, sig, thumb)
+                            for variant, data in variants.items():
+                                self._disk_thumb_put(p, sig, data, variant=variant)
+                            self._phash_record(p, sig, thumb)
+                        if p in previews:
+                            self._disk_thumb_put(p, sig, previews[p], variant="preview")
+                            self._phash_record(p, sig, previews[p], tiles=self.PREVIEW_STRIP_FRAMES)
+                        if hashes.get(p) is not None:
+                            self._phash_put(p, sig, hashes[p])
+                finally:
+                    for p in claimed:
+                        self._release_cache_work("preview", p)
+                done += len(chunk)
+                if progress:
+                    progress(done, total, len(files))
+                # Save as we go so an interrupted run resumes where it stopped.
+                if time.time() - last_save > 10:
+                    self._save_thumb_disk_index(force=True)
+                    self._save_phash_index(force=True)
+                    self._save_storage_index(force=True)
+                    self._save_lineage_index(force=True)
+                    last_save = time.time()
+        finally:
+            for fut in futures:
+                fut.cancel()
+            executor.shutdown(wait=True)
+            self._save_thumb_disk_index(force=True)
+            self._save_phash_index(force=True)
+            self._save_storage_index(force=True)
+            self._save_lineage_index(force=True)
+        return done
+
+    def _get_phash_trees(self):
+        self._ensure_phash_index()
+        if self._phash_trees is not None and self._phash_trees_version == self._phash_version:
+            return self._phash_trees
+        trees = {"image": BKTree(), "video": BKTree()}
+        with self._thumb_lock:
+            entries = list(self._phash_index.items())
+        for p, meta in entries:
+            kind = "video" if self.has_video_file_extension(p) else "image"
+            trees[kind].add(int(meta["hash"], 16), p)
+        self._phash_trees = trees
+        self._phash_trees_version = self._phash_version
+        return trees
+
+    def _find_similar_groups(self, file_paths, anchor_path=None, file_stats=None):
+        candidates = set(file_paths)
+        trees = self._get_phash_trees()
+        hashes = {}
+        for p in file_paths:
+            h = self._phash_get(p, self._scan_sig(file_stats, p, fresh=p == anchor_path))
+            if h is not None:
+                hashes[p] = h
+        if anchor_path:
+            h = hashes.get(anchor_path)
+            if h is None:
+                return []
+            tree = trees["video" if self.has_video_file_extension(anchor_path) else "image"]
+            matches = sorted((dist, q) for q, dist in tree.search(h, self.PHASH_DUPLICATE_THRESHOLD) if q in candidates)
+            return [[q for _, q in matches]] if len(matches) > 1 else []
+        parent = {p: p for p in hashes}
+
+        def find(p):
+            while parent[p] != p:
+                parent[p] = parent[parent[p]]
+                p = parent[p]
+            return p
+
+        for p, h in hashes.items():
+            tree = trees["video" if self.has_video_file_extension(p) else "image"]
+            for q, _ in tree.search(h, self.PHASH_DUPLICATE_THRESHOLD):
+                if q in parent and q != p:
+                    rp, rq = find(p), find(q)
+                    if rp != rq:
+                        parent[rq] = rp
+        groups = {}
+        for p in hashes:
+            groups.setdefault(find(p), []).append(p)
+        result = []
+        for members in groups.values():
+            if len(members) > 1:
+                members.sort(key=lambda p: (file_stats or {}).get(p, (0, 0, 0))[2], reverse=True)
+                result.append(members)
+        result.sort(key=len, reverse=True)
+        return result
+
+    def find_duplicate_files(self, selection_str, current_state, current_dir=""):
+        roots = self._get_roots()
+        selected = [os.path.abspath(p) for p in (selection_str.split('||') if selection_str else []) if p]
+        anchor_path = selected[0] if len(selected) == 1 else None
+        file_stats = {}
+        tree_files = self._indexed_tree_files(roots, stats=file_stats)
+        if anchor_path and anchor_path not in file_stats:
+            tree_files.append(anchor_path)
+        if anchor_path:
+            self._ensure_phashes([anchor_path])
+        # Hashing a whole tree can take minutes: group what is hashed now and fill in the rest in the background.
+        missing = self._missing_phashes(tree_files, file_stats)
+        if missing:
+            self._schedule_phashes(missing)
+        pending_note = f" {len(missing)} file(s) are still being hashed; run again later for complete results." if missing else ""
+        if self._storage_tree_scan_running:
+            pending_note += " The output folders are still being indexed; run again later for complete results."
+        groups = self._find_similar_groups(tree_files, anchor_path=anchor_path, file_stats=file_stats)
+        if not groups:
+            gr.Info(("No similar files found." if anchor_path else "No duplicates found.") + pending_note)
+            return self.list_output_files_as_html(current_state, current_dir)
+        file_items, group_labels, extras = [], {}, []
+        for i, members in enumerate(groups, 1):
+            label = f"Similar to {html.escape(os.path.basename(anchor_path))}" if anchor_path else f"Group {i} · {len(members)} similar files"
+            group_labels[members[0]] = label
+            file_items.extend(members)
+            extras.extend(m for m in members[1:] if m != anchor_path)
+        thumb_targets = [p for p in file_items if self.has_video_file_extension(p) or self.has_image_file_extension(p)]
+        listing = {
+            "roots": roots,
+            "cur_abs": current_dir or "",
+            "folder_items": [],
+            "file_items": file_items,
+            "thumbnails_dict": self._get_thumbnails_cached(thumb_targets, file_stats=file_stats),
+            "previews_dict": self._get_video_previews_cached([p for p in thumb_targets if self.has_video_file_extension(p)], file_stats=file_stats),
+            "file_stats": file_stats,
+            "group_labels": group_labels,
+            "selected_paths": extras,
+        }
+        gr.Info(f"Found {len(groups)} group(s) of similar files; {len(extras)} extra copies pre-selected.{pending_note}")
+        self._remember_gallery_listing(current_state, listing)
+        return self._render_gallery_from_listing(listing)
+
+    def _parse_gallery_query(self, text: str):
+        """Split `column<op>value` terms, e.g. `type=video duration>5 height>=720 model~wan sort=-ctime scope=all`, into (filters, sort, descending, whole_tree, ignored)."""
+        filters, sort, descending, whole_tree, ignored = [], "ctime", True, False, []
+        try:
+            terms = shlex.split(text or "")
+        except ValueError:
+            terms = (text or "").split()
+        for term in terms:
+            match = self.GALLERY_QUERY_TERM.match(term)
+            if not match:
+                ignored.append(term)
                 continue
-            if p in priority_set:
-                priority_misses.append(p)
+            name, op, value = match.group(1).lower(), match.group(2), match.group(3)
+            op = "==" if op == "=" else op
+            if name == "sort" and op == "==":
+                descending = value.startswith("-")
+                sort = value.lstrip("-+").lower()
+                if sort not in FileColumns.NUMERIC_COLUMNS and sort not in FileColumns.LABEL_COLUMNS:
+                    ignored.append(term)
+                    sort, descending = "ctime", True
+            elif name == "scope" and op == "==":
+                whole_tree = value.lower() in ("all", "tree")
+            elif name in FileColumns.LABEL_COLUMNS and op in ("==", "!=", "~"):
+                values = [v for v in value.split(",") if v]
+                filters.append((name, "in" if op == "==" else op, values))
+            elif name in FileColumns.NUMERIC_COLUMNS and op != "~":
+                try:
+                    filters.append((name, op, float(value)))
+                except ValueError:
+                    ignored.append(term)
             else:
-                normal_misses.append(p)
-        to_generate = priority_misses + normal_misses
-        if to_generate:
-            generated = get_thumbnails_in_batch_windows(to_generate) or {}
-            for p in to_generate:
-                thumb = generated.get(p)
-                if thumb:
-                    sig = self._thumb_sig_from_path(p)
-                    if sig:
-                        now = time.time()
-                        self._thumb_cache[p] = {"key": sig, "thumb": thumb, "ts": now}
-                        self._disk_thumb_put(p, sig, thumb)
-                        result[p] = thumb
-        self._prune_thumb_cache()
-        return result
+                ignored.append(term)
+        return filters, sort, descending, whole_tree, ignored
 
-    def _build_gallery_listing(self, current_dir="", force_refresh=False, incremental_refresh=False):
+    def _query_file_columns(self, filters, sort="ctime", descending=True):
+        self._ensure_storage_index()
+        with self._thumb_lock:
+            columns = self._get_file_columns()
+            paths = columns.query(filters, sort, descending)
+            stats = {p: (columns.get(p, "size"), columns.get(p, "mtime"), columns.get(p, "ctime")) for p in paths}
+        return paths, stats
+
+    def _build_gallery_listing(self, current_dir="", force_refresh=False, incremental_refresh=False, query=""):
         roots = self._get_roots()
         cur = (current_dir or "").strip()
         cur_abs = os.path.abspath(cur) if cur else ""
@@ -355,6 +3166,7 @@ class GalleryPlugin(WAN2GPPlugin):
             cur_abs = ""
         folder_items = []
         file_items = []
+        file_stats = {}
         seen_files = set()
         seen_folders = set()
 
@@ -375,31 +3187,50 @@ class GalleryPlugin(WAN2GPPlugin):
         if not cur_abs:
             for r in roots:
                 scan = self._scan_dir_non_recursive_cached(r, force_refresh=force_refresh, incremental_refresh=incremental_refresh)
-                for fo in scan["folders"]:
-                    add_folder(fo["path"], fo["name"])
-                for f in scan["files"]:
+                for fo_path, fo_name in scan.iter_folders():
+                    add_folder(fo_path, fo_name)
+                for f, size, mtime_ns, ctime in scan.iter_file_stats():
+                    file_stats[f] = (size, mtime_ns, ctime)
                     add_file(f)
         else:
             parent = os.path.abspath(os.path.join(cur_abs, os.pardir))
             if parent and parent != cur_abs and self._is_within_roots(parent, roots):
                 add_folder(parent, "⬆️ ..")
             scan = self._scan_dir_non_recursive_cached(cur_abs, force_refresh=force_refresh, incremental_refresh=incremental_refresh)
-            for fo in scan["folders"]:
-                add_folder(fo["path"], fo["name"])
-            for f in scan["files"]:
+            for fo_path, fo_name in scan.iter_folders():
+                add_folder(fo_path, fo_name)
+            for f, size, mtime_ns, ctime in scan.iter_file_stats():
+                file_stats[f] = (size, mtime_ns, ctime)
                 add_file(f)
 
+        if query:
+            filters, sort, descending, whole_tree, _ = self._parse_gallery_query(query)
+            if whole_tree:
+                # Answered from the storage index; folders never listed are indexed in the background and show up on a later query.
+                self._start_storage_tree_scan(roots)
+                folder_items = []
+            else:
+                filters.append(("dir", "in", [cur_abs] if cur_abs else roots))
+            file_items, column_stats = self._query_file_columns(filters, sort, descending)
+            for p, st in column_stats.items():
+                file_stats.setdefault(p, st)
+        else:
+            try:
+                file_items.sort(key=lambda p: file_stats[p][2] if p in file_stats else os.path.getctime(p), reverse=True)
+            except Exception:
+                file_items.sort(reverse=True)
         folder_items.sort(key=lambda x: x["name"].lower())
-        try:
-            file_items.sort(key=os.path.getctime, reverse=True)
-        except Exception:
-            file_items.sort(reverse=True)
+        folder_summaries = self._get_folder_summaries([fo["path"] for fo in folder_items if fo["name"] != "⬆️ .."])
 
         thumb_targets = [p for p in file_items if self.has_video_file_extension(p) or self.has_image_file_extension(p)]
         visible_total_slots = 36
         visible_file_slots = max(0, visible_total_slots - len(folder_items))
         priority_thumb_targets = thumb_targets[:visible_file_slots]
-        thumbnails_dict = self._get_thumbnails_cached(thumb_targets, priority_paths=priority_thumb_targets)
+        thumbnails_dict = self._get_thumbnails_cached(thumb_targets, priority_paths=priority_thumb_targets, file_stats=file_stats)
+        video_targets = [p for p in thumb_targets if self.has_video_file_extension(p)]
+        priority_video_targets = [p for p in priority_thumb_targets if self.has_video_file_extension(p)]
+        previews_dict = self._get_video_previews_cached(video_targets, priority_paths=priority_video_targets, file_stats=file_stats)
+        thumbnails_dict.update(self._get_waveforms_cached([p for p in file_items if self.has_audio_file_extension(p)], file_stats=file_stats))
 
         return {
             "roots": roots,
@@ -407,60 +3238,141 @@ class GalleryPlugin(WAN2GPPlugin):
             "folder_items": folder_items,
             "file_items": file_items,
             "thumbnails_dict": thumbnails_dict,
+            "previews_dict": previews_dict,
+            "file_stats": file_stats,
+            "folder_summaries": folder_summaries,
         }
 
+    def _thumb_srcset(self, abs_path: str, sig):
+        # Larger variants are served by the listing API; without it the inline base thumbnail is all there is.
+        if not self._listing_api_active or not sig:
+            return ""
+        url = f"/gallery_api/thumb?path={quote(abs_path)}&amp;v={sig[0]}"
+        return ", ".join(f"{url}&amp;w={size} {size / 128:g}x" for size in self.THUMB_VARIANT_SIZES)
+
+    def _preview_url(self, abs_path: str, sig):
+        if not self._listing_api_active or not sig or not self.has_video_file_extension(abs_path):
+            return ""
+        return f"/gallery_api/thumb?path={quote(abs_path)}&amp;variant=preview&amp;v={sig[0]}"
+
+    def _render_file_fragment(self, f: str, base64_thumb, preview_b64, srcset="", preview_url=""):
+        """Markup for one file tile after its opening `<div class="gallery-item…"`, as a tuple of string pieces; thumbnails are referenced, not copied."""
+        basename = os.path.basename(f)
+        display_name = basename
+        match = self.DISPLAY_NAME_PATTERN.search(basename)
+        if match:
+            display_name = match.group(1)
+        is_video = self.has_video_file_extension(f)
+        is_audio = self.has_audio_file_extension(f)
+        srcset_attr = f' srcset="{srcset}"' if srcset else ""
+        if is_audio and base64_thumb:
+            thumb_parts = ('<img src="data:image/jpeg;base64,', base64_thumb, '" alt="waveform">')
+        elif is_audio:
+            thumb_parts = ("""
+                    <div style="font-size:42px;line-height:1;display:flex;align-items:center;justify-content:center;height:100%;">
+                        🔊
+                    </div>
+                """,)
+        else:
+            preview_b64 = preview_b64 if is_video else None
+            strip_style = f"background-size:{self.PREVIEW_STRIP_FRAMES * 100}% auto;"
+            if preview_url and (preview_b64 or base64_thumb):
+                # Served by URL: a hover strip is only fetched on first hover; a strip standing in for the thumbnail loads with the page.
+                if base64_thumb:
+                    strip_div = f'<div class="gallery-hover-preview" data-frames="{self.PREVIEW_STRIP_FRAMES}" data-src="{preview_url}" style="{strip_style}"></div>'
+                    thumb_parts = ('<img src="data:image/jpeg;base64,', base64_thumb, f'"{srcset_attr} alt="thumb">', strip_div)
+                else:
+                    thumb_parts = (f'<div class="gallery-hover-preview gallery-hover-preview-static" data-frames="{self.PREVIEW_STRIP_FRAMES}" style="background-image:url({preview_url});{strip_style}"></div>',)
+            elif preview_url:
+                thumb_parts = (f'<video muted preload="metadata" src="/gradio_api/file={f}#t=0.5"></video>'
+                               f'<div class="gallery-hover-preview" data-frames="{self.PREVIEW_STRIP_FRAMES}" data-src="{preview_url}" style="{strip_style}"></div>',)
+            elif preview_b64:
+                preview_class = "gallery-hover-preview" if base64_thumb else "gallery-hover-preview gallery-hover-preview-static"
+                thumb_parts = (
+                    ('<img src="data:image/jpeg;base64,', base64_thumb, f'"{srcset_attr} alt="thumb">') if base64_thumb else ()
+                ) + (
+                    f'<div class="{preview_class}" data-frames="{self.PREVIEW_STRIP_FRAMES}" style="background-image:url(data:image/jpeg;base64,',
+                    preview_b64,
+                    f');background-size:{self.PREVIEW_STRIP_FRAMES * 100}% auto;"></div>',
+                )
+            elif base64_thumb:
+                thumb_parts = ('<img src="data:image/jpeg;base64,', base64_thumb, f'"{srcset_attr} alt="thumb">')
+            elif is_video:
+                thumb_parts = (f'<video muted preload="metadata" src="/gradio_api/file={f}#t=0.5"></video>',)
+            else:
+                thumb_parts = (f'<img src="/gradio_api/file={f}" alt="thumb">',)
+        hover_attrs = ' onmousemove="scrubGalleryPreview(event, this)" onmouseleave="resetGalleryPreview(this)"' if is_video else ""
+        safe_path = json.dumps(f, ensure_ascii=False)
+        return (f""" data-path={safe_path} onclick="selectGalleryItem(event, this)">
+                <div class="gallery-item-thumbnail"{hover_attrs}>""",) + thumb_parts + (f"""</div>
+                <div class="gallery-item-name" title="{basename}">{display_name}</div>
+            </div>
+            """,)
+
     def _render_gallery_from_listing(self, listing):
         cur_abs = listing["cur_abs"]
         folder_items = listing["folder_items"]
         file_items = listing["file_items"]
         thumbnails_dict = listing["thumbnails_dict"]
-        items_html = ""
+        previews_dict = listing.get("previews_dict", {})
+        group_labels = listing.get("group_labels", {})
+        selected_paths = listing.get("selected_paths", [])
+        selected_set = set(selected_paths)
+        file_stats = listing.get("file_stats")
+        folder_summaries = listing.get("folder_summaries", {})
+        parts = ["<div class='gallery-grid'>"]
 
         for fo in folder_items:
             fpath = fo["path"]
             display_name = fo["name"]
             safe_path = json.dumps(fpath, ensure_ascii=False)
-            items_html += f"""
+            summary = folder_summaries.get(fpath)
+            thumb_html = "📁"
+            if summary:
+                size_mb = summary["bytes"] / (1024 * 1024)
+                size_text = f"{size_mb / 1024:.1f} GB" if size_mb >= 1024 else f"{size_mb:.1f} MB"
+                stats_html = f'<div class="gallery-folder-stats">{summary["files"]} files · {size_text}</div>'
+                thumb_html = (f'<img src="data:image/jpeg;base64,{summary["mosaic"]}" alt="folder">' if summary.get("mosaic") else "📁") + stats_html
+            parts.append(f"""
             <div class="gallery-item gallery-folder" data-path={safe_path} ondblclick="openGalleryFolder(event, this)">
                 <div class="gallery-item-thumbnail" style="display:flex;align-items:center;justify-content:center;font-size:42px;">
-                    📁
+                    {thumb_html}
                 </div>
                 <div class="gallery-item-name" title="{display_name}">{display_name}</div>
             </div>
-            """
+            """)
 
         for f in file_items:
-            basename = os.path.basename(f)
-            display_name = basename
-            match = re.search(r'_seed\d+_(.+)\.(mp4|jpg|jpeg|png|webp|wav|mp3|flac|ogg|m4a|aac)$', basename, re.IGNORECASE)
-            if match:
-                display_name = match.group(1)
-            is_video = self.has_video_file_extension(f)
-            is_audio = self.has_audio_file_extension(f)
-            base64_thumb = thumbnails_dict.get(os.path.abspath(f))
-            if is_audio:
-                thumbnail_html = """
-                    <div style="font-size:42px;line-height:1;display:flex;align-items:center;justify-content:center;height:100%;">
-                        🔊
-                    </div>
-                """
+            if f in group_labels:
+                parts.append(f'<div class="gallery-group-label">{group_labels[f]}</div>')
+            abs_f = os.path.abspath(f)
+            base64_thumb = thumbnails_dict.get(abs_f)
+            preview_b64 = previews_dict.get(abs_f)
+            sig = self._scan_sig(file_stats, abs_f)
+            srcset = self._thumb_srcset(abs_f, sig) if base64_thumb else ""
+            preview_url = self._preview_url(abs_f, sig)
+            # Cached fragments hold 0/1 placeholders instead of the base64 data, so they never keep evicted thumbnails alive.
+            key = (sig, bool(base64_thumb), bool(preview_b64), srcset, preview_url)
+            with self._thumb_lock:
+                cached = self._fragment_cache.get(f)
+                if cached and cached[0] == key:
+                    self._fragment_cache.move_to_end(f)
+            if cached and cached[0] == key:
+                template = cached[1]
             else:
-                thumbnail_html = (
-                    f'<img src="data:image/jpeg;base64,{base64_thumb}" alt="thumb">'
-                    if base64_thumb else
-                    (f'<video muted preload="metadata" src="/gradio_api/file={f}#t=0.5"></video>'
-                     if is_video
-                     else f'<img src="/gradio_api/file={f}" alt="thumb">')
-                )
-            safe_path = json.dumps(f, ensure_ascii=False)
-            items_html += f"""
-            <div class="gallery-item" data-path={safe_path} onclick="selectGalleryItem(event, this)">
-                <div class="gallery-item-thumbnail">{thumbnail_html}</div>
-                <div class="gallery-item-name" title="{basename}">{display_name}</div>
-            </div>
-            """
+                fragment = self._render_file_fragment(f, base64_thumb, preview_b64, srcset, preview_url)
+                template = tuple(0 if piece is base64_thumb else 1 if piece is preview_b64 else piece for piece in fragment)
+                with self._thumb_lock:
+                    self._fragment_cache[f] = (key, template)
+            parts.append('\n            <div class="gallery-item selected"' if f in selected_set else '\n            <div class="gallery-item"')
+            parts.extend(base64_thumb if piece == 0 else preview_b64 if piece == 1 else piece for piece in template)
+        with self._thumb_lock:
+            while len(self._fragment_cache) > self.FRAGMENT_CACHE_MAX_ENTRIES:
+                self._fragment_cache.popitem(last=False)
+
+        parts.append("</div>")
+        full_html = "".join(parts)
 
-        full_html = f"<div class='gallery-grid'>{items_html}</div>"
 
         clear_metadata_html = """
         <div class='metadata-content'>
@@ -470,7 +3382,7 @@ class GalleryPlugin(WAN2GPPlugin):
 
         return {
             self.gallery_html_output: full_html,
-            self.selected_files_for_backend: "",
+            self.selected_files_for_backend: "||".join(selected_paths),
             self.metadata_panel_output: clear_metadata_html,
             self.join_videos_btn: gr.Button(visible=False),
             self.recreate_join_btn: gr.Button(visible=False),
@@ -488,10 +3400,244 @@ class GalleryPlugin(WAN2GPPlugin):
             self.current_gallery_dir: cur_abs if cur_abs else ""
         }
 
-    def refresh_gallery_files(self, current_state, current_dir=""):
-        listing = self._build_gallery_listing(current_dir=current_dir, force_refresh=True, incremental_refresh=True)
+    def refresh_gallery_files(self, current_state, current_dir="", request: gr.Request = None):
+        self._ensure_listing_api(request)
+        listing = self._build_gallery_listing(current_dir=current_dir, force_refresh=True, incremental_refresh=True, query=self._gallery_query(current_state))
+        self._remember_gallery_listing(current_state, listing)
         return self._render_gallery_from_listing(listing)
 
+    def _ensure_listing_api(self, request=None):
+        if self._listing_api_registered:
+            return
+        app = None
+        try:
+            app = request.request.app if request is not None and getattr(request, "request", None) is not None else None
+        except Exception:
+            app = None
+        if app is None:
+            app = getattr(getattr(self, "main", None), "app", None)
+        if app is None or not hasattr(app, "add_api_route"):
+            return
+        self._listing_api_registered = True
+        if getattr(app, "auth", None):
+            print("Gallery listing API not exposed: the server has authentication enabled.")
+            return
+        try:
+            from fastapi import Request
+            from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+            def listing_endpoint(request: Request):
+                status, etag, payload = self.get_gallery_listing_json(dict(request.query_params), request.headers.get("if-none-match"))
+                headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+                if status == 304:
+                    return Response(status_code=304, headers=headers)
+                return JSONResponse(payload, status_code=status, headers=headers)
+
+            def thumb_endpoint(request: Request):
+                try:
+                    width = int(request.query_params.get("w", 0))
+                except ValueError:
+                    width = 0
+                accept_webp = "image/webp" in request.headers.get("accept", "")
+                data, mime = self.get_gallery_thumb_bytes(request.query_params.get("path", ""), width, accept_webp, request.query_params.get("variant", ""))
+                if not data:
+                    return Response(status_code=404)
+                return Response(content=data, media_type=mime, headers={"Cache-Control": "public, max-age=31536000, immutable", "Vary": "Accept"})
+
+            app.add_api_route("/gallery_api/listing", listing_endpoint, methods=["GET"])
+            def export_endpoint(request: Request):
+                stream = self.iter_selection_export(request.query_params.get("token", ""))
+                if stream is None:
+                    return Response(status_code=404)
+                filename = time.strftime("gallery_export_%Y%m%d_%H%M%S.zip")
+                return StreamingResponse(stream, media_type="application/zip", headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+            app.add_api_route("/gallery_api/thumb", thumb_endpoint, methods=["GET"])
+            app.add_api_route("/gallery_api/export", export_endpoint, methods=["GET"])
+            self._listing_api_active = True
+        except Exception as e:
+            print(f"Could not register gallery listing API: {e}")
+
+    def prepare_selection_export(self, selection_str, request: gr.Request = None):
+        self._ensure_listing_api(request)
+        file_paths = [os.path.abspath(p) for p in (selection_str.split('||') if selection_str else []) if p]
+        file_paths = [p for p in file_paths if self._is_within_roots(p) and os.path.isfile(p)]
+        if not file_paths:
+            gr.Warning("No files selected for export.")
+            return ""
+        if not self._listing_api_active:
+            gr.Warning("Export is unavailable: the gallery download route could not be registered on this server.")
+            return ""
+        now = time.time()
+        for t, (_, expires) in list(self._export_tokens.items()):
+            if expires < now:
+                self._export_tokens.pop(t, None)
+        token = secrets.token_urlsafe(16)
+        self._export_tokens[token] = (file_paths, now + self.EXPORT_TOKEN_TTL_SECONDS)
+        gr.Info(f"Exporting {len(file_paths)} file(s)...")
+        return token
+
+    def _export_entries(self, file_paths):
+        roots = self._get_roots()
+        seen = set()
+        for p in file_paths:
+            root = next((r for r in roots if self._is_within_roots(p, [r])), None)
+            arc_base = os.path.relpath(p, root) if root else os.path.basename(p)
+            arc_base = arc_base.replace(os.sep, "/")
+            sources = [p] + [os.path.splitext(p)[0] + ext for ext in self.METADATA_SIDECAR_EXTENSIONS]
+            for src in sources:
+                if src != p and not os.path.isfile(src):
+                    continue
+                arcname = os.path.splitext(arc_base)[0] + os.path.splitext(src)[1] if src != p else arc_base
+                if arcname in seen:
+                    continue
+                seen.add(arcname)
+                yield src, arcname, os.path.splitext(src)[1].lower() in self.EXPORT_STORED_EXTENSIONS
+
+    def iter_selection_export(self, token: str):
+        entry = self._export_tokens.get(token or "")
+        if not entry or entry[1] < time.time():
+            return None
+        return iter_zip_stream(self._export_entries(entry[0]))
+
+    def _listing_etag(self, dirs, params):
+        parts = [repr(sorted(params.items()))]
+        for d in dirs:
+            parts.append(f"{d}:{self._dir_mtime_ns(d)}")
+        return '"' + hashlib.sha1("|".join(parts).encode("utf-8", errors="ignore")).hexdigest() + '"'
+
+    def get_gallery_listing_json(self, query, if_none_match=None):
+        roots = self._get_roots()
+        current_dir = query.get("dir", "") or ""
+        if current_dir and not (os.path.isdir(current_dir) and self._is_within_roots(current_dir, roots)):
+            return 404, None, {"error": "unknown directory"}
+        cur_abs = os.path.abspath(current_dir) if current_dir else ""
+        sort_key = query.get("sort", "ctime")
+        column_sort = sort_key in ("width", "height", "duration", "fps", "seed", "model")
+        if sort_key not in ("name", "type") and not column_sort:
+            sort_key = "ctime"
+        descending = query.get("order", "desc") != "asc"
+        filter_text = query.get("q", "") or ""
+        use_columns = bool(filter_text) or column_sort
+        try:
+            page = max(0, int(query.get("page", 0)))
+            page_size = min(1000, max(1, int(query.get("page_size", 100))))
+        except ValueError:
+            return 400, None, {"error": "page and page_size must be integers"}
+        params = {"dir": cur_abs, "sort": sort_key, "order": "desc" if descending else "asc", "page": page, "page_size": page_size, "q": filter_text}
+        if use_columns:
+            # Attributes are filled in the background without touching directory mtimes.
+            params["attrs"] = self._storage_attrs_version
+        dirs = [cur_abs] if cur_abs else roots
+        # Thumbnails and previews finish in the background without touching directory mtimes either; only the listed folders' count.
+        with self._thumb_lock:
+            if use_columns and self._parse_gallery_query(filter_text)[3]:
+                params["thumbs"] = sum(self._thumb_dir_versions.values())
+            else:
+                params["thumbs"] = [self._thumb_dir_versions.get(d, 0) for d in dirs]
+        etag = self._listing_etag(dirs, params)
+        if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+            return 304, etag, None
+
+        # A directory whose mtime moved since it was cached gets an incremental rescan; untouched ones stay cache hits.
+        stale = any(getattr(self._scan_cache_get(d, touch=False), "dir_mtime", None) != self._dir_mtime_ns(d) for d in dirs)
+        column_query = f"{filter_text} sort={'-' if descending else ''}{sort_key if column_sort else 'ctime'}" if use_columns else ""
+        listing = self._build_gallery_listing(current_dir=cur_abs, force_refresh=stale, incremental_refresh=stale, query=column_query)
+        file_stats = listing.get("file_stats", {})
+        file_type = self._file_type
+
+        sorters = {
+            "ctime": lambda p: file_stats.get(p, (0, 0, 0))[2],
+            "mtime": lambda p: file_stats.get(p, (0, 0, 0))[1],
+            "size": lambda p: file_stats.get(p, (0, 0, 0))[0],
+            "name": lambda p: os.path.basename(p).lower(),
+            "type": lambda p: (file_type(p), os.path.basename(p).lower()),
+        }
+        files = listing["file_items"] if column_sort else sorted(listing["file_items"], key=sorters[sort_key], reverse=descending)
+        items = []
+        for p in files[page * page_size:(page + 1) * page_size]:
+            size, mtime_ns, ctime = file_stats.get(p, (None, None, None))
+            items.append({
+                "path": p,
+                "name": os.path.basename(p),
+                "type": file_type(p),
+                "size": size,
+                "mtime": mtime_ns / 1e9 if mtime_ns is not None else None,
+                "ctime": ctime,
+                "thumb_url": f"/gallery_api/thumb?path={quote(p)}&v={mtime_ns}" if self._thumb_servable(p, listing) else None,
+            })
+        payload = {
+            "dir": cur_abs,
+            "roots": listing["roots"],
+            "sort": sort_key,
+            "order": params["order"],
+            "page": page,
+            "page_size": page_size,
+            "total": len(files),
+            "folders": [{"path": fo["path"], "name": fo["name"]} for fo in listing["folder_items"] if fo["name"] != "⬆️ .."],
+            "items": items,
+        }
+        return 200, etag, payload
+
+    def _thumb_servable(self, path: str, listing):
+        # Only Windows produces shell thumbnails; elsewhere the thumb route derives one from the preview strip or the image itself.
+        return path in listing["thumbnails_dict"] or path in listing["previews_dict"] or self.has_image_file_extension(path)
+
+    def _derive_disk_thumb(self, abs_path: str, sig):
+        img = self._folder_mosaic_tile(abs_path, sig, size=max(self.THUMB_VARIANT_SIZES))
+        if img is None:
+            return None
+        thumb, variants = encode_thumbnail_variants(img, variant_sizes=self.THUMB_VARIANT_SIZES)
+        self._disk_thumb_put(abs_path, sig, thumb)
+        for variant, data in variants.items():
+            self._disk_thumb_put(abs_path, sig, data, variant=variant)
+        self._save_thumb_disk_index(force=False)
+        return thumb
+
+    def get_gallery_thumb_bytes(self, file_path: str, width=0, accept_webp=True, variant=""):
+        if not file_path or not self._is_within_roots(file_path):
+            return None, None
+        abs_path = os.path.abspath(file_path)
+        sig = self._thumb_sig_from_path(abs_path)
+        if not sig:
+            return None, None
+        if variant == "preview":
+            return self._get_preview_strip_bytes(abs_path, sig)
+        # Smallest stored variant that covers the requested width; the base JPEG when nothing larger is needed or cached.
+        if width:
+            formats = ("webp", "jpeg") if accept_webp else ("jpeg", "webp")
+            for size in sorted(s for s in self.THUMB_VARIANT_SIZES if s >= width) + sorted((s for s in self.THUMB_VARIANT_SIZES if s < width), reverse=True):
+                for fmt in formats:
+                    data = self._disk_thumb_get(abs_path, sig, variant=f"{fmt}{size}")
+                    if not data:
+                        continue
+                    raw = base64.b64decode(data)
+                    if fmt == "webp" and not accept_webp:
+                        raw = self._transcode_to_jpeg(raw)
+                        if not raw:
+                            continue
+                    return raw, f"image/{fmt}" if fmt == "webp" and accept_webp else "image/jpeg"
+        cached = self._thumb_cache.get(abs_path)
+        thumb = cached["thumb"] if cached and cached.get("key") == sig else self._disk_thumb_get(abs_path, sig)
+        if not thumb:
+            thumb = self._derive_disk_thumb(abs_path, sig)
+            if thumb and width:
+                return self.get_gallery_thumb_bytes(abs_path, width, accept_webp)
+        try:
+            return (base64.b64decode(thumb), "image/jpeg") if thumb else (None, None)
+        except Exception:
+            return None, None
+
+    def _transcode_to_jpeg(self, raw: bytes):
+        try:
+            img = Image.open(io.BytesIO(raw)).convert("RGB")
+            buffer = io.BytesIO()
+            img.save(buffer, format="JPEG", quality=80)
+            return buffer.getvalue()
+        except Exception as e:
+            print(f"Could not transcode thumbnail to JPEG: {e}")
+            return None
+
     def create_gallery_ui(self):
         css = """
             #gallery-layout {
@@ -531,6 +3677,13 @@ class GalleryPlugin(WAN2GPPlugin):
                 transition: all 0.2s ease-in-out;
                 box-shadow: 0 1px 3px rgba(0,0,0,0.1);
             }
+            .gallery-group-label {
+                grid-column: 1 / -1;
+                font-size: 13px;
+                font-weight: bold;
+                padding-top: 6px;
+                border-bottom: 1px solid var(--border-color-primary);
+            }
             .gallery-item:hover {
                 border-color: var(--border-color-accent);
                 transform: translateY(-2px);
@@ -540,6 +3693,7 @@ class GalleryPlugin(WAN2GPPlugin):
                 box-shadow: 0 0 0 3px var(--primary-200);
             }
             .gallery-item-thumbnail {
+                position: relative;
                 flex-grow: 1;
                 background-color: var(--panel-background-fill);
                 display: flex;
@@ -552,6 +3706,31 @@ class GalleryPlugin(WAN2GPPlugin):
                 height: 100%;
                 object-fit: contain;
             }
+            .gallery-hover-preview {
+                display: none;
+                position: absolute;
+                inset: 0;
+                background-repeat: no-repeat;
+                background-position: 0% 50%;
+                background-color: var(--panel-background-fill);
+            }
+            .gallery-item:hover .gallery-hover-preview, .gallery-hover-preview-static {
+                display: block;
+            }
+            .gallery-item:hover .gallery-hover-preview[data-src]:not(.gallery-hover-preview-loaded) {
+                display: none;
+            }
+            .gallery-folder-stats {
+                position: absolute;
+                left: 0;
+                right: 0;
+                bottom: 0;
+                padding: 2px 4px;
+                font-size: 11px;
+                text-align: center;
+                color: #fff;
+                background-color: rgba(0, 0, 0, 0.55);
+            }
             .gallery-item-name {
                 padding: 4px 8px;
                 font-size: 12px;
@@ -566,6 +3745,23 @@ class GalleryPlugin(WAN2GPPlugin):
                 align-items: center;
                 justify-content: center;
             }
+            .video-joiner-player {
+                position: relative;
+            }
+            .joiner-sprite-view {
+                display: none;
+                position: absolute;
+                top: 0;
+                left: 0;
+                width: 100%;
+                z-index: 2;
+                pointer-events: none;
+                background-repeat: no-repeat;
+                background-color: #000;
+            }
+            .video-joiner-player.sprite-scrubbing .joiner-sprite-view {
+                display: block;
+            }
             .metadata-content {
                 font-family: monospace;
                 font-size: 13px;
@@ -619,7 +3815,37 @@ class GalleryPlugin(WAN2GPPlugin):
                     const selectedItems = Array.from(gallery.querySelectorAll('.gallery-item.selected'));
                     const selectedPaths = selectedItems.map(el => el.dataset.path);
                     selectedFilesInput.value = selectedPaths.join('||');
-                    selectedFilesInput.dispatchEvent(new Event('input', { bubbles: true }));
+                    clearTimeout(window.gallerySelectTimer);
+                    window.gallerySelectTimer = setTimeout(() => {
+                        selectedFilesInput.dispatchEvent(new Event('input', { bubbles: true }));
+                    }, 150);
+                };
+
+                window.scrubGalleryPreview = function(event, element) {
+                    const strip = element.querySelector('.gallery-hover-preview');
+                    if (!strip) return;
+                    if (strip.dataset.src && !strip.classList.contains('gallery-hover-preview-loaded')) {
+                        if (strip.dataset.loading) return;
+                        strip.dataset.loading = '1';
+                        const img = new Image();
+                        img.onload = () => {
+                            strip.style.backgroundImage = `url("${strip.dataset.src}")`;
+                            strip.classList.add('gallery-hover-preview-loaded');
+                        };
+                        // Not built yet: the request queued it, try again on a later hover.
+                        img.onerror = () => setTimeout(() => { delete strip.dataset.loading; }, 3000);
+                        img.src = strip.dataset.src;
+                    }
+                    const frames = parseInt(strip.dataset.frames || '1', 10);
+                    const rect = element.getBoundingClientRect();
+                    const ratio = rect.width > 0 ? (event.clientX - rect.left) / rect.width : 0;
+                    const frame = Math.max(0, Math.min(frames - 1, Math.floor(ratio * frames)));
+                    strip.style.backgroundPosition = frames > 1 ? `${(frame / (frames - 1)) * 100}% 50%` : '0% 50%';
+                };
+
+                window.resetGalleryPreview = function(element) {
+                    const strip = element.querySelector('.gallery-hover-preview');
+                    if (strip) strip.style.backgroundPosition = '0% 50%';
                 };
 
                 window.openGalleryFolder = function(event, element) {
@@ -635,6 +3861,7 @@ class GalleryPlugin(WAN2GPPlugin):
                     dirInput.dispatchEvent(new Event('input', { bubbles: true }));
 
                     if (selectedFilesInput) {
+                        clearTimeout(window.gallerySelectTimer);
                         selectedFilesInput.value = "";
                         selectedFilesInput.dispatchEvent(new Event('input', { bubbles: true }));
                     }
@@ -679,23 +3906,54 @@ class GalleryPlugin(WAN2GPPlugin):
                         }
                     });
 
+                    const spriteView = container.querySelector('.joiner-sprite-view');
+                    const spriteCols = parseInt(container.dataset.spriteCols || '0', 10);
+                    const spriteRows = parseInt(container.dataset.spriteRows || '0', 10);
+                    const spriteStep = parseInt(container.dataset.spriteStep || '1', 10);
+                    const spriteTiles = parseInt(container.dataset.spriteTiles || '0', 10);
+
+                    function showSpriteFrame(frameNumber) {
+                        const tile = Math.max(0, Math.min(Math.floor((frameNumber - 1) / spriteStep), spriteTiles - 1));
+                        const col = tile % spriteCols;
+                        const row = Math.floor(tile / spriteCols);
+                        const x = spriteCols > 1 ? (col / (spriteCols - 1)) * 100 : 0;
+                        const y = spriteRows > 1 ? (row / (spriteRows - 1)) * 100 : 0;
+                        spriteView.style.backgroundPosition = `${x}% ${y}%`;
+                        container.classList.add('sprite-scrubbing');
+                    }
+
                     const handleSliderInput = () => {
                         const sliderInput = sliderContainer.querySelector('input[type="range"]');
                         if (sliderInput) {
                             isSeekingFromSlider = true;
                             const frameNumber = parseInt(sliderInput.value, 10);
                             clearTimeout(debounceTimer);
+                            if (spriteView && spriteTiles > 0) {
+                                showSpriteFrame(frameNumber);
+                                return;
+                            }
                             debounceTimer = setTimeout(() => {
                                 updateVideoToFrame(frameNumber);
                             }, 50);
                         }
                     };
 
+                    const handleSliderCommit = () => {
+                        if (!spriteView || spriteTiles <= 0) return;
+                        const sliderInput = sliderContainer.querySelector('input[type="range"]');
+                        if (!sliderInput) return;
+                        isSeekingFromSlider = true;
+                        video.addEventListener('seeked', () => container.classList.remove('sprite-scrubbing'), { once: true });
+                        updateVideoToFrame(parseInt(sliderInput.value, 10));
+                        setTimeout(() => container.classList.remove('sprite-scrubbing'), 1000);
+                    };
+
                     const handleInteractionEnd = () => {
                         setTimeout(() => { isSeekingFromSlider = false; }, 150);
                     };
 
                     sliderContainer.addEventListener('input', handleSliderInput);
+                    sliderContainer.addEventListener('change', handleSliderCommit);
                     sliderContainer.addEventListener('mouseup', handleInteractionEnd);
                     sliderContainer.addEventListener('touchend', handleInteractionEnd);
                 }
@@ -774,7 +4032,12 @@ class GalleryPlugin(WAN2GPPlugin):
             with gr.Column(elem_id="gallery_tab_container"):
                 with gr.Row():
                     self.refresh_gallery_files_btn = gr.Button("Refresh Files")
+                    self.find_duplicates_btn = gr.Button("Find Similar / Duplicates")
+                    self.export_selection_btn = gr.Button("Export Selection")
+                    self.storage_usage_btn = gr.Button("Storage Usage")
                     self.delete_files_btn = gr.Button("Delete selected File", elem_id="stop-button")
+                with gr.Row():
+                    self.gallery_query_box = gr.Textbox(show_label=False, placeholder="Filter / sort, e.g. type=video duration>5 height>=720 model~wan sort=-ctime scope=all (Enter to apply)")
                 with gr.Row(elem_id="gallery-layout"):
                     self.gallery_html_output = gr.HTML(
                         value="<div class='gallery-grid'><p class='placeholder'>Click 'Refresh Files' to load gallery.</p></div>",
@@ -826,6 +4089,7 @@ class GalleryPlugin(WAN2GPPlugin):
                 self.current_gallery_dir = gr.Text(label="Current Gallery Dir", visible=False, elem_id="current-gallery-dir")
                 self.path_for_settings_loader = gr.Text(label="Path for Settings Loader", visible=False)
                 self.current_selected_video_path = gr.Text(visible=False)
+                self.export_token = gr.Text(visible=False)
 
         outputs_list = [
             self.gallery_html_output,
@@ -848,7 +4112,8 @@ class GalleryPlugin(WAN2GPPlugin):
         ]
         no_updates = {comp: gr.update() for comp in outputs_list}
 
-        def on_tab_select(current_state, current_dir, evt: gr.SelectData):
+        def on_tab_select(current_state, current_dir, evt: gr.SelectData, request: gr.Request):
+            self._ensure_listing_api(request)
             if evt.value == "Gallery" and not self.loaded_once:
                 self.loaded_once = True
                 return self.list_output_files_as_html(current_state, current_dir)
@@ -874,6 +4139,38 @@ class GalleryPlugin(WAN2GPPlugin):
             show_progress="hidden"
         )
 
+        self.gallery_query_box.submit(
+            fn=self.apply_gallery_query,
+            inputs=[self.gallery_query_box, self.state, self.current_gallery_dir],
+            outputs=outputs_list,
+            show_progress="hidden"
+        )
+
+        self.find_duplicates_btn.click(
+            fn=self.find_duplicate_files,
+            inputs=[self.selected_files_for_backend, self.state, self.current_gallery_dir],
+            outputs=outputs_list
+        )
+
+        self.export_selection_btn.click(
+            fn=self.prepare_selection_export,
+            inputs=[self.selected_files_for_backend],
+            outputs=[self.export_token],
+            show_progress="hidden"
+        ).then(
+            fn=None,
+            inputs=[self.export_token],
+            js="""(token) => {
+                if (token) { window.location.href = '/gallery_api/export?token=' + encodeURIComponent(token); }
+            }"""
+        )
+
+        self.storage_usage_btn.click(
+            fn=self.show_storage_usage,
+            inputs=[self.state],
+            outputs=[self.metadata_panel_output]
+        )
+
         self.delete_files_btn.click(
             fn=self.delete_selected_files,
             inputs=[self.selected_files_for_backend, self.state, self.current_gallery_dir],
@@ -892,7 +4189,8 @@ class GalleryPlugin(WAN2GPPlugin):
                 self.merge_source1_prompt, self.merge_source1_image, self.merge_source2_prompt, self.merge_source2_image,
                 self.current_frame_buttons_row, self.current_selected_video_path
             ],
-            show_progress="hidden"
+            show_progress="hidden",
+            trigger_mode="always_last"
         )
 
         self.use_as_start_btn.click(
@@ -982,7 +4280,7 @@ class GalleryPlugin(WAN2GPPlugin):
             print(f"Debug parsed: video_path={video_path}, time={current_time}")
             fps, _, _, _ = self.get_video_info(video_path)
             frame_number = int(current_time * fps)
-            current_frame = self.get_video_frame(video_path, frame_number, return_PIL=True)
+            current_frame = self._get_video_frame_cached(video_path, frame_number)
             gr.Info(f"Current frame (frame {frame_number + 1}) set as Start-Image.")
             return {
                 self.image_start: [(current_frame, "Current Frame")],
@@ -1008,7 +4306,7 @@ class GalleryPlugin(WAN2GPPlugin):
             print(f"Debug parsed: video_path={video_path}, time={current_time}")
             fps, _, _, _ = self.get_video_info(video_path)
             frame_number = int(current_time * fps)
-            current_frame = self.get_video_frame(video_path, frame_number, return_PIL=True)
+            current_frame = self._get_video_frame_cached(video_path, frame_number)
             gr.Info(f"Current frame (frame {frame_number + 1}) set as End-Image.")
             return {
                 self.image_end: [(current_frame, "Current Frame")],
@@ -1039,12 +4337,18 @@ class GalleryPlugin(WAN2GPPlugin):
                     abs_file = os.path.abspath(file_path)
                     touched_dirs.add(os.path.abspath(os.path.dirname(abs_file)))
                     self._thumb_cache.pop(abs_file, None)
+                    self._preview_cache.pop(abs_file, None)
                     self._disk_thumb_delete(abs_file)
+                    self._phash_delete(abs_file)
+                    self._frame_cache_drop(abs_file)
+                    self._sprite_disk_delete(abs_file)
+                    self._proxy_disk_delete(abs_file)
+                    self._lineage_remove_files([abs_file])
+                    self._storage_remove_files([abs_file])
                     os.remove(file_path)
                     deleted_count += 1
                     base_path = os.path.splitext(file_path)[0]
-                    metadata_extensions = ['.txt', '.json', '.metadata']
-                    for ext in metadata_extensions:
+                    for ext in self.METADATA_SIDECAR_EXTENSIONS:
                         metadata_path = base_path + ext
                         if os.path.exists(metadata_path):
                             try:
@@ -1062,6 +4366,9 @@ class GalleryPlugin(WAN2GPPlugin):
             self._invalidate_scan_cache_for_dir(d)
 
         self._save_thumb_disk_index(force=True)
+        self._save_phash_index(force=True)
+        self._save_lineage_index(force=True)
+        self._save_storage_index(force=True)
 
         if deleted_count > 0:
             gr.Info(f"Successfully deleted {deleted_count} file(s).")
@@ -1070,11 +4377,32 @@ class GalleryPlugin(WAN2GPPlugin):
 
         return self.refresh_gallery_files(current_state, current_dir)
 
+    def _gallery_query(self, current_state):
+        return current_state.get("gallery_query", "") if isinstance(current_state, dict) else ""
+
+    def apply_gallery_query(self, query, current_state, current_dir=""):
+        query = (query or "").strip()
+        _, _, _, whole_tree, ignored = self._parse_gallery_query(query)
+        if ignored:
+            gr.Warning(f"Ignored filter terms: {' '.join(ignored)}")
+        if whole_tree:
+            self._start_storage_tree_scan(self._get_roots())
+            if self._storage_tree_scan_running:
+                gr.Info("Still indexing the output folders; scope=all results may be incomplete.")
+        if query and self._file_attrs_pending:
+            gr.Info(f"Still reading attributes of {len(self._file_attrs_pending)} file(s); results may be incomplete.")
+        if isinstance(current_state, dict):
+            current_state["gallery_query"] = query
+        return self.list_output_files_as_html(current_state, current_dir)
+
     def list_output_files_as_html(self, current_state, current_dir=""):
-        listing = self._build_gallery_listing(current_dir=current_dir, force_refresh=False, incremental_refresh=False)
+        self._wait_for_prewarm()
+        listing = self._build_gallery_listing(current_dir=current_dir, force_refresh=False, incremental_refresh=False, query=self._gallery_query(current_state))
+        self._remember_gallery_listing(current_state, listing)
         return self._render_gallery_from_listing(listing)
 
     def add_merge_info_to_metadata(self, configs, plugin_data, **kwargs):
+        self._last_generation_activity_ts = time.time()
         if plugin_data and "merge_info" in plugin_data:
             configs["merge_info"] = plugin_data["merge_info"]
         return configs
@@ -1140,7 +4468,7 @@ class GalleryPlugin(WAN2GPPlugin):
         except Exception:
             pass
 
-        info = self.probe_audio_ffprobe(file_path)
+        info = self._get_audio_probe_cached(file_path)
         if info:
             if "duration_s" in info:
                 values.append(f"{info['duration_s']:.2f} s")
@@ -1167,7 +4495,9 @@ class GalleryPlugin(WAN2GPPlugin):
             f"<TD><B>{v}</B></TD></TR>"
             for l, v in zip(labels, values) if v is not None
         ]
-        return f"<TABLE ID=video_info WIDTH=100%>{''.join(rows)}</TABLE>"
+        waveform = self._get_waveforms_cached([os.path.abspath(file_path)]).get(os.path.abspath(file_path))
+        waveform_html = f"<img src='data:image/jpeg;base64,{waveform}' alt='waveform' style='width:100%;'>" if waveform else ""
+        return f"{waveform_html}<TABLE ID=video_info WIDTH=100%>{''.join(rows)}</TABLE>"
 
     def get_video_info_html(self, current_state, file_path):
         configs, _, _ = self.get_settings_from_file(current_state, file_path, False, False, False)
@@ -1227,134 +4557,245 @@ class GalleryPlugin(WAN2GPPlugin):
         ]
         return f"<TABLE ID=video_info WIDTH=100%>{''.join(rows)}</TABLE>"
 
+    def _panel_spec(self, factory, key=None, **kwargs):
+        return (factory, kwargs, key)
+
+    def _panel_spec_key(self, spec):
+        factory, kwargs, key = spec
+        name = factory.__name__ if factory else None
+        return (name, key if key is not None else tuple(sorted(kwargs.items())))
+
+    def _materialize_panel_spec(self, spec):
+        factory, kwargs, _ = spec
+        kwargs = {k: (v() if callable(v) else v) for k, v in kwargs.items()}
+        return factory(**kwargs) if factory else kwargs.get("value")
+
+    def _reset_panel_state(self, current_state):
+        if isinstance(current_state, dict):
+            current_state.pop("gallery_panel_keys", None)
+
+    def _remember_gallery_listing(self, current_state, listing):
+        self._note_session_state(current_state)
+        self._reset_panel_state(current_state)
+        if isinstance(current_state, dict):
+            current_state["gallery_file_order"] = list(listing.get("file_items", []))
+            current_state["gallery_file_index"] = {p: i for i, p in enumerate(current_state["gallery_file_order"])}
+
+    def _file_info_cached(self, kind: str, file_path: str, compute):
+        abs_path = os.path.abspath(file_path)
+        sig = self._thumb_sig_from_path(abs_path)
+        key = (kind, abs_path, sig)
+        if sig:
+            with self._info_lock:
+                if key in self._file_info_cache:
+                    self._file_info_cache.move_to_end(key)
+                    return self._file_info_cache[key]
+        value = compute()
+        if sig:
+            with self._info_lock:
+                self._file_info_cache[key] = value
+                while len(self._file_info_cache) > self.INFO_CACHE_MAX_ENTRIES:
+                    self._file_info_cache.popitem(last=False)
+        return value
+
+    def _get_settings_cached(self, current_state, file_path: str):
+        def load():
+            result = self.get_settings_from_file(current_state, file_path, False, False, False)
+            configs = result[0] if result else None
+            if configs and "merge_info" in configs:
+                self._lineage_record_merge(file_path, configs["merge_info"])
+                self._save_lineage_index(force=False)
+            return result
+        return self._file_info_cached("settings", file_path, load)
+
+    def _get_video_info_cached(self, file_path: str):
+        def load():
+            # The persisted storage index holds the probe of files seen by a scan or the offline warm-up.
+            abs_path = os.path.abspath(file_path)
+            sig = self._thumb_sig_from_path(abs_path)
+            with self._thumb_lock:
+                entry = self._storage_index.get(abs_path)
+            if sig and entry is not None and (entry[1], entry[0]) == sig and entry[8] > 0 and entry[5] > 0 and entry[7] >= 0:
+                return entry[8], int(entry[5]), int(entry[6]), int(round(entry[7] * entry[8]))
+            return self.get_video_info(file_path)
+        return self._file_info_cached("video_info", file_path, load)
+
+    def _get_video_info_html_cached(self, current_state, file_path: str):
+        return self._file_info_cached("info_html", file_path, lambda: self.get_video_info_html(current_state, file_path))
+
+    def _schedule_neighbor_prefetch(self, current_state, file_path: str):
+        order = current_state.get("gallery_file_order") if isinstance(current_state, dict) else None
+        if not order or self.NEIGHBOR_PREFETCH_RADIUS <= 0:
+            return
+        idx = current_state.get("gallery_file_index", {}).get(file_path)
+        if idx is None:
+            return
+        targets = []
+        for d in range(1, self.NEIGHBOR_PREFETCH_RADIUS + 1):
+            for j in (idx + d, idx - d):
+                if 0 <= j < len(order):
+                    targets.append(order[j])
+        with self._info_lock:
+            self._neighbor_prefetch_gen += 1
+            gen = self._neighbor_prefetch_gen
+            if self._neighbor_prefetch_executor is None:
+                self._neighbor_prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gallery-neighbor-prefetch")
+        # The worker must not read the live session state while the UI keeps mutating it; the gallery's own keys are not needed there.
+        state_copy = {k: v for k, v in current_state.items() if not k.startswith("gallery_")}
+        try:
+            self._neighbor_prefetch_executor.submit(self._prefetch_neighbors, state_copy, targets, gen)
+        except Exception:
+            pass
+
+    def _prefetch_neighbors(self, current_state, targets, gen):
+        for p in targets:
+            self._wait_for_generation_idle()
+            # A newer selection supersedes this batch; its own job warms the new neighbourhood.
+            if gen != self._neighbor_prefetch_gen:
+                return
+            try:
+                if not os.path.exists(p) or self.has_audio_file_extension(p):
+                    continue
+                self._get_settings_cached(current_state, p)
+                self._get_video_info_html_cached(current_state, p)
+                if self.has_video_file_extension(p):
+                    _, _, _, frame_count = self._get_video_info_cached(p)
+                    self._get_video_frame_cached(p, 0, prefetch=False)
+                    if frame_count > 1:
+                        self._get_video_frame_cached(p, frame_count - 1, prefetch=False)
+            except Exception as e:
+                print(f"Neighbour prefetch failed for {os.path.basename(p)}: {e}")
+
     def update_metadata_panel_and_buttons(self, selection_str, current_state):
+        self._note_session_state(current_state)
         file_paths = selection_str.split('||') if selection_str else []
         video_files = [f for f in file_paths if self.has_video_file_extension(f)]
+        spec = self._panel_spec
 
-        updates = {
-            self.join_videos_btn: gr.Button(visible=len(video_files) == 2 and len(file_paths) == 2, interactive=True),
-            self.recreate_join_btn: gr.Button(visible=False),
-            self.send_to_generator_settings_btn: gr.Button(visible=False),
-            self.path_for_settings_loader: "",
-            self.preview_row: gr.Column(visible=False),
-            self.video_preview: gr.Video(visible=False, value=None),
-            self.image_preview: gr.Image(visible=False, value=None),
-            self.audio_preview: gr.Audio(visible=False, value=None),
-            self.frame_preview_row: gr.Row(visible=False),
-            self.first_frame_preview: gr.Image(value=None),
-            self.last_frame_preview: gr.Image(value=None),
-            self.join_interface: gr.Column(visible=False),
-            self.merge_info_display: gr.Column(visible=False),
-            self.metadata_panel_output: gr.HTML(value="<div class='metadata-content'><p class='placeholder'>Select a file to view its metadata.</p></div>", visible=True),
-            self.merge_source1_prompt: gr.Markdown(value=""),
-            self.merge_source1_image: gr.Image(value=None),
-            self.merge_source2_prompt: gr.Markdown(value=""),
-            self.merge_source2_image: gr.Image(value=None),
-            self.current_frame_buttons_row: gr.Row(visible=False),
-            self.current_selected_video_path: ""
+        panel = {
+            self.join_videos_btn: spec(gr.Button, visible=len(video_files) == 2 and len(file_paths) == 2, interactive=True),
+            self.recreate_join_btn: spec(gr.Button, visible=False),
+            self.send_to_generator_settings_btn: spec(gr.Button, visible=False),
+            self.path_for_settings_loader: spec(None, value=""),
+            self.preview_row: spec(gr.Column, visible=False),
+            self.video_preview: spec(gr.Video, visible=False, value=None),
+            self.image_preview: spec(gr.Image, visible=False, value=None),
+            self.audio_preview: spec(gr.Audio, visible=False, value=None),
+            self.frame_preview_row: spec(gr.Row, visible=False),
+            self.first_frame_preview: spec(gr.Image, value=None),
+            self.last_frame_preview: spec(gr.Image, value=None),
+            self.join_interface: spec(gr.Column, visible=False),
+            self.merge_info_display: spec(gr.Column, visible=False),
+            self.metadata_panel_output: spec(gr.HTML, value="<div class='metadata-content'><p class='placeholder'>Select a file to view its metadata.</p></div>", visible=True),
+            self.merge_source1_prompt: spec(gr.Markdown, value=""),
+            self.merge_source1_image: spec(gr.Image, value=None),
+            self.merge_source2_prompt: spec(gr.Markdown, value=""),
+            self.merge_source2_image: spec(gr.Image, value=None),
+            self.current_frame_buttons_row: spec(gr.Row, visible=False),
+            self.current_selected_video_path: spec(None, value="")
         }
 
+        if len(video_files) == 2 and len(file_paths) == 2:
+            for p in video_files:
+                self._get_video_sprite(p)
+
         if len(file_paths) == 1:
             file_path = file_paths[0]
-            updates[self.path_for_settings_loader] = file_path
-            configs, _, _ = self.get_settings_from_file(current_state, file_path, False, False, False)
-            updates[self.send_to_generator_settings_btn] = gr.Button(visible=True, interactive=bool(configs))
+            sig = self._thumb_sig_from_path(file_path)
+            panel[self.path_for_settings_loader] = spec(None, value=file_path)
+            configs, _, _ = self._get_settings_cached(current_state, file_path)
+            self._schedule_neighbor_prefetch(current_state, file_path)
+            panel[self.send_to_generator_settings_btn] = spec(gr.Button, visible=True, interactive=bool(configs))
             if self.has_audio_file_extension(file_path):
-                updates[self.metadata_panel_output] = gr.HTML(value=self.get_audio_info_html(file_path), visible=True)
+                panel[self.metadata_panel_output] = spec(gr.HTML, key=("audio_info", file_path, sig, os.path.abspath(file_path) in self._thumb_cache), value=lambda: self.get_audio_info_html(file_path), visible=True)
             else:
-                updates[self.metadata_panel_output] = gr.HTML(value=self.get_video_info_html(current_state, file_path), visible=True)
+                children = tuple(self._lineage_children_of(file_path))
+                panel[self.metadata_panel_output] = spec(gr.HTML, key=("video_info", file_path, sig, children), value=lambda: self._get_video_info_html_cached(current_state, file_path) + self.get_lineage_html(file_path), visible=True)
 
             if configs and "merge_info" in configs:
                 merge_info = configs["merge_info"]
-                save_path = self.server_config.get("save_path", "outputs")
-                image_save_path = self.server_config.get("image_save_path", "outputs")
                 vid1_rel, vid2_rel = merge_info['source_video_1']['path'], merge_info['source_video_2']['path']
-                vid1_abs = next((p for p in [os.path.join(save_path, vid1_rel), os.path.join(image_save_path, vid1_rel)] if os.path.exists(p)), None)
-                vid2_abs = next((p for p in [os.path.join(save_path, vid2_rel), os.path.join(image_save_path, vid2_rel)] if os.path.exists(p)), None)
+                vid1_abs, vid2_abs = self._resolve_merge_sources(merge_info)
 
                 if vid1_abs and vid2_abs:
-                    updates[self.recreate_join_btn] = gr.Button(visible=True, interactive=True)
-                    updates[self.merge_info_display] = gr.Column(visible=True)
+                    self._get_video_sprite(vid1_abs)
+                    self._get_video_sprite(vid2_abs)
+                    panel[self.recreate_join_btn] = spec(gr.Button, visible=True, interactive=True)
+                    panel[self.merge_info_display] = spec(gr.Column, visible=True)
                     f1_num, f2_num = merge_info['source_video_1']['frame_used'], merge_info['source_video_2']['frame_used']
-                    f1_pil = self.get_video_frame(vid1_abs, f1_num - 1, return_PIL=True)
-                    f2_pil = self.get_video_frame(vid2_abs, f2_num - 1, return_PIL=True)
-                    c1, _, _ = self.get_settings_from_file(current_state, vid1_abs, False, False, False)
-                    c2, _, _ = self.get_settings_from_file(current_state, vid2_abs, False, False, False)
-                    p1 = (c1.get('prompt', 'N/A') if c1 else 'N/A')
-                    p2 = (c2.get('prompt', 'N/A') if c2 else 'N/A')
-
-                    updates[self.merge_source1_prompt] = f"<b>{vid1_rel} (Frame {f1_num})</b><br>{p1[:100] + '...' if len(p1) > 100 else p1}"
-                    updates[self.merge_source1_image] = f1_pil
-                    updates[self.merge_source2_prompt] = f"<b>{vid2_rel} (Frame {f2_num})</b><br>{p2[:100] + '...' if len(p2) > 100 else p2}"
-                    updates[self.merge_source2_image] = f2_pil
+                    sig1, sig2 = self._thumb_sig_from_path(vid1_abs), self._thumb_sig_from_path(vid2_abs)
+
+                    def source_prompt(vid_abs, vid_rel, f_num):
+                        c, _, _ = self._get_settings_cached(current_state, vid_abs)
+                        p = (c.get('prompt', 'N/A') if c else 'N/A')
+                        return f"<b>{vid_rel} (Frame {f_num})</b><br>{p[:100] + '...' if len(p) > 100 else p}"
+
+                    panel[self.merge_source1_prompt] = spec(None, key=("prompt", vid1_abs, sig1, f1_num), value=lambda: source_prompt(vid1_abs, vid1_rel, f1_num))
+                    panel[self.merge_source1_image] = spec(None, key=("frame", vid1_abs, sig1, f1_num - 1), value=lambda: self._get_video_frame_cached(vid1_abs, f1_num - 1))
+                    panel[self.merge_source2_prompt] = spec(None, key=("prompt", vid2_abs, sig2, f2_num), value=lambda: source_prompt(vid2_abs, vid2_rel, f2_num))
+                    panel[self.merge_source2_image] = spec(None, key=("frame", vid2_abs, sig2, f2_num - 1), value=lambda: self._get_video_frame_cached(vid2_abs, f2_num - 1))
                 else:
-                    updates[self.preview_row] = gr.Column(visible=True)
+                    panel[self.preview_row] = spec(gr.Column, visible=True)
 
             else:
-                updates[self.preview_row] = gr.Column(visible=True)
+                panel[self.preview_row] = spec(gr.Column, visible=True)
 
                 if self.has_video_file_extension(file_path):
-                    updates[self.video_preview] = gr.Video(value=file_path, visible=True)
-                    updates[self.image_preview] = gr.Image(visible=False, value=None)
-                    updates[self.audio_preview] = gr.Audio(visible=False, value=None)
-
-                    updates[self.current_frame_buttons_row] = gr.Row(visible=True)
-                    updates[self.current_selected_video_path] = file_path
-
-                    updates[self.frame_preview_row] = gr.Row(visible=True)
-                    first_frame_pil = self.get_video_frame(file_path, 0, return_PIL=True)
-                    _, _, _, frame_count = self.get_video_info(file_path)
-                    last_frame_pil = (
-                        self.get_video_frame(file_path, frame_count - 1, return_PIL=True)
-                        if frame_count > 1 else first_frame_pil
-                    )
+                    panel[self.video_preview] = spec(gr.Video, value=self._get_video_proxy(file_path) or file_path, visible=True)
 
-                    updates[self.first_frame_preview] = gr.Image(
-                        value=first_frame_pil,
+                    panel[self.current_frame_buttons_row] = spec(gr.Row, visible=True)
+                    panel[self.current_selected_video_path] = spec(None, value=file_path)
+
+                    panel[self.frame_preview_row] = spec(gr.Row, visible=True)
+
+                    def last_frame():
+                        _, _, _, frame_count = self._get_video_info_cached(file_path)
+                        return self._get_video_frame_cached(file_path, frame_count - 1 if frame_count > 1 else 0, prefetch=False)
+
+                    panel[self.first_frame_preview] = spec(
+                        gr.Image,
+                        key=("first_frame", file_path, sig),
+                        value=lambda: self._get_video_frame_cached(file_path, 0, prefetch=False),
                         label="First Frame"
                     )
-                    updates[self.last_frame_preview] = gr.Image(
-                        value=last_frame_pil,
+                    panel[self.last_frame_preview] = spec(
+                        gr.Image,
+                        key=("last_frame", file_path, sig),
+                        value=last_frame,
                         label="Last Frame",
                         visible=True
                     )
 
                 elif self.has_image_file_extension(file_path):
-                    updates[self.image_preview] = gr.Image(
-                        value=Image.open(file_path),
+                    panel[self.image_preview] = spec(
+                        gr.Image,
+                        key=("image", file_path, sig),
+                        value=lambda: Image.open(file_path),
                         label="Image Preview",
                         visible=True
                     )
-                    updates[self.video_preview] = gr.Video(visible=False, value=None)
-                    updates[self.audio_preview] = gr.Audio(visible=False, value=None)
-
-                    updates[self.current_frame_buttons_row] = gr.Row(visible=False)
-                    updates[self.frame_preview_row] = gr.Row(visible=False)
-                    updates[self.current_selected_video_path] = ""
 
                 elif self.has_audio_file_extension(file_path):
-                    updates[self.audio_preview] = gr.Audio(
+                    panel[self.audio_preview] = spec(
+                        gr.Audio,
                         value=file_path,
                         visible=True
                     )
-                    updates[self.video_preview] = gr.Video(visible=False, value=None)
-                    updates[self.image_preview] = gr.Image(visible=False, value=None)
-
-                    updates[self.current_frame_buttons_row] = gr.Row(visible=False)
-                    updates[self.frame_preview_row] = gr.Row(visible=False)
-                    updates[self.current_selected_video_path] = ""
-
-                else:
-                    updates[self.video_preview] = gr.Video(visible=False, value=None)
-                    updates[self.image_preview] = gr.Image(visible=False, value=None)
-                    updates[self.audio_preview] = gr.Audio(visible=False, value=None)
-                    updates[self.current_frame_buttons_row] = gr.Row(visible=False)
-                    updates[self.frame_preview_row] = gr.Row(visible=False)
-                    updates[self.current_selected_video_path] = ""
 
         elif len(file_paths) > 1:
-            updates[self.metadata_panel_output] = gr.HTML(value=f"<div class='metadata-content'><p>{len(file_paths)} items selected.</p></div>", visible=True)
+            panel[self.metadata_panel_output] = spec(gr.HTML, value=f"<div class='metadata-content'><p>{len(file_paths)} items selected.</p></div>", visible=True)
 
+        # Only send components whose content differs from what this session's panel already shows.
+        prev_keys = current_state.get("gallery_panel_keys") if isinstance(current_state, dict) else None
+        new_keys = {}
+        updates = {}
+        for comp, comp_spec in panel.items():
+            k = self._panel_spec_key(comp_spec)
+            new_keys[id(comp)] = k
+            if prev_keys is None or prev_keys.get(id(comp)) != k:
+                updates[comp] = self._materialize_panel_spec(comp_spec)
+        if isinstance(current_state, dict):
+            current_state["gallery_panel_keys"] = new_keys
         return updates
 
     def load_settings_and_frames_from_gallery(self, current_state, file_path):
@@ -1372,10 +4813,10 @@ class GalleryPlugin(WAN2GPPlugin):
         configs["model_type"] = target_model_type
         first_frame, last_frame = None, None
         if self.has_video_file_extension(file_path):
-            first_frame = self.get_video_frame(file_path, 0, return_PIL=True)
+            first_frame = self._get_video_frame_cached(file_path, 0, prefetch=False)
             _, _, _, frame_count = self.get_video_info(file_path)
             if frame_count > 1:
-                last_frame = self.get_video_frame(file_path, frame_count - 1, return_PIL=True)
+                last_frame = self._get_video_frame_cached(file_path, frame_count - 1, prefetch=False)
         elif self.has_image_file_extension(file_path):
             first_frame = Image.open(file_path)
         allowed_prompts = self.get_model_def(target_model_type).get("image_prompt_types_allowed", "")
@@ -1401,16 +4842,12 @@ class GalleryPlugin(WAN2GPPlugin):
 
     def recreate_join_interface(self, file_info, current_state):
         if isinstance(file_info, str):
-            configs, _, _ = self.get_settings_from_file(current_state, file_info, False, False, False)
+            configs, _, _ = self._get_settings_cached(current_state, file_info)
             if not (configs and "merge_info" in configs):
                 gr.Warning("Could not find merge info in the selected file.")
                 return {}
             merge_info = configs["merge_info"]
-            save_path = self.server_config.get("save_path", "outputs")
-            image_save_path = self.server_config.get("image_save_path", "outputs")
-            vid1_rel, vid2_rel = merge_info['source_video_1']['path'], merge_info['source_video_2']['path']
-            vid1_abs = next((p for p in [os.path.join(save_path, vid1_rel), os.path.join(image_save_path, vid1_rel)] if os.path.exists(p)), None)
-            vid2_abs = next((p for p in [os.path.join(save_path, vid2_rel), os.path.join(image_save_path, vid2_rel)] if os.path.exists(p)), None)
+            vid1_abs, vid2_abs = self._resolve_merge_sources(merge_info)
             if not (vid1_abs and vid2_abs):
                 gr.Warning("One or both source videos for merging could not be found.")
                 return {}
@@ -1430,11 +4867,22 @@ class GalleryPlugin(WAN2GPPlugin):
         v2_fps, _, _, v2_frames = self.get_video_info(vid2_path)
 
         def create_player(container_id, slider_id, path, fps):
-            return f'<div id="{container_id}" class="video-joiner-player" data-slider-id="{slider_id}" data-fps="{fps}"><video src="{base_url}/gradio_api/file={path}" style="width:100%;" controls muted preload="metadata"></video></div>'
+            sprite = self._get_video_sprite(path)
+            sprite_attrs, sprite_html = "", ""
+            if sprite:
+                layout = sprite["layout"]
+                sprite_attrs = f' data-sprite-cols="{layout["cols"]}" data-sprite-rows="{layout["rows"]}" data-sprite-step="{layout["step"]}" data-sprite-tiles="{layout["tiles"]}"'
+                sprite_html = (
+                    f'<div class="joiner-sprite-view" style="aspect-ratio:{layout["tile_w"]}/{layout["tile_h"]};'
+                    f'background-image:url(data:image/jpeg;base64,{sprite["b64"]});'
+                    f'background-size:{layout["cols"] * 100}% {layout["rows"] * 100}%;"></div>'
+                )
+            return f'<div id="{container_id}" class="video-joiner-player" data-slider-id="{slider_id}" data-fps="{fps}"{sprite_attrs}>{sprite_html}<video src="{base_url}/gradio_api/file={path}" style="width:100%;" controls muted preload="metadata"></video></div>'
 
         player1_html = create_player("video1_player_container", "video1_frame_slider", vid1_path, v1_fps)
         player2_html = create_player("video2_player_container", "video2_frame_slider", vid2_path, v2_fps)
 
+        self._reset_panel_state(current_state)
         return {
             self.join_interface: gr.Column(visible=True),
             self.preview_row: gr.Column(visible=False),
@@ -1454,17 +4902,19 @@ class GalleryPlugin(WAN2GPPlugin):
         }
 
     def send_selected_frames_to_generator(self, vid1_path, frame1_num, vid2_path, frame2_num, current_image_prompt_type):
-        frame1 = self.get_video_frame(vid1_path, int(frame1_num) - 1, return_PIL=True)
-        frame2 = self.get_video_frame(vid2_path, int(frame2_num) - 1, return_PIL=True)
+        frame1 = self._get_video_frame_cached(vid1_path, int(frame1_num) - 1)
+        frame2 = self._get_video_frame_cached(vid2_path, int(frame2_num) - 1)
         gr.Info("Frames sent to Video Generator.")
         updated_image_prompt_type = self.add_to_sequence(current_image_prompt_type, "SE")
         merge_info = {
             "source_video_1": {
                 "path": os.path.basename(vid1_path),
+                "abs_path": os.path.abspath(vid1_path),
                 "frame_used": int(frame1_num)
             },
             "source_video_2": {
                 "path": os.path.basename(vid2_path),
+                "abs_path": os.path.abspath(vid2_path),
                 "frame_used": int(frame2_num)
             }
         }
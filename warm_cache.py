@@ -0,0 +1,79 @@
+"""Warm the gallery caches offline, without starting the Wan2GP UI.
+
+Run from the Wan2GP root directory, e.g.:
+
+    python plugins/wan2gp-gallery/warm_cache.py --workers 8
+
+Safe to run while the server is up (cache writes go through the shared
+index lock) and safe to interrupt: already cached files are skipped on
+the next run.
+"""
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import time
+
+
+def _load_gallery_plugin_class(plugin_dir):
+    spec = importlib.util.spec_from_file_location(
+        "wan2gp_gallery_offline", os.path.join(plugin_dir, "__init__.py"), submodule_search_locations=[plugin_dir]
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = package
+    spec.loader.exec_module(package)
+    return importlib.import_module(f"{spec.name}.plugin").GalleryPlugin
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-fill the File Gallery thumbnail, preview, similarity, file attribute (model, seed, media info) and lineage caches.")
+    parser.add_argument("--wan2gp-root", default=os.getcwd(), help="Wan2GP install directory (default: current directory)")
+    parser.add_argument("--config", default=None, help="server config file (default: <wan2gp-root>/wgp_config.json)")
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1), help="parallel decode workers")
+    parser.add_argument("--reconcile", action="store_true", help="first re-index or delete cache files that lost their index entry or source")
+    opts = parser.parse_args(argv)
+
+    root = os.path.abspath(opts.wan2gp_root)
+    config_file = opts.config or os.path.join(root, "wgp_config.json")
+    sys.path.insert(0, root)
+    os.chdir(root)
+
+    from shared.utils.utils import has_video_file_extension, has_image_file_extension, has_audio_file_extension, get_video_info
+
+    server_config = {}
+    if os.path.exists(config_file):
+        with open(config_file, "r", encoding="utf-8") as f:
+            server_config = json.load(f)
+
+    GalleryPlugin = _load_gallery_plugin_class(os.path.dirname(os.path.abspath(__file__)))
+    plugin = GalleryPlugin()
+    plugin.server_config = server_config
+    plugin.has_video_file_extension = has_video_file_extension
+    plugin.has_image_file_extension = has_image_file_extension
+    plugin.has_audio_file_extension = has_audio_file_extension
+    plugin.get_video_info = get_video_info
+
+    started = time.time()
+
+    def report(done, total, scanned):
+        if total == 0:
+            print(f"All {scanned} files are already cached.")
+            return
+        elapsed = time.time() - started
+        print(f"[{done}/{total}] {done * 100 // total}% of uncached files ({scanned} scanned), {elapsed:.0f}s elapsed", flush=True)
+
+    try:
+        if opts.reconcile:
+            stats = plugin.reconcile_gallery_cache(pause=0)
+            print("Cache reconciled: " + ", ".join(f"{v} {k}" for k, v in stats.items()))
+        plugin.warm_gallery_caches(workers=opts.workers, progress=report)
+    except KeyboardInterrupt:
+        print("Interrupted; progress so far is saved, rerun to resume.")
+        return 130
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())